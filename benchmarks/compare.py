@@ -0,0 +1,37 @@
+"""
+Compares two benchmark results: python -m benchmarks.compare old.json new.json
+"""
+import sys
+import json
+
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values |= flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+    return values
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__.strip(), file=sys.stderr)
+        sys.exit(1)
+    with open(sys.argv[1]) as old_file, open(sys.argv[2]) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print(f'{"":44} {old["commit"] or "old":>14} {new["commit"] or "new":>14} {"change":>8}')
+    old_values, new_values = flatten(old), flatten(new)
+    for key, old_value in old_values.items():
+        if key.startswith('params.') or key == 'timestamp':
+            continue
+        new_value = new_values.get(key)
+        if new_value is None:
+            continue
+        change = f'{(new_value - old_value) / old_value:+.1%}' if old_value else ''
+        print(f'{key:44} {old_value:>14} {new_value:>14} {change:>8}')
+
+
+if __name__ == '__main__':
+    main()
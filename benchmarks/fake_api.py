@@ -0,0 +1,110 @@
+import re
+import json
+import time
+from collections import Counter
+from aiohttp import web
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'Guardian', 'username': 'guardian_bench_bot'}
+USER_ID_RE = re.compile(r'tg://user\?id=(\d+)')
+
+
+class FakeTelegram:
+    """
+    Minimal stand-in for Bot API server, answers every method the bot calls.
+    Counts calls by method, keeps the last message sent to every chat and the captchas sent to every user.
+    """
+
+    def __init__(self, admin_ids: set[int]):
+        self.admin_ids = admin_ids
+        self.calls = Counter()
+        self.message_id = 0
+        self.last_messages = {}
+        # (chat_id, user_id) -> (time received, sent message)
+        self.captchas = {}
+
+    def routes(self) -> list[web.RouteDef]:
+        return [web.post('/bot{token}/{method}', self.handle)]
+
+    def new_message(self, fields) -> dict:
+        self.message_id += 1
+        chat_id = int(fields['chat_id'])
+        message = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f'Chat {chat_id}'},
+            'from': BOT_USER
+        }
+        if 'reply_markup' in fields:
+            message['reply_markup'] = json.loads(fields['reply_markup'])
+        self.last_messages[chat_id] = message
+        return message
+
+    def send_photo(self, fields) -> dict:
+        received = time.perf_counter()
+        message = self.new_message(fields)
+        message['caption'] = fields.get('caption', '')
+        file_id = f'photo-{message["message_id"]}'
+        message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 240}]
+        # Captcha shared by raid newcomers mentions all of them
+        for user_id in USER_ID_RE.findall(message['caption']):
+            self.captchas[(message['chat']['id'], int(user_id))] = (received, message)
+        return message
+
+    def send_message(self, fields) -> dict:
+        message = self.new_message(fields)
+        message['text'] = fields.get('text', '')
+        return message
+
+    def get_chat_administrators(self, _fields) -> list[dict]:
+        return [{'status': 'creator', 'is_anonymous': False,
+                 'user': {'id': user_id, 'is_bot': False, 'first_name': 'Admin'}}
+                for user_id in self.admin_ids]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        fields = await request.post()
+        match method:
+            case 'getMe':
+                result = BOT_USER
+            case 'sendPhoto':
+                result = self.send_photo(fields)
+            case 'sendMessage':
+                result = self.send_message(fields)
+            case 'getChatAdministrators':
+                result = self.get_chat_administrators(fields)
+            case _:
+                result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+class FakeQwant:
+    """
+    Image search stub returning thumbnails served by itself.
+    """
+
+    def __init__(self, base_url: str, images: int = 50):
+        self.base_url = base_url
+        self.images = images
+        self.calls = 0
+
+    def routes(self) -> list[web.RouteDef]:
+        return [web.get('/v3/search/images', self.search), web.get('/images/{name}', self.image)]
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        query = request.query.get('q', '')
+        items = [{'thumbnail': f'{self.base_url}/images/{abs(hash((query, i)))}.jpg'} for i in range(self.images)]
+        return web.json_response({'status': 'success', 'data': {'result': {'items': items}}})
+
+    async def image(self, _request: web.Request) -> web.Response:
+        return web.Response(body=b'\xff\xd8\xff\xd9', content_type='image/jpeg')
+
+
+async def start_server(telegram: FakeTelegram, qwant: FakeQwant, host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.add_routes(telegram.routes() + qwant.routes())
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port, backlog=1024).start()
+    return runner
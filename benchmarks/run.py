@@ -0,0 +1,337 @@
+"""
+End-to-end load test of the bot against local fake Telegram Bot API, Qwant stub and Redis.
+
+Run from the repository root:
+
+    python -m benchmarks.run --chats 50 --joins-per-chat 20
+
+Without --redis-url an in-process fake Redis server (fakeredis) is used.
+Results are saved as JSON, compare two runs with `python -m benchmarks.compare old.json new.json`.
+"""
+import sys
+import copy
+import json
+import time
+import random
+import asyncio
+import argparse
+import sqlite3
+import resource
+import tempfile
+import subprocess
+import statistics
+import yaml
+from pathlib import Path
+from aiogram import Bot, Dispatcher, types
+from guardian import qwant, app as guardian_app
+from guardian.app import App
+from guardian.maintenance import migrations
+from guardian.redis import Redis
+from guardian.util import AttrDict
+from benchmarks.fake_api import FakeTelegram, FakeQwant, start_server
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = ROOT.joinpath('benchmarks', 'results')
+TOKEN = '123456:benchmark'
+ADMIN_ID = 1
+FIRST_USER_ID = 100000
+
+
+class Scenario:
+    def __init__(self, name: str):
+        self.name = name
+        self.updates = 0
+        self.seconds = 0.0
+        self.latencies = []
+
+    def result(self) -> dict:
+        result = {
+            'updates': self.updates,
+            'seconds': round(self.seconds, 4),
+            'updates_per_second': round(self.updates / self.seconds, 1) if self.seconds else None
+        }
+        if len(self.latencies) >= 2:
+            percentiles = statistics.quantiles(self.latencies, n=100, method='inclusive')
+            result['latency_p50'] = round(percentiles[49], 6)
+            result['latency_p99'] = round(percentiles[98], 6)
+        return result
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace, app: App, telegram: FakeTelegram):
+        self.args = args
+        self.app = app
+        self.telegram = telegram
+        self.random = random.Random(args.seed)
+        self.update_id = 0
+        self.message_id = 0
+
+    def chat(self, chat_id: int) -> dict:
+        return {'id': chat_id, 'type': 'supergroup', 'title': f'Chat {chat_id}'}
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+
+    def update(self, **fields) -> types.Update:
+        self.update_id += 1
+        return types.Update(update_id=self.update_id, **fields)
+
+    def message(self, chat_id: int, user_id: int, **fields) -> types.Update:
+        self.message_id += 1
+        return self.update(message={
+            'message_id': self.message_id, 'date': int(time.time()),
+            'chat': self.chat(chat_id), 'from': self.user(user_id), **fields
+        })
+
+    def callback_query(self, user_id: int, message: dict, data: str) -> types.Update:
+        return self.update(callback_query={
+            'id': str(self.update_id), 'from': self.user(user_id), 'chat_instance': str(message['chat']['id']),
+            'message': message, 'data': data
+        })
+
+    async def dispatch(self, updates: list[types.Update], on_start=None):
+        """
+        Processes updates in batches like polling does, at most `concurrency` batches at a time.
+        """
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        size = self.args.batch
+
+        async def process(batch):
+            async with semaphore:
+                if on_start is not None:
+                    on_start(batch)
+                await self.app.dp.process_updates(batch)
+
+        await asyncio.gather(*(process(updates[i:i + size]) for i in range(0, len(updates), size)))
+
+    async def join_storm(self) -> Scenario:
+        scenario = Scenario('join_storm')
+        joins, started = [], {}
+        for i in range(self.args.joins_per_chat):
+            for chat in range(self.args.chats):
+                user = self.user(FIRST_USER_ID + chat * self.args.joins_per_chat + i)
+                joins.append(self.message(-1000 - chat, user['id'], new_chat_members=[user]))
+
+        def on_start(batch):
+            now = time.perf_counter()
+            for update in batch:
+                started[(update.message.chat.id, update.message.from_user.id)] = now
+
+        start = time.perf_counter()
+        await self.dispatch(joins, on_start)
+        # Wait for shared captchas of raided chats
+        while self.app.joins.batches or self.app.joins.tasks:
+            await asyncio.sleep(0.01)
+        scenario.seconds = time.perf_counter() - start
+        scenario.updates = len(joins)
+        for key, begin in started.items():
+            captcha = self.telegram.captchas.get(key)
+            if captcha is not None:
+                scenario.latencies.append(captcha[0] - begin)
+        return scenario
+
+    async def correct_button(self, chat_id: int, user_id: int, buttons: list[str]) -> str | None:
+        signer = self.app.signer
+        if signer is not None:
+            for button in buttons:
+                answer = signer.verify(button, chat_id, user_id)
+                if answer is not None and answer.correct:
+                    return button
+        data = await self.app.dp.storage.get_data(chat=chat_id, user=user_id)
+        return data.get('answer')
+
+    async def captcha_answers(self) -> Scenario:
+        scenario = Scenario('captcha_answers')
+        answers = []
+        for (chat_id, user_id), (_, message) in self.telegram.captchas.items():
+            buttons = [button['callback_data']
+                       for row in message['reply_markup']['inline_keyboard'] for button in row]
+            correct = await self.correct_button(chat_id, user_id, buttons)
+            if correct is None:
+                continue
+            if self.random.random() < self.args.correct_ratio:
+                answer = correct
+            else:
+                answer = self.random.choice([b for b in buttons if b != correct])
+            answers.append(self.callback_query(user_id, message, answer))
+        self.random.shuffle(answers)
+
+        start = time.perf_counter()
+        await self.dispatch(answers)
+        scenario.seconds = time.perf_counter() - start
+        scenario.updates = len(answers)
+        return scenario
+
+    async def settings_wizard(self, chat_id: int):
+        text = '/settings'
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        steps = [
+            lambda: self.message(chat_id, ADMIN_ID, text=text, entities=entities),
+            # Ban channels: Yes / No
+            lambda: self.callback_query(ADMIN_ID, self.telegram.last_messages[chat_id], '2'),
+            lambda: self.callback_query(ADMIN_ID, self.telegram.last_messages[chat_id],
+                                        self.random.choice(['0', '1']))
+        ]
+        for step in steps:
+            await self.app.dp.process_updates([step()])
+        return len(steps)
+
+    async def settings_wizards(self) -> Scenario:
+        scenario = Scenario('settings_wizard')
+        chats = [-2000 - i for i in range(self.args.settings_chats)]
+        start = time.perf_counter()
+        for _ in range(self.args.settings_rounds):
+            steps = await asyncio.gather(*(self.settings_wizard(chat_id) for chat_id in chats))
+            scenario.updates += sum(steps)
+        scenario.seconds = time.perf_counter() - start
+        return scenario
+
+    async def chat_messages(self) -> Scenario:
+        scenario = Scenario('chat_messages')
+        messages = []
+        for i in range(self.args.messages_per_chat):
+            for chat in range(self.args.chats):
+                user_id = FIRST_USER_ID + chat * self.args.joins_per_chat + i % self.args.joins_per_chat
+                messages.append(self.message(-1000 - chat, user_id, text=f'Message {i}'))
+
+        start = time.perf_counter()
+        await self.dispatch(messages)
+        scenario.seconds = time.perf_counter() - start
+        scenario.updates = len(messages)
+        return scenario
+
+    async def run(self) -> list[Scenario]:
+        return [await self.join_storm(), await self.captcha_answers(), await self.settings_wizards(),
+                await self.chat_messages()]
+
+
+def make_config(args: argparse.Namespace, base_url: str, redis_url: str, db_path: str) -> AttrDict:
+    with open(args.config, 'r') as stream:
+        config = yaml.safe_load(stream)
+    config = copy.deepcopy(config)
+    config['telegram'] = {'token': TOKEN, 'api_server': base_url}
+    config['metrics']['enabled'] = False
+    config['redis']['url'] = redis_url
+    config['database']['path'] = db_path
+    config['images']['providers'] = ['qwant']
+    config['log_level'] = args.log_level
+    config['log_queue'] = False
+    config['guardian']['signed_answers'] = args.signed_answers
+    if not args.rate_limits:
+        config['outbound'] = {'global_rate': 1e6, 'chat_rate': 1e6, 'chat_burst': 1e6}
+    return AttrDict(config)
+
+
+class FakeRedis(Redis):
+    """
+    Redis client connected to in-process fakeredis server instead of `url`.
+    """
+
+    @staticmethod
+    def create_pool(_url: str, _max_connections: int):
+        from fakeredis import FakeServer
+        from fakeredis.aioredis import FakeRedis as FakeRedisClient
+
+        return FakeRedisClient(server=FakeServer(), decode_responses=True).connection_pool
+
+
+def git_commit() -> str | None:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+async def run(args: argparse.Namespace) -> dict:
+    base_url = f'http://{args.host}:{args.port}'
+    telegram = FakeTelegram({ADMIN_ID})
+    fake_qwant = FakeQwant(base_url)
+    runner = await start_server(telegram, fake_qwant, args.host, args.port)
+    qwant.URL = f'{base_url}/v3/search/images'
+
+    redis_url = args.redis_url
+    if redis_url is None:
+        guardian_app.Redis = FakeRedis
+        redis_url = 'redis://fakeredis'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp).joinpath('data.db')
+        with sqlite3.connect(db_path) as db:
+            for _, migration in migrations():
+                db.executescript(migration.read_text())
+
+        app = App(make_config(args, base_url, redis_url, str(db_path)))
+        if args.no_fast_path:
+            app.dp.is_relevant = None
+        Bot.set_current(app.bot)
+        Dispatcher.set_current(app.dp)
+        await app.on_startup(app.dp)
+        # Let the captcha pool fill up, as it would be long before the first join in production
+        await app.pool.fill()
+        calls_before = telegram.calls.copy()
+        try:
+            scenarios = await Benchmark(args, app, telegram).run()
+        finally:
+            await app.on_shutdown(app.dp)
+            await (await app.bot.get_session()).close()
+            await runner.cleanup()
+
+    return {
+        'commit': git_commit(),
+        'timestamp': int(time.time()),
+        'python': sys.version.split()[0],
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'config', 'redis_url')},
+        'redis': 'fakeredis' if args.redis_url is None else 'redis-server',
+        'scenarios': {scenario.name: scenario.result() for scenario in scenarios},
+        'api_calls': dict(sorted((telegram.calls - calls_before).items())),
+        'image_searches': fake_qwant.calls,
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', default=ROOT.joinpath('config.example.yaml'),
+                        help='Base configuration, servers, paths and logging are overridden.')
+    parser.add_argument('-o', '--output', help='Path of JSON results, saved to benchmarks/results/ by default.')
+    parser.add_argument('--redis-url', help='Use real Redis server, its database gets polluted with test data.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='Port of fake Bot API and Qwant server.')
+    parser.add_argument('--chats', type=int, default=20, help='Number of chats in join storm.')
+    parser.add_argument('--joins-per-chat', type=int, default=20, help='Number of new members per chat.')
+    parser.add_argument('--correct-ratio', type=float, default=0.8, help='Share of correct captcha answers.')
+    parser.add_argument('--settings-chats', type=int, default=20,
+                        help='Number of chats running settings wizard concurrently.')
+    parser.add_argument('--settings-rounds', type=int, default=5, help='Number of settings wizards per chat.')
+    parser.add_argument('--messages-per-chat', type=int, default=100,
+                        help='Number of ordinary messages per chat after join storm.')
+    parser.add_argument('--batch', type=int, default=100, help='Updates per batch, as in getUpdates.')
+    parser.add_argument('--concurrency', type=int, default=4, help='Max number of batches processed at once.')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='Keep outbound rate limits of the base configuration, no limits by default.')
+    parser.add_argument('--signed-answers', action='store_true', help='Verify captcha answers by signed buttons.')
+    parser.add_argument('--no-fast-path', action='store_true',
+                        help='Dispatch every update instead of dropping irrelevant ones first.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='error')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR.joinpath(f'{results["timestamp"]}-{results["commit"] or "unknown"}.json')
+    with open(output, 'w') as stream:
+        json.dump(results, stream, indent=2)
+    json.dump(results, sys.stdout, indent=2)
+    print(f'\nSaved to {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,93 @@
+from __future__ import annotations
+import time
+
+STARTED = time.perf_counter()
+
 import sys
+import asyncio
 import argparse
-import yaml
 from pathlib import Path
-from guardian.app import App
-from guardian.util import AttrDict
+from typing import TYPE_CHECKING
+from guardian.startup import StartupProfile
+
+if TYPE_CHECKING:
+    from guardian.util import AttrDict
+
+
+def load_config(file: Path) -> AttrDict:
+    import yaml
+    from guardian import config
+
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(file, 'r') as stream:
+        return config.from_dict(yaml.load(stream, Loader=loader))
+
+
+async def populate_corpus(config: AttrDict, args: argparse.Namespace):
+    from guardian import http
+    from guardian.corpus import Corpus, populate
+    from guardian.images import create_provider
+
+    client = http.from_config(config.http)
+    provider = create_provider([args.provider], client, config.images.corpus_path)
+    try:
+        await populate(Corpus(config.images.corpus_path), provider, client, args.per_query, args.concurrency)
+    finally:
+        await provider.close()
+        await client.close()
+
+
+def create_app(config: AttrDict, profile: StartupProfile):
+    with profile.phase('import guardian.app'):
+        from guardian.app import App
+    with profile.phase('create app'):
+        return App(config, profile)
 
 
 def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', default='config.yaml', help='Path to configuration file.')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Log durations of imports and startup phases once the bot accepts updates.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.add_parser('run', help='Run the bot (default).')
+    subparsers.add_parser('receive', help='Receive updates via webhook and add them to Redis Streams.')
+    worker = subparsers.add_parser('worker', help='Process updates from Redis Streams.')
+    worker.add_argument('--metrics-port', type=int, help='Port of metrics server, overrides metrics.port.')
+    corpus = subparsers.add_parser('corpus', help='Manage local image corpus.')
+    corpus_commands = corpus.add_subparsers(dest='corpus_command', metavar='command', required=True)
+    populate_parser = corpus_commands.add_parser('populate', help='Download images for every query phrase.')
+    populate_parser.add_argument('-p', '--provider', default='qwant', help='Image provider to download from.')
+    populate_parser.add_argument('-n', '--per-query', type=int, default=10,
+                                 help='Number of images to have for every query phrase.')
+    populate_parser.add_argument('-j', '--concurrency', type=int, default=4,
+                                 help='Number of query phrases processed concurrently.')
+    db = subparsers.add_parser('db', help='Manage settings database.')
+    db_commands = db.add_subparsers(dest='db_command', metavar='command', required=True)
+    db_commands.add_parser('migrate', help='Apply pending migrations.')
+    export_parser = db_commands.add_parser('export', help='Export settings.')
+    export_parser.add_argument('file', help='Path of output file, - for stdout.')
+    export_parser.add_argument('-f', '--format', choices=('jsonl', 'csv'),
+                               help='File format, guessed from file extension by default.')
+    import_parser = db_commands.add_parser('import', help='Import settings, overwriting existing values.')
+    import_parser.add_argument('file', help='Path of input file, - for stdin.')
+    import_parser.add_argument('-f', '--format', choices=('jsonl', 'csv'),
+                               help='File format, guessed from file extension by default.')
+    import_parser.add_argument('--chunk-size', type=int, default=10000, help='Number of rows per transaction.')
+    import_parser.add_argument('--no-notify', dest='notify', action='store_false',
+                               help="Don't update settings cached by running bot instances.")
+    vacuum_parser = db_commands.add_parser('vacuum', help='Rebuild database file to reclaim free space.')
+    vacuum_parser.add_argument('--into', help='Write compacted copy to this path instead, without blocking the bot.')
+    report_parser = subparsers.add_parser('report', help='Show captcha solve rates and answer latencies.')
+    report_parser.add_argument('--by', choices=('query', 'chat'), default='query', help='Group events by.')
+    report_parser.add_argument('-d', '--days', type=float, default=30, help='Only events of that many last days.')
+    report_parser.add_argument('-n', '--limit', type=int, default=0,
+                               help='Show only that many rows with the lowest solve rates, 0 shows all.')
+    report_parser.add_argument('--fast', type=float, default=2,
+                               help='Correct answers faster than that many seconds are counted as suspicious.')
+    ignores_parser = subparsers.add_parser('ignores', help='Show ignored users and their memory usage per chat.')
+    ignores_parser.add_argument('-n', '--limit', type=int, default=0,
+                                help='Show only that many chats with the most ignored users, 0 shows all.')
     args = parser.parse_args()
     config_file = Path(args.config)
 
@@ -19,10 +98,43 @@ def cli():
         print(f'File not found: {config_file}', file=sys.stderr)
         sys.exit(1)
 
-    with open(config_file, 'r') as stream:
-        config = AttrDict(yaml.safe_load(stream))
+    profile = StartupProfile(STARTED, args.profile_startup)
+    profile.import_dependencies()
+    with profile.phase('load config'):
+        config = load_config(config_file)
+
+    match args.command:
+        case 'corpus':
+            from guardian import log
+
+            log.init(config.log_level, config.log_format)
+            asyncio.run(populate_corpus(config, args))
+        case 'db':
+            from guardian import log, maintenance
+
+            log.init(config.log_level, config.log_format)
+            sys.exit(asyncio.run(maintenance.run(config, args)))
+        case 'report':
+            from guardian import log, events
+
+            log.init(config.log_level, config.log_format)
+            sys.exit(asyncio.run(events.run_report(config, args)))
+        case 'ignores':
+            from guardian import log, redis
 
-    App(config).start()
+            log.init(config.log_level, config.log_format)
+            sys.exit(asyncio.run(redis.run_ignore_stats(config, args)))
+        case 'receive':
+            if 'webhook_host' not in config.telegram:
+                print('receive command requires telegram.webhook_host setting', file=sys.stderr)
+                sys.exit(1)
+            create_app(config, profile).start_receiver()
+        case 'worker':
+            if args.metrics_port is not None:
+                config.metrics.port = args.metrics_port
+            create_app(config, profile).start_worker()
+        case _:
+            create_app(config, profile).start()
 
 
 if __name__ == '__main__':
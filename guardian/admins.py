@@ -0,0 +1,83 @@
+import json
+import time
+import asyncio
+from aiogram import Bot
+from redis.exceptions import RedisError
+from guardian.cache import ChatCache
+from guardian.redis import Redis
+from guardian.util import log_exception
+
+# Redis pub/sub channel announcing chats which administrators changed.
+CHANNEL = 'admins'
+
+
+def admins_key(chat_id: int) -> str:
+    return f'admins:{chat_id}'
+
+
+class AdminCache:
+    """
+    IDs of chat administrators kept for `ttl` seconds in LRU cache of at most `max_size` chats
+    and, if `redis` is given, in Redis shared by all bot instances.
+    Entries older than half of `ttl` are refreshed in the background, so checks rarely wait for Bot API.
+    Concurrent loads of the same chat are collapsed into one request.
+    """
+
+    def __init__(self, bot: Bot, redis: Redis | None, ttl: int, max_size: int):
+        self.bot = bot
+        self.redis = None if redis is None else redis.redis
+        self.ttl = ttl
+        # Chat ID -> (monotonic time admins were fetched, admin IDs)
+        self.cache = ChatCache('admins', self.fetch, max_size)
+
+    async def get(self, chat_id: int) -> frozenset[int]:
+        now = time.monotonic()
+        fetched, admins = await self.cache.get_or_load(chat_id, lambda entry: now - entry[0] < self.ttl)
+        if now - fetched >= self.ttl / 2:
+            self.cache.load(chat_id).add_done_callback(self.refreshed)
+        return admins
+
+    @staticmethod
+    def refreshed(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            log_exception(future.exception())
+
+    async def is_admin(self, chat_id: int, user_id: int) -> bool:
+        return user_id in await self.get(chat_id)
+
+    async def fetch(self, chat_id: int) -> tuple[float, frozenset[int]]:
+        key = admins_key(chat_id)
+        if self.redis is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                value, ttl = await pipe.execute()
+            # Refresh entries due for it rather than copying them
+            age = self.ttl - ttl / 1000
+            if value is not None and age < self.ttl / 2:
+                return time.monotonic() - age, frozenset(json.loads(value))
+        members = await self.bot.get_chat_administrators(chat_id)
+        admins = frozenset(member.user.id for member in members)
+        if self.redis is not None:
+            await self.redis.set(key, json.dumps(sorted(admins)), ex=self.ttl)
+        return time.monotonic(), admins
+
+    async def invalidate(self, chat_id: int):
+        self.cache.forget(chat_id)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.delete(admins_key(chat_id))
+            await self.redis.publish(CHANNEL, chat_id)
+        except RedisError as e:
+            log_exception(e)
+
+    def handle_message(self, data: str):
+        self.cache.forget(int(data))
+
+    def start(self):
+        if self.redis is not None:
+            self.cache.start(self.redis, CHANNEL, self.handle_message)
+
+    async def stop(self):
+        await self.cache.stop()
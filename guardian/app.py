@@ -1,18 +1,38 @@
+import time
 import asyncio
-from aiogram import Bot, Dispatcher, executor, types
-from aiogram.types import ChatType, ContentType, Message
+from collections import OrderedDict
+from typing import Awaitable
+from aiohttp import web
+from aiogram import Bot as BaseBot, Dispatcher as BaseDispatcher, executor, types
+from aiogram.types import ChatPermissions, ChatType, ContentType, Message
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.utils.executor import start_webhook
-from aiogram.utils.exceptions import TelegramAPIError
-from guardian import qwant, qna, log
+from aiogram.utils.executor import set_webhook
+from aiogram.utils.exceptions import TelegramAPIError, BadRequest
+from guardian import log, metrics
+from guardian.bot import Bot, api_server, webhook_url, webhook_secret, check_secret_token
+from guardian.dispatcher import Dispatcher
+from guardian.inbound import ChatExecutor
+from guardian.outbound import OutboundQueue, ObsoleteRequestError, drop_if
 from guardian.database import Database
 from guardian.settings import Settings, Setting
 from guardian.redis import Redis
-from guardian.filters import UsernameFilter
-from guardian.util import emoji_keyboard, settings_keyboard, get_user_tag, callback, log_exception, AttrDict
+from guardian.storage import RedisStorage
+from guardian.scheduler import Scheduler
+from guardian import http
+from guardian.images import create_provider
+from guardian.pool import CaptchaPool, Captcha
+from guardian.file_cache import FileIdCache
+from guardian.raid import JoinBatcher
+from guardian.catchup import fetch_backlog, catch_up
+from guardian.signing import AnswerSigner, TOKEN_PREFIX
+from guardian.filters import UsernameFilter, ChatAdminFilter, CHANNEL_BOT, is_channel_message
+from guardian.admins import AdminCache
+from guardian.events import CaptchaEvents, SHOWN, CORRECT, WRONG, TIMEOUT
+from guardian.maintenance import migrate
+from guardian.startup import StartupProfile
+from guardian.util import settings_keyboard, get_user_tag, log_exception, AttrDict
 from guardian.i18n import I18nMiddleware
 
 PERMISSIVE_ATTRIBUTES = {
@@ -21,7 +41,12 @@ PERMISSIVE_ATTRIBUTES = {
     'can_send_other_messages': True,
     'can_add_web_page_previews': True
 }
+RESTRICTIVE_PERMISSIONS = ChatPermissions(can_send_messages=False)
 CHAT_TYPE = [ChatType.GROUP, ChatType.SUPERGROUP]
+# Max number of newcomers restricted at once.
+RESTRICT_CONCURRENCY = 8
+# Max number of remembered members who left, used to drop messages addressed to them.
+MAX_DEPARTED = 10000
 
 
 class CaptchaState(StatesGroup):
@@ -34,27 +59,62 @@ class SettingsState(StatesGroup):
 
 
 class App:
-    def __init__(self, config: AttrDict):
+    def __init__(self, config: AttrDict, profile: StartupProfile | None = None):
         global logger
 
-        logger = log.init(config.log_level)
-        storage = MemoryStorage()
+        logger = log.init(config.log_level, config.log_format, config.log_queue, config.log_rate_limit)
+        self.redis = Redis(config.redis.url)
+        # Outlive captcha timeout, so after_captcha_timeout still finds the state
+        storage = RedisStorage(self.redis, ttl=config.guardian.captcha_expire * 2)
         self.use_webhook = 'webhook_host' in config.telegram
-        self.bot = Bot(token=config.telegram.token, parse_mode=types.ParseMode.HTML)
-        self.dp = Dispatcher(self.bot, storage=storage)
+        self.outbound = OutboundQueue(config.outbound.global_rate, config.outbound.chat_rate,
+                                      config.outbound.chat_burst)
+        self.bot = Bot(token=config.telegram.token, parse_mode=types.ParseMode.HTML,
+                       server=api_server(config.telegram),
+                       outbound=self.outbound)
+        self.inbound = ChatExecutor(config.inbound.concurrency, config.inbound.queue_size, config.inbound.overflow)
+        self.dp = Dispatcher(self.bot, storage=storage, inbound=self.inbound, is_relevant=self.is_relevant)
         self.dp.middleware.setup(LoggingMiddleware(logger))
-        self.dp.middleware.setup(I18nMiddleware(self.lang))
-        self.settings = Settings(Database())
-        self.redis = Redis(config.redis.url)
+        self.i18n = I18nMiddleware(self.lang)
+        self.dp.middleware.setup(self.i18n)
+        self.dp.middleware.setup(metrics.MetricsMiddleware())
+        self.metrics_runner = None
+        # Set when started with `start`, other modes get updates from elsewhere
+        self.catch_up = False
+        self.backlog = None
+        self.loop_lag = None
+        self.db = Database(config.database.path, config.database.flush_interval)
+        self.settings = Settings(self.db, self.redis, config.guardian.settings_cache_size)
+        self.events = CaptchaEvents(self.db, config.events.buffer_size, config.events.flush_interval)
+        self.admins = AdminCache(self.bot, self.redis if config.admins.redis else None, config.admins.ttl,
+                                 config.admins.cache_size)
+        self.scheduler = Scheduler(self.redis, config.scheduler.interval, config.scheduler.batch,
+                                   config.scheduler.lease)
+        self.scheduler.register('delete_message', self.delete_message)
+        self.scheduler.register('captcha_timeout', self.after_captcha_timeout)
+        self.scheduler.register('shared_captcha_timeout', self.after_shared_captcha_timeout)
+        self.restrictions = asyncio.Semaphore(RESTRICT_CONCURRENCY)
+        self.joins = JoinBatcher(self.show_shared_captcha)
+        self.departed = OrderedDict()
+        self.signer = None
+        if config.guardian.signed_answers:
+            self.signer = AnswerSigner(config.guardian.answer_secret)
+        self.file_ids = FileIdCache(self.redis, config.redis.file_id_cache_size)
+        self.http = http.from_config(config.http)
+        self.provider = create_provider(config.images.providers, self.http, config.images.corpus_path)
+        self.pool = CaptchaPool(self.provider, config.pool.size, config.pool.low_watermark, config.pool.max_uses)
         self.config = config
+        self.profile = profile or StartupProfile(time.perf_counter(), enabled=False)
         self.dp.filters_factory.bind(UsernameFilter, event_handlers=[self.dp.message_handlers])
-        chat_admin = {'chat_type': CHAT_TYPE, 'is_chat_admin': True}
+        self.dp.filters_factory.bind(ChatAdminFilter,
+                                     event_handlers=[self.dp.message_handlers, self.dp.callback_query_handlers])
+        chat_admin = {'chat_type': CHAT_TYPE, 'chat_admins': self.admins}
         self.dp.register_message_handler(self.handle_new_chat_member,
                                          content_types=ContentType.NEW_CHAT_MEMBERS,
                                          chat_type=CHAT_TYPE)
 
         self.dp.register_message_handler(self.handle_channel_message,
-                                         username='Channel_Bot',
+                                         username=CHANNEL_BOT,
                                          chat_type=CHAT_TYPE)
 
         self.dp.register_message_handler(self.handle_left_chat_member,
@@ -69,6 +129,13 @@ class App:
                                          state=SettingsState.value,
                                          **chat_admin)
 
+        if self.signer is not None:
+            # Signed answers don't need user state, so the handler goes first and skips reading it
+            self.dp.register_callback_query_handler(self.handle_signed_captcha_response,
+                                                    lambda query: query.data.startswith(TOKEN_PREFIX),
+                                                    state='*',
+                                                    chat_type=CHAT_TYPE)
+
         self.dp.register_callback_query_handler(self.handle_inline_kb_captcha_response,
                                                 state=CaptchaState.show,
                                                 chat_type=CHAT_TYPE)
@@ -83,24 +150,84 @@ class App:
 
         self.dp.register_callback_query_handler(self.handle_inline_keyboard)
 
+        self.dp.register_chat_member_handler(self.handle_chat_member)
+        self.dp.register_my_chat_member_handler(self.handle_chat_member)
+        storage.watch(self.dp.message_states())
+
+    def is_relevant(self, update: types.Update) -> bool:
+        """
+        Cheap check run before middlewares and filters, tells apart messages no handler would take:
+        ordinary messages of chats without users in a state some message handler waits for.
+        """
+        message = update.message
+        if message is None:
+            return True
+        if message.new_chat_members or message.left_chat_member is not None or is_channel_message(message):
+            return True
+        if message.text is not None and message.text.startswith('/'):
+            return True
+        return self.dp.storage.is_waiting(message.chat.id)
+
     @staticmethod
     def format_errors(errors: list[str], i18n) -> str:
         return i18n.t('errors.validation_error', errors='\n'.join(errors))
 
-    def lang(self, chat_id: int):
-        return self.settings.get(chat_id, Setting.LANGUAGE)
+    async def lang(self, chat_id: int):
+        return await self.settings.get(chat_id, Setting.LANGUAGE)
+
+    @staticmethod
+    def captcha_job_id(chat_id: int, user_id: int, message_id: int) -> str:
+        return f'captcha:{chat_id}:{user_id}:{message_id}'
+
+    async def delete_message(self, chat_id: int, message_id: int):
+        try:
+            await self.bot.delete_message(chat_id, message_id)
+        except TelegramAPIError as e:
+            # Message can be already deleted by another admin or by previous run of the same job
+            log_exception(e)
 
-    # TODO: can throw exception if another admin deletes the message
     async def send_temp_message(self, chat_id: int, text: str, expire: int | float | None = None):
         if expire is None:
             expire = self.config.guardian.message_expire
         msg = await self.bot.send_message(chat_id, text)
-        cb = callback(self.bot.delete_message, chat_id, msg.message_id)
-        asyncio.get_running_loop().call_later(expire, cb)
-
-    async def after_captcha_timeout(self, state: FSMContext, chat_id: int, message_id: int, text: str):
+        await self.scheduler.schedule('delete_message', expire, chat_id=chat_id, message_id=msg.message_id)
+
+    async def send_captcha(self, chat_id: int, captcha: Captcha, caption: str,
+                           keyboard: types.InlineKeyboardMarkup | None = None) -> Message:
+        phrase, image = captcha.comb.query_phrase, captcha.image
+        if keyboard is None:
+            keyboard = captcha.keyboard
+        file_id = await self.file_ids.get(phrase, image.key)
+        if file_id is not None:
+            try:
+                return await self.bot.send_photo(chat_id, file_id, caption, reply_markup=keyboard)
+            except BadRequest as e:
+                # Telegram rejected cached file_id, fall back to uploading the image
+                log_exception(e)
+                await self.file_ids.invalidate(phrase, image.key)
+        msg = await self.bot.send_photo(chat_id, image.as_photo(), caption, reply_markup=keyboard)
+        await self.file_ids.put(phrase, image.key, msg.photo[-1].file_id)
+        return msg
+
+    async def after_captcha_timeout(self, chat_id: int, user_id: int, message_id: int, text: str,
+                                    captcha_id: str | None = None, phrase: str | None = None,
+                                    emoji: str | None = None, shown_at: float | None = None):
+        if captcha_id is not None:
+            # Signed captcha, timeout and answer race for the same marker
+            if await self.redis.mark_answered(captcha_id, self.answered_ttl()):
+                metrics.CAPTCHA_OUTCOMES.inc('timeout')
+                self.events.record(chat_id, user_id, TIMEOUT, phrase, emoji, shown_at)
+                try:
+                    await self.bot.delete_message(chat_id, message_id)
+                except TelegramAPIError as e:
+                    log_exception(e)
+                await self.send_temp_message(chat_id, text)
+            return
+        state = self.dp.current_state(chat=chat_id, user=user_id)
         current_state = await state.get_state()
         if current_state is not None:
+            metrics.CAPTCHA_OUTCOMES.inc('timeout')
+            self.events.record(chat_id, user_id, TIMEOUT, phrase, emoji, shown_at)
             await asyncio.gather(
                 self.bot.delete_message(chat_id, message_id),
                 state.finish(),
@@ -108,69 +235,183 @@ class App:
             )
             await self.send_temp_message(chat_id, text)
 
-    async def handle_new_chat_member(self, message: Message, state: FSMContext, i18n):
+    def answered_ttl(self) -> int:
+        # Outlive captcha expiration, later answers are rejected by the signed expiration time
+        return self.config.guardian.captcha_expire * 2
+
+    def has_left(self, chat_id: int, user_id: int) -> bool:
+        return (chat_id, user_id) in self.departed
+
+    async def restrict(self, chat_id: int, user_id: int) -> bool:
+        async with self.restrictions:
+            return await self.bot.restrict_chat_member(chat_id, user_id, RESTRICTIVE_PERMISSIONS)
+
+    async def handle_new_chat_member(self, message: Message, i18n):
         chat_id = message.chat.id
-        new_member = message.new_chat_members[0]
-        if new_member.is_bot:
+        members = [member for member in message.new_chat_members if not member.is_bot]
+        if len(members) < len(message.new_chat_members):
             bot = await message.bot.me
-            if new_member.id == bot.id:
+            if any(member.id == bot.id for member in message.new_chat_members):
                 await message.answer(i18n.t('bot.make_me_admin'))
                 return
             logger.info('New member is a bot, skipping captcha.')
+        if len(members) == 0:
             return
+        for member in members:
+            self.departed.pop((chat_id, member.id), None)
 
-        # Always restrict new member as soon as possible
-        restricted, _ = await asyncio.gather(
-            message.chat.restrict(new_member.id, can_send_messages=False),
+        # Always restrict new members as soon as possible.
+        # Mark them ignored at the same time, so duplicate joins don't get another captcha.
+        threshold = await self.settings.get(chat_id, Setting.RAID_THRESHOLD)
+        _, marked, raid, *restricted = await asyncio.gather(
             message.delete(),
+            self.redis.try_ignore_many(chat_id, [member.id for member in members],
+                                       duration=self.config.guardian.ignore_expire),
+            self.redis.track_joins(chat_id, len(members), threshold),
+            *(self.restrict(chat_id, member.id) for member in members),
             return_exceptions=True
         )
+        if isinstance(marked, Exception):
+            log_exception(marked)
+            marked = [False] * len(members)
+        if isinstance(raid, Exception):
+            log_exception(raid)
+            raid = False
+
+        newcomers, error = [], None
+        for member, is_marked, is_restricted in zip(members, marked, restricted):
+            # Doesn't make sense to show captcha if restriction didn't work
+            if isinstance(is_restricted, Exception):
+                logger.error(is_restricted)
+                error = is_restricted
+                if is_marked:
+                    await self.redis.unignore(chat_id, member.id)
+            elif not is_marked:
+                # Don't show captcha for ignored users
+                metrics.CAPTCHA_OUTCOMES.inc('ignored')
+                logger.info('Ignoring %s:%s', chat_id, member.id)
+            else:
+                newcomers.append(member)
+        if error is not None:
+            await message.answer(error)
 
-        # Doesn't make sense to show captcha if restriction didn't work
-        if issubclass(type(restricted), TelegramAPIError):
-            logger.error(restricted)
-            await message.answer(restricted)
-            return
+        if raid:
+            window = await self.settings.get(chat_id, Setting.RAID_WINDOW)
+            self.joins.add(chat_id, newcomers, window)
+        else:
+            await asyncio.gather(*(self.show_captcha(chat_id, member, i18n) for member in newcomers))
 
-        # Don't show captcha for ignored users
-        if await self.redis.is_ignored(chat_id, new_member.id):
-            logger.info(f'Ignoring {chat_id}:{new_member.id}')
+    async def show_captcha(self, chat_id: int, member: types.User, i18n):
+        state = self.dp.current_state(chat=chat_id, user=member.id)
+        try:
+            captcha = await self.pool.pop()
+        except Exception as e:
+            log_exception(e)
+            await self.redis.unignore(chat_id, member.id)
             return
+        comb = captcha.comb
+        logger.info('Query phrase: "%s", Variants: %s, Answer: %s',
+                    comb.query_phrase, comb.emoji, comb.answer())
+        logger.info('Image: %s', captcha.image)
+
+        user_tag = get_user_tag(member)
+        expire = self.config.guardian.captcha_expire
+        caption = i18n.t('captcha.caption', user_tag=user_tag, expire=expire)
+        if self.signer is None:
+            captcha_id, keyboard = None, captcha.keyboard
+        else:
+            captcha_id, keyboard = self.signer.keyboard(chat_id, member.id, comb, expire)
 
-        comb = qna.pick(6)
-        # TODO: handle request errors from Qwant.com
-        log.logger.info(
-            f'Query phrase: "{comb.query_phrase}", Variants: {comb.emoji}, Answer: {comb.answer()}')
-        url = await qwant.get_image_url(comb.query_phrase)
-        log.logger.info(f'Image URL: {url}')
+        try:
+            with drop_if(lambda: self.has_left(chat_id, member.id)):
+                requests = [self.send_captcha(chat_id, captcha, caption, keyboard)]
+                if captcha_id is None:
+                    requests.append(state.set_state(CaptchaState.show))
+                msg, *_ = await asyncio.gather(*requests)
+        except ObsoleteRequestError:
+            logger.info('%s:%s has left, captcha dropped', chat_id, member.id)
+            await state.finish()
+            return
+        except TelegramAPIError as e:
+            log_exception(e)
+            await asyncio.gather(self.redis.unignore(chat_id, member.id), state.finish())
+            return
+        shown_at, emoji = round(time.time(), 3), ''.join(comb.emoji)
+        self.events.record(chat_id, member.id, SHOWN, comb.query_phrase, emoji)
+        if captcha_id is None:
+            async with state.proxy() as data:
+                # Store ID of this captcha keyboard message in the user's store.
+                # Will check it later in the keyboard handler to prevent other users from using this keyboard.
+                data['message_id'] = msg.message_id
+                data['answer'] = comb.answer()
 
-        keyboard = emoji_keyboard(comb.emoji, rows=2)
-        user_tag = get_user_tag(new_member)
-        caption = i18n.t('captcha.caption', user_tag=user_tag,
-                         expire=self.config.guardian.captcha_expire)
+        text = i18n.t('captcha.time_over', user_tag=user_tag)
+        job_id = self.captcha_job_id(chat_id, member.id, msg.message_id)
+        await self.scheduler.schedule('captcha_timeout', expire, job_id,
+                                      chat_id=chat_id, user_id=member.id,
+                                      message_id=msg.message_id, text=text, captcha_id=captcha_id,
+                                      phrase=comb.query_phrase, emoji=emoji, shown_at=shown_at)
+
+    async def show_shared_captcha(self, chat_id: int, members: list[types.User]):
+        """
+        Shows one captcha to all newcomers collected during raid window, every newcomer answers it on their own.
+        """
+        try:
+            captcha = await self.pool.pop()
+        except Exception as e:
+            log_exception(e)
+            await asyncio.gather(*(self.redis.unignore(chat_id, member.id) for member in members))
+            return
+        comb = captcha.comb
+        logger.info('Shared captcha for %d newcomer(s), query phrase: "%s", Answer: %s',
+                    len(members), comb.query_phrase, comb.answer())
 
-        # TODO: handle errors with sending photo and writing to redis
-        msg, _ = await asyncio.gather(
-            self.bot.send_photo(chat_id, url, caption, reply_markup=keyboard),
-            CaptchaState.show.set()
-        )
-        await self.redis.ignore(chat_id, new_member.id, duration=self.config.guardian.ignore_expire)
-        async with state.proxy() as data:
-            # Store ID of this captcha keyboard message in the user's store.
-            # Will check it later in the keyboard handler to prevent other users from using this keyboard.
-            data['message_id'] = msg.message_id
-            data['answer'] = comb.answer()
+        user_tags = {str(member.id): get_user_tag(member) for member in members}
+        caption = self.i18n.t('captcha.shared_caption', user_tags=', '.join(user_tags.values()),
+                              expire=self.config.guardian.captcha_expire)
+        try:
+            msg = await self.send_captcha(chat_id, captcha, caption)
+        except TelegramAPIError as e:
+            log_exception(e)
+            await asyncio.gather(*(self.redis.unignore(chat_id, member.id) for member in members))
+            return
 
-        text = i18n.t('captcha.time_over', user_tag=user_tag)
-        asyncio.get_running_loop().call_later(self.config.guardian.captcha_expire,
-                                              callback(self.after_captcha_timeout,
-                                                       state,
-                                                       chat_id,
-                                                       msg.message_id,
-                                                       text))
+        shown_at, emoji = round(time.time(), 3), ''.join(comb.emoji)
+        for member in members:
+            self.events.record(chat_id, member.id, SHOWN, comb.query_phrase, emoji)
+        data = {'message_id': msg.message_id, 'answer': comb.answer(), 'shared': True,
+                'phrase': comb.query_phrase, 'emoji': emoji, 'shown_at': shown_at}
+        states = [self.dp.current_state(chat=chat_id, user=member.id) for member in members]
+        await asyncio.gather(*(state.set_state(CaptchaState.show) for state in states))
+        await asyncio.gather(*(state.set_data(data) for state in states))
+
+        text = self.i18n.t('captcha.shared_time_over', user_tags='{user_tags}')
+        await self.scheduler.schedule('shared_captcha_timeout', self.config.guardian.captcha_expire,
+                                      f'captcha:{chat_id}:{msg.message_id}', chat_id=chat_id,
+                                      message_id=msg.message_id, user_tags=user_tags, text=text)
+
+    async def after_shared_captcha_timeout(self, chat_id: int, message_id: int, user_tags: dict, text: str):
+        timed_out = []
+        for user_id, user_tag in user_tags.items():
+            state = self.dp.current_state(chat=chat_id, user=int(user_id))
+            if await state.get_state() is None:
+                continue
+            data = await state.get_data()
+            if data.get('message_id') == message_id:
+                metrics.CAPTCHA_OUTCOMES.inc('timeout')
+                self.events.record(chat_id, int(user_id), TIMEOUT, data.get('phrase'), data.get('emoji'),
+                                   data.get('shown_at'))
+                await state.finish()
+                timed_out.append(user_tag)
+        try:
+            await self.bot.delete_message(chat_id, message_id)
+        except TelegramAPIError as e:
+            log_exception(e)
+        if len(timed_out) > 0:
+            await self.send_temp_message(chat_id, text.format(user_tags=', '.join(timed_out)))
 
     async def handle_channel_message(self, message: Message):
-        if self.settings.get(message.chat.id, Setting.BAN_CHANNELS):
+        if await self.settings.get(message.chat.id, Setting.BAN_CHANNELS):
             await asyncio.gather(
                 self.bot.ban_chat_sender_chat(message.chat.id, message.sender_chat.id),
                 message.delete(),
@@ -178,11 +419,20 @@ class App:
             )
 
     async def handle_left_chat_member(self, message: Message):
+        self.departed[(message.chat.id, message.left_chat_member.id)] = True
+        self.departed.move_to_end((message.chat.id, message.left_chat_member.id))
+        while len(self.departed) > MAX_DEPARTED:
+            self.departed.popitem(last=False)
         try:
             await message.delete()
         except TelegramAPIError as e:
             log_exception(e)
 
+    async def handle_chat_member(self, update: types.ChatMemberUpdated):
+        if update.old_chat_member.is_chat_admin() != update.new_chat_member.is_chat_admin():
+            logger.info('Administrators of %s changed', update.chat.id)
+            await self.admins.invalidate(update.chat.id)
+
     async def handle_settings_command(self, message: Message, state: FSMContext, i18n):
         pairs = map(lambda s: (str(s.value), s.title), Setting)
         keyboard = settings_keyboard(list(pairs), 2)
@@ -200,8 +450,8 @@ class App:
             if data['message_id'] != message.message_id:
                 await query.answer(i18n.t('query.wrong_user'))
                 return
-            data['setting'] = setting
-            raw_value = self.settings.get(message.chat.id, setting)
+            data['setting'] = setting.value
+            raw_value = await self.settings.get(message.chat.id, setting)
             default = ''
             if raw_value is None:
                 default = ' (' + i18n.t('settings.default') + ')'
@@ -233,7 +483,7 @@ class App:
                 await query.answer(i18n.t('query.wrong_user'))
                 return
 
-            setting = data['setting']
+            setting = Setting(data['setting'])
             if setting.variants is None:
                 return
 
@@ -248,12 +498,12 @@ class App:
 
     async def handle_setting_value(self, message: Message, state: FSMContext, i18n):
         async with state.proxy() as data:
-            setting = data['setting']
+            setting = Setting(data['setting'])
             if setting.variants is not None:
                 return
 
             value, chat_id = message.text.strip(), message.chat.id
-            is_valid, errors = setting.validate(value, i18n.t)
+            is_valid, errors = setting.validate(value, i18n)
             if not is_valid:
                 msg, _, _ = await asyncio.gather(
                     message.answer(self.format_errors(errors, i18n)),
@@ -279,68 +529,235 @@ class App:
             if data['message_id'] != message.message_id:
                 await query.answer(i18n.t('query.wrong_user'))
                 return
+            shared = data.get('shared', False)
+            correct = data['answer'] == user_answer
+
+        outcome = CORRECT if correct else WRONG
+        if shared:
+            # Captcha shared by raid newcomers is deleted on timeout,
+            # welcome and incorrect answer messages are skipped not to flood the chat
+            self.events.record(chat_id, query.from_user.id, outcome, data.get('phrase'), data.get('emoji'),
+                               data.get('shown_at'))
+            cleanup = state.finish()
+        else:
+            job = await self.scheduler.pop(self.captcha_job_id(chat_id, query.from_user.id, message.message_id))
+            if job is not None:
+                self.events.record(chat_id, query.from_user.id, outcome, job.get('phrase'), job.get('emoji'),
+                                   job.get('shown_at'))
+            cleanup = asyncio.gather(message.delete(), state.finish())
+        await self.finish_captcha(query, correct, cleanup, shared, i18n)
+
+    async def handle_signed_captcha_response(self, query: types.CallbackQuery, i18n):
+        message, chat_id = query.message, query.message.chat.id
+        answer = self.signer.verify(query.data, chat_id, query.from_user.id)
+        if answer is None:
+            await query.answer(i18n.t('query.wrong_user'))
+            return
+        if answer.expire_at < time.time():
+            await query.answer(i18n.t('query.expired'))
+            return
+        # Only the first press counts, captcha could also be timed out already
+        if not await self.redis.mark_answered(answer.captcha_id, self.answered_ttl()):
+            await query.answer()
+            return
 
-            user_tag = get_user_tag(query.from_user)
-            if data['answer'] == user_answer:
-                restricted, _, _, _ = await asyncio.gather(
-                    message.chat.restrict(query.from_user.id, **PERMISSIVE_ATTRIBUTES),
-                    query.answer(i18n.t('query.correct')),
-                    message.delete(),
-                    state.finish(),
-                    return_exceptions=True
-                )
+        job = await self.scheduler.pop(self.captcha_job_id(chat_id, query.from_user.id, message.message_id))
+        if job is not None:
+            self.events.record(chat_id, query.from_user.id, CORRECT if answer.correct else WRONG,
+                               job.get('phrase'), job.get('emoji'), job.get('shown_at'))
+        await self.finish_captcha(query, answer.correct, message.delete(), False, i18n)
+
+    async def finish_captcha(self, query: types.CallbackQuery, correct: bool, cleanup: Awaitable, shared: bool,
+                             i18n):
+        message, chat_id = query.message, query.message.chat.id
+        user_tag = get_user_tag(query.from_user)
+        if correct:
+            metrics.CAPTCHA_OUTCOMES.inc('correct')
+            restricted, _, _ = await asyncio.gather(
+                message.chat.restrict(query.from_user.id, **PERMISSIVE_ATTRIBUTES),
+                query.answer(i18n.t('query.correct')),
+                cleanup,
+                return_exceptions=True
+            )
 
-                # Don't welcome user if restriction didn't work
-                if issubclass(type(restricted), TelegramAPIError):
-                    logger.error(restricted)
-                    await message.answer(restricted)
-                    return
+            # Don't welcome user if restriction didn't work
+            if issubclass(type(restricted), TelegramAPIError):
+                logger.error(restricted)
+                await message.answer(restricted)
+                return
+            if shared:
+                return
 
-                text = self.settings.get(chat_id, Setting.WELCOME_MESSAGE)
-                if text is None:
-                    text = i18n.t('bot.welcome', user_tag=user_tag)
-                else:
-                    text = text.format(user_tag=user_tag)
-                await self.send_temp_message(chat_id, text)
+            text = await self.settings.get(chat_id, Setting.WELCOME_MESSAGE)
+            if text is None:
+                text = i18n.t('bot.welcome', user_tag=user_tag)
             else:
-                await asyncio.gather(
-                    query.answer(i18n.t('query.wrong')),
-                    message.delete(),
-                    state.finish(),
-                    return_exceptions=True
-                )
-                text = i18n.t('bot.incorrect_answer', user_tag=user_tag)
-                await self.send_temp_message(chat_id, text)
+                text = text.format(user_tag=user_tag)
+            try:
+                # Welcome can wait in outbound queue behind restrictions and captchas of other newcomers
+                with drop_if(lambda: self.has_left(chat_id, query.from_user.id)):
+                    await self.send_temp_message(chat_id, text)
+            except ObsoleteRequestError:
+                logger.info('%s:%s has left, welcome message dropped', chat_id, query.from_user.id)
+        else:
+            metrics.CAPTCHA_OUTCOMES.inc('wrong')
+            await asyncio.gather(
+                query.answer(i18n.t('query.wrong')),
+                cleanup,
+                return_exceptions=True
+            )
+            if shared:
+                return
+            text = i18n.t('bot.incorrect_answer', user_tag=user_tag)
+            await self.send_temp_message(chat_id, text)
 
     async def handle_inline_keyboard(self, query: types.CallbackQuery, i18n):
         await query.answer(i18n.t('query.wrong_user'))
 
-    async def on_startup(self, _dp):
+    def metrics_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/metrics', metrics.handle_metrics)
+        return app
+
+    async def start_metrics(self):
+        metrics.PENDING_JOBS.set_function(self.scheduler.pending)
+        metrics.FSM_STATES.set_function(self.dp.storage.count_states)
+        metrics.OUTBOUND_QUEUE_DEPTH.set_function(self.outbound.depth)
+        metrics.INBOUND_QUEUE_DEPTH.set_function(self.inbound.depth)
+        self.loop_lag = asyncio.create_task(metrics.measure_loop_lag())
+        # In webhook mode /metrics is served by the webhook server
+        if not self.use_webhook:
+            self.metrics_runner = web.AppRunner(self.metrics_app())
+            await self.metrics_runner.setup()
+            site = web.TCPSite(self.metrics_runner, self.config.metrics.host, self.config.metrics.port)
+            await site.start()
+
+    async def stop_metrics(self):
+        if self.loop_lag is not None:
+            self.loop_lag.cancel()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+
+    async def connect_redis(self):
         await self.redis.ping()
+        await self.redis.migrate_legacy_ignores()
+
+    async def connect_database(self):
+        await self.db.connect()
+        async with self.db.writing:
+            applied = await migrate(self.db.db)
+        if len(applied) > 0:
+            logger.info('Applied database migration(s) %s', applied)
+
+    async def receive_updates(self) -> list[types.Update]:
+        """
+        Fetches the backlog if catching up and sets the webhook, returns the backlog.
+        """
+        updates = []
+        if self.catch_up:
+            fetch_request = fetch_backlog(self.bot, self.redis, self.config.streams.lease)
+            updates = await self.profile.timed('fetch backlog', fetch_request)
         if self.use_webhook:
-            webhook_url = f'https://{self.config.telegram.webhook_host}/bot{self.config.telegram.token}/'
-            await self.bot.set_webhook(webhook_url)
-        await self.settings.load()
+            # Updates are only delivered once the webhook server listens, after startup
+            set_webhook_request = self.bot.set_webhook(webhook_url(self.config.telegram),
+                                                       allowed_updates=self.dp.allowed_updates(),
+                                                       secret_token=webhook_secret(self.config.telegram))
+            await self.profile.timed('set webhook', set_webhook_request)
+        return updates
+
+    async def on_startup(self, _dp):
+        # Steps talk to different services, so they run concurrently
+        steps = [
+            self.profile.timed('connect redis', self.connect_redis()),
+            self.profile.timed('connect database', self.connect_database()),
+            self.receive_updates()
+        ]
+        if self.config.metrics.enabled:
+            steps.append(self.profile.timed('start metrics', self.start_metrics()))
+        with self.profile.phase('on_startup'):
+            _, _, backlog, *_ = await asyncio.gather(*steps)
+        # Warm-up tasks, such as filling the captcha pool, go on in the background
+        self.settings.start()
+        self.events.start()
+        self.admins.start()
+        self.dp.storage.start()
+        self.pool.start()
+        self.scheduler.start()
+        if self.catch_up:
+            self.backlog = catch_up(self.dp, backlog, self.config.catchup.max_age, self.config.catchup.concurrency)
+        self.profile.ready(logger)
 
     async def on_shutdown(self, _dp):
         logger.warning('Shutting down..')
+        if self.backlog is not None:
+            self.backlog.cancel()
+            await asyncio.gather(self.backlog, return_exceptions=True)
+        await self.stop_metrics()
+        await self.joins.stop()
+        await self.pool.stop()
+        await self.scheduler.stop()
+        await self.settings.stop()
+        await self.admins.stop()
+        await self.dp.storage.stop()
+        await self.provider.close()
+        await self.http.close()
         if self.use_webhook:
             await self.bot.delete_webhook()
+        await self.outbound.stop()
         await self.redis.close()
+        await self.db.close()
+        log.stop()
+
+    async def process_stream_update(self, update: dict):
+        await self.dp.process_update(types.Update(**update))
+
+    async def run_worker(self):
+        # Only needed by split deployment
+        from guardian.streams import StreamWorker, wait_for_signal
+
+        # Updates come from Redis Streams, webhook is set by `guardian receive`
+        self.use_webhook = False
+        config = self.config.streams
+        # Every consumed shard holds a connection while waiting for new entries
+        redis = Redis(self.config.redis.url, max_connections=config.shards + 2)
+        worker = StreamWorker(redis, self.process_stream_update, config.shards, config.batch,
+                              config.max_attempts, config.lease)
+        BaseBot.set_current(self.bot)
+        BaseDispatcher.set_current(self.dp)
+        await self.on_startup(self.dp)
+        worker.start()
+        logger.info('Worker %s started', worker.name)
+        try:
+            await wait_for_signal()
+        finally:
+            await worker.stop()
+            await redis.close()
+            await self.on_shutdown(self.dp)
+            await (await self.bot.get_session()).close()
+
+    def start_worker(self):
+        asyncio.run(self.run_worker())
+
+    def start_receiver(self):
+        from guardian import streams
+
+        streams.run_receiver(self.config, self.dp.allowed_updates())
 
     def start(self):
+        self.catch_up = self.config.catchup.enabled
         kwargs = {
             'dispatcher': self.dp,
             'on_startup': self.on_startup,
             'on_shutdown': self.on_shutdown,
-            'skip_updates': True
+            'skip_updates': not self.catch_up
         }
         if self.use_webhook:
-            start_webhook(
-                webhook_path='',
+            web_app = web.Application(middlewares=[check_secret_token(webhook_secret(self.config.telegram))])
+            if self.config.metrics.enabled:
+                web_app.router.add_get('/metrics', metrics.handle_metrics)
+            set_webhook(webhook_path='', web_app=web_app, **kwargs).run_app(
                 host=self.config.webhook.host,
-                port=self.config.webhook.port,
-                **kwargs
+                port=self.config.webhook.port
             )
         else:
-            executor.start_polling(**kwargs)
+            executor.start_polling(allowed_updates=self.dp.allowed_updates(), **kwargs)
@@ -0,0 +1,113 @@
+import io
+import hmac
+import aiogram
+from hashlib import sha256
+from aiohttp import web
+from aiohttp.helpers import guess_filename
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import RetryAfter
+from guardian import log, metrics
+from guardian.inbound import lend_slot
+from guardian.outbound import OutboundQueue, ObsoleteRequestError, PRIORITIES, CHAT_LIMITED, obsolete_check
+from guardian.util import AttrDict
+
+# Max number of retries of a request rejected by flood control.
+MAX_RETRIES = 3
+# Path of webhook server updates are posted to, webhook_url() path is expected to be proxied to it.
+WEBHOOK_PATH = '/'
+# Header carrying secret_token passed to setWebhook in every webhook request.
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def api_server(telegram: AttrDict) -> TelegramAPIServer:
+    if 'api_server' in telegram:
+        return TelegramAPIServer.from_base(telegram.api_server)
+    return TELEGRAM_PRODUCTION
+
+
+def webhook_url(telegram: AttrDict) -> str:
+    return f'https://{telegram.webhook_host}/bot{telegram.token}/'
+
+
+def webhook_secret(telegram: AttrDict) -> str:
+    """
+    Returns secret token of webhook requests, derived from bot token, so every instance knows it without config.
+    """
+    return sha256(f'webhook:{telegram.token}'.encode()).hexdigest()
+
+
+def check_secret_token(secret: str):
+    """
+    Returns middleware rejecting updates posted without `secret` in SECRET_TOKEN_HEADER.
+    """
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        if request.method == 'POST' and not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), secret):
+            raise web.HTTPForbidden()
+        return await handler(request)
+
+    return middleware
+
+
+def read_files(files: dict) -> dict[str, tuple[str, bytes]]:
+    """
+    Reads and closes files of a request, returns (filename, content) of every file.
+    aiohttp closes every file it sends, so a retried request has to send copies.
+    """
+    contents = {}
+    for key, file in files.items():
+        if isinstance(file, InputFile):
+            filename, file = file.filename, file.file
+        elif isinstance(file, tuple):
+            filename, file = file
+        else:
+            filename = guess_filename(file) or key
+        if hasattr(file, 'read'):
+            with file:
+                file = file.read()
+        contents[key] = (filename, file)
+    return contents
+
+
+def open_files(contents: dict[str, tuple[str, bytes]]) -> dict[str, tuple[str, io.BytesIO]]:
+    return {key: (filename, io.BytesIO(content)) for key, (filename, content) in contents.items()}
+
+
+class Bot(aiogram.Bot):
+    """
+    Bot which sends requests through `outbound` queue if given,
+    retries requests rejected by flood control and drops obsolete ones (see `outbound.drop_if`).
+    """
+
+    def __init__(self, *args, outbound: OutboundQueue | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbound = outbound
+
+    async def send(self, method: str, data: dict | None, files: dict | None, **kwargs):
+        with metrics.TELEGRAM_SECONDS.time(method):
+            return await super().request(method, data, files, **kwargs)
+
+    async def request(self, method: str, data: dict | None = None, files: dict | None = None, **kwargs):
+        if self.outbound is None or method not in PRIORITIES:
+            return await self.send(method, data, files, **kwargs)
+        chat_id = data.get('chat_id') if method in CHAT_LIMITED else None
+        is_obsolete = obsolete_check.get()
+        contents = read_files(files) if files else None
+        attempt = 0
+        while True:
+            # Updates of other chats go on while the handler waits for rate limits
+            async with lend_slot():
+                await self.outbound.acquire(method, chat_id)
+            if is_obsolete is not None and is_obsolete():
+                metrics.OUTBOUND_DROPPED.inc(method)
+                raise ObsoleteRequestError(f'{method} request became obsolete while queued')
+            try:
+                return await self.send(method, data, open_files(contents) if contents else files, **kwargs)
+            except RetryAfter as e:
+                metrics.OUTBOUND_RETRIES.inc(method)
+                if attempt == MAX_RETRIES:
+                    raise
+                attempt += 1
+                log.logger.warning('Flood control on %s to %s, retrying in %s seconds', method, chat_id, e.timeout)
+                self.outbound.block(chat_id, e.timeout)
@@ -0,0 +1,111 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Callable, Awaitable
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from guardian import log, metrics
+from guardian.util import log_exception
+
+
+class ChatCache:
+    """
+    LRU cache of values of at most `max_size` chats loaded with `fetch`.
+    Concurrent loads of the same chat are collapsed into one `fetch` call.
+    Caches of other bot instances are invalidated through Redis pub/sub, see `start`.
+    Lookups, evictions and size are exported as metrics labeled with `name`.
+    """
+
+    def __init__(self, name: str, fetch: Callable[[int], Awaitable], max_size: int):
+        self.name = name
+        self.fetch = fetch
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.task = None
+
+    def get(self, chat_id: int, is_fresh: Callable[[Any], bool] | None = None) -> Any | None:
+        """
+        Returns cached value of the chat, or None if it isn't cached or `is_fresh(value)` is False.
+        """
+        value = self.entries.get(chat_id)
+        if value is None or is_fresh is not None and not is_fresh(value):
+            metrics.CACHE_REQUESTS.inc(self.name, 'miss')
+            return None
+        metrics.CACHE_REQUESTS.inc(self.name, 'hit')
+        self.entries.move_to_end(chat_id)
+        return value
+
+    def load(self, chat_id: int) -> asyncio.Future:
+        future = self.loading.get(chat_id)
+        if future is None:
+            future = asyncio.ensure_future(self.fetch(chat_id))
+            self.loading[chat_id] = future
+            future.add_done_callback(lambda f: self.loaded(chat_id, f))
+        return future
+
+    async def get_or_load(self, chat_id: int, is_fresh: Callable[[Any], bool] | None = None) -> Any:
+        value = self.get(chat_id, is_fresh)
+        if value is None:
+            value = await asyncio.shield(self.load(chat_id))
+        return value
+
+    def loaded(self, chat_id: int, future: asyncio.Future):
+        # Don't cache the result if the chat was invalidated while loading
+        if self.loading.get(chat_id) is not future:
+            return
+        del self.loading[chat_id]
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.entries[chat_id] = future.result()
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            metrics.CACHE_EVICTIONS.inc(self.name)
+        metrics.CACHE_SIZE.set(len(self.entries), self.name)
+
+    def modify(self, chat_id: int) -> Any | None:
+        """
+        Returns cached value of the chat to be changed in place or None if it isn't cached.
+        A load in progress is discarded, since it can miss the change.
+        """
+        self.loading.pop(chat_id, None)
+        return self.entries.get(chat_id)
+
+    def forget(self, chat_id: int):
+        self.entries.pop(chat_id, None)
+        self.loading.pop(chat_id, None)
+        metrics.CACHE_SIZE.set(len(self.entries), self.name)
+
+    def clear(self):
+        self.entries.clear()
+        self.loading.clear()
+        metrics.CACHE_SIZE.set(0, self.name)
+
+    async def listen(self, redis: Redis, channel: str, handle_message: Callable[[str], None]):
+        while True:
+            try:
+                async with redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(channel)
+                    async for message in pubsub.listen():
+                        try:
+                            handle_message(message['data'])
+                        except Exception as e:
+                            # A malformed message mustn't stop the listener
+                            log.logger.warning('Skipping malformed %s message %r: %s', channel, message['data'], e)
+            except RedisError as e:
+                log_exception(e)
+                # Changes could be missed while disconnected
+                self.clear()
+                await asyncio.sleep(1)
+
+    def start(self, redis: Redis, channel: str, handle_message: Callable[[str], None]):
+        """
+        Passes messages of pub/sub `channel` to `handle_message` until stopped.
+        """
+        self.task = asyncio.create_task(self.listen(redis, channel, handle_message))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
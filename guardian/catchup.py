@@ -0,0 +1,106 @@
+import time
+import asyncio
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from guardian import log, metrics
+from guardian.filters import is_channel_message
+from guardian.redis import Redis
+from guardian.streams import WORKERS_KEY
+from guardian.util import log_exception
+
+# Max number of updates returned by getUpdates at once.
+PAGE_SIZE = 100
+
+
+async def fetch_backlog(bot: Bot, redis: Redis, lease: float) -> list[Update]:
+    """
+    Fetches updates received while the bot was down and confirms them, so they're not delivered again.
+    Fetches nothing if updates are received by someone else: while webhook is set (by other instances of the bot
+    or `guardian receive`) or stream workers which renewed their leases within `lease` seconds are alive.
+    """
+    info = await bot.get_webhook_info()
+    if info.pending_update_count == 0:
+        return []
+    if info.url:
+        log.logger.info('Webhook is set, leaving %d pending update(s) to it', info.pending_update_count)
+        return []
+    if await redis.redis.zcount(WORKERS_KEY, time.time() - lease, '+inf') > 0:
+        log.logger.info('Stream workers are alive, leaving %d pending update(s) to them', info.pending_update_count)
+        return []
+    updates, offset = [], None
+    while True:
+        page = await bot.get_updates(offset=offset, limit=PAGE_SIZE, timeout=0)
+        if len(page) == 0:
+            break
+        updates.extend(page)
+        offset = page[-1].update_id + 1
+    if offset is not None:
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+    return updates
+
+
+def coalesce(updates: list[Update], max_age: float) -> list[Update]:
+    """
+    Keeps only joins and messages of channels. Skips joins older than `max_age` seconds,
+    all but the latest join of the same user and joins of users who left afterwards.
+    """
+    latest, left = {}, {}
+    for update in updates:
+        message = update.message
+        if message is None:
+            continue
+        for member in message.new_chat_members or []:
+            latest[(message.chat.id, member.id)] = update.update_id
+        if message.left_chat_member is not None:
+            left[(message.chat.id, message.left_chat_member.id)] = update.update_id
+
+    relevant, expire_before = [], time.time() - max_age
+    for update in updates:
+        message = update.message
+        if is_channel_message(message):
+            relevant.append(update)
+        elif message is not None and message.new_chat_members and message.date.timestamp() >= expire_before:
+            chat_id = message.chat.id
+            members = [member for member in message.new_chat_members
+                       if latest[(chat_id, member.id)] == update.update_id
+                       and left.get((chat_id, member.id), 0) < update.update_id]
+            if len(members) > 0:
+                message.new_chat_members = members
+                relevant.append(update)
+    return relevant
+
+
+async def drain(dp: Dispatcher, updates: list[Update], concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(update):
+        async with semaphore:
+            try:
+                await dp.process_update(update)
+            except Exception as e:
+                log_exception(e)
+
+    await asyncio.gather(*(process(update) for update in updates))
+
+
+def catch_up(dp: Dispatcher, updates: list[Update], max_age: float, concurrency: int) -> asyncio.Task | None:
+    """
+    Starts handling relevant updates of the backlog fetched by `fetch_backlog` in the background,
+    at most `concurrency` at a time. Returns the task draining the backlog.
+    """
+    start = time.perf_counter()
+    relevant = coalesce(updates, max_age)
+    metrics.CATCHUP_BACKLOG.set(len(updates))
+    metrics.CATCHUP_RELEVANT.set(len(relevant))
+    log.logger.info('Backlog of %d update(s), %d to handle', len(updates), len(relevant))
+    if len(relevant) == 0:
+        metrics.CATCHUP_SECONDS.set(time.perf_counter() - start)
+        return None
+
+    async def run():
+        await drain(dp, relevant, concurrency)
+        seconds = time.perf_counter() - start
+        metrics.CATCHUP_SECONDS.set(seconds)
+        log.logger.info('Backlog handled in %.1f seconds', seconds)
+
+    return asyncio.create_task(run())
@@ -0,0 +1,104 @@
+import copy
+from guardian.util import AttrDict
+
+# Settings missing from configuration file, so configs written for earlier versions keep working.
+# See config.example.yaml for descriptions. telegram.token, telegram.webhook_host and redis.url have no defaults.
+DEFAULTS = {
+    'webhook': {
+        'host': '127.0.0.1',
+        'port': 7878,
+    },
+    'metrics': {
+        'enabled': False,
+        'host': '127.0.0.1',
+        'port': 7879,
+    },
+    'inbound': {
+        'concurrency': 64,
+        'queue_size': 1000,
+        'overflow': 'low_priority',
+    },
+    'outbound': {
+        'global_rate': 30,
+        'chat_rate': 20,
+        'chat_burst': 5,
+    },
+    'streams': {
+        'shards': 16,
+        'max_length': 10000,
+        'batch': 50,
+        'max_attempts': 3,
+        'lease': 10,
+    },
+    'catchup': {
+        'enabled': True,
+        'max_age': 600,
+        'concurrency': 8,
+    },
+    'redis': {
+        'file_id_cache_size': 10000,
+    },
+    'guardian': {
+        'captcha_expire': 60,
+        'message_expire': 10,
+        'ignore_expire': 300,
+        'signed_answers': False,
+        'settings_cache_size': 10000,
+    },
+    'admins': {
+        'ttl': 600,
+        'cache_size': 10000,
+        'redis': True,
+    },
+    'http': {
+        'total_timeout': 10,
+        'connect_timeout': 3,
+        'limit_per_host': 8,
+        'retries': 2,
+        'backoff': 0.5,
+        'breaker_threshold': 5,
+        'breaker_reset_timeout': 30,
+    },
+    'database': {
+        'path': 'data.db',
+        'flush_interval': 1,
+    },
+    'events': {
+        'buffer_size': 10000,
+        'flush_interval': 5,
+    },
+    'scheduler': {
+        'interval': 1,
+        'batch': 100,
+        'lease': 30,
+    },
+    'images': {
+        'providers': ['local', 'qwant'],
+        'corpus_path': 'corpus',
+    },
+    'pool': {
+        'size': 20,
+        'low_watermark': 10,
+        'max_uses': 2,
+    },
+    'log_level': 'info',
+    'log_format': 'text',
+    'log_queue': True,
+    'log_rate_limit': 10,
+}
+
+
+def merge(defaults: dict, values: dict) -> dict:
+    """
+    Returns `values` with missing keys taken from `defaults`, nested sections are merged recursively.
+    """
+    merged = dict(defaults)
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(defaults.get(key), dict):
+            value = merge(defaults[key], value)
+        merged[key] = value
+    return merged
+
+
+def from_dict(values: dict | None) -> AttrDict:
+    return AttrDict(merge(copy.deepcopy(DEFAULTS), values or {}))
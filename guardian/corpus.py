@@ -0,0 +1,120 @@
+import os
+import mmap
+import random
+import marshal
+import asyncio
+from hashlib import blake2b
+from pathlib import Path
+from guardian import qna, log
+from guardian.http import HttpClient
+from guardian.images import Image, ImageProvider
+from guardian.util import log_exception
+
+INDEX_FILE = 'index'
+PACK_FILE = 'pack'
+INDEX_VERSION = 1
+
+
+class CorpusIndexError(Exception):
+    pass
+
+
+class Corpus:
+    """
+    Content-addressed on-disk image store.
+    Images are appended to a single pack file and read through a memory map.
+    The index maps image digest to (offset, length) in the pack and query phrase to image digests.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.objects = {}
+        self.queries = {}
+        self.mmap = None
+        self.load()
+
+    def load(self):
+        index = self.path / INDEX_FILE
+        if not index.is_file():
+            return
+        with open(index, 'rb') as f:
+            version, self.objects, self.queries = marshal.load(f)
+        if version != INDEX_VERSION:
+            raise CorpusIndexError(f'Unsupported corpus index version {version} in {index}')
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        index = self.path / INDEX_FILE
+        tmp = index.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            marshal.dump((INDEX_VERSION, self.objects, self.queries), f)
+        os.replace(tmp, index)
+
+    def images(self, query: str) -> list[bytes]:
+        return self.queries.get(query, [])
+
+    def read(self, digest: bytes) -> memoryview:
+        if self.mmap is None:
+            with open(self.path / PACK_FILE, 'rb') as f:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, length = self.objects[digest]
+        return memoryview(self.mmap)[offset:offset + length]
+
+    def add(self, query: str, data: bytes) -> bytes:
+        digest = blake2b(data, digest_size=16).digest()
+        if digest not in self.objects:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / PACK_FILE, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data)
+            self.objects[digest] = (offset, len(data))
+        digests = self.queries.setdefault(query, [])
+        if digest not in digests:
+            digests.append(digest)
+        return digest
+
+    def __len__(self):
+        return len(self.objects)
+
+
+class LocalProvider(ImageProvider):
+    name = 'local'
+
+    def __init__(self, corpus: Corpus):
+        self.corpus = corpus
+        log.logger.info(f'Loaded {len(corpus)} images for {len(corpus.queries)} queries from {corpus.path}')
+
+    async def get_image(self, query: str) -> Image | None:
+        digests = self.corpus.images(query)
+        if len(digests) == 0:
+            return None
+        digest = random.choice(digests)
+        return Image(digest.hex(), data=self.corpus.read(digest))
+
+
+async def populate(corpus: Corpus, provider: ImageProvider, http: HttpClient,
+                   per_query: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    size = len(corpus)
+
+    async def fetch(query: str):
+        async with semaphore:
+            attempts = 0
+            while len(corpus.images(query)) < per_query and attempts < per_query * 3:
+                attempts += 1
+                try:
+                    image = await provider.get_image(query)
+                    if image is None:
+                        continue
+                    data = image.data if image.data is not None else await http.get_bytes(image.url)
+                except Exception as e:
+                    log_exception(e)
+                    continue
+                corpus.add(query, bytes(data))
+            log.logger.info(f'"{query}": {len(corpus.images(query))} image(s)')
+
+    try:
+        await asyncio.gather(*(fetch(q) for q in qna.phrases()))
+    finally:
+        corpus.save()
+    log.logger.info(f'Added {len(corpus) - size} image(s), corpus now has {len(corpus)} image(s)')
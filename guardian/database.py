@@ -1,21 +1,136 @@
+import asyncio
 import aiosqlite
+from typing import Callable, Awaitable
+from guardian import log, metrics
+from guardian.util import log_exception
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',
+)
+
+# Statements are kept as constants, so sqlite3 statement cache reuses prepared statements.
+SELECT_SETTINGS = 'SELECT * FROM settings'
+SELECT_CHAT_SETTINGS = 'SELECT * FROM settings WHERE chat_id = ?'
+UPSERT_SETTING = """
+INSERT INTO settings VALUES (:chat_id, :setting_id, :value)
+ON CONFLICT (chat_id, setting_id) DO UPDATE SET value = :value
+"""
+INSERT_CAPTCHA_EVENT = 'INSERT INTO captcha_events VALUES (?, ?, ?, ?, ?, ?, ?)'
 
 
 class Database:
-    FILE = 'data.db'
+    """
+    Single long-lived SQLite connection in WAL mode, writes are made one transaction at a time.
+    With `flush_interval` > 0 setting upserts are queued, merged by (chat_id, setting_id)
+    and written in a single transaction every `flush_interval` seconds and on close.
+    Other write-behind buffers are flushed the same way with `flush_every`.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.db = None
+        self.pending = {}
+        # Held by a write transaction, so a rollback doesn't discard writes of another one
+        self.writing = asyncio.Lock()
+        self.closing = asyncio.Event()
+        self.flushes = []
+        self.tasks = []
+
+    async def connect(self):
+        self.db = await aiosqlite.connect(self.path)
+        self.db.row_factory = aiosqlite.Row
+        for pragma in PRAGMAS:
+            await self.db.execute(pragma)
+        if self.flush_interval > 0:
+            self.flush_every(self.flush, self.flush_interval)
+
+    def flush_every(self, flush: Callable[[], Awaitable], interval: float):
+        """
+        Calls `flush` every `interval` seconds and on close.
+        """
+        self.flushes.append(flush)
+        self.tasks.append(asyncio.create_task(self.flush_periodically(flush, interval)))
 
     async def select_settings(self):
-        query = 'SELECT * FROM settings'
-        async with aiosqlite.connect(self.FILE) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(query) as cursor:
+        with metrics.SQLITE_SECONDS.time('select_settings'):
+            async with self.db.execute(SELECT_SETTINGS) as cursor:
                 return await cursor.fetchall()
 
+    async def select_chat_settings(self, chat_id: int) -> list[dict]:
+        with metrics.SQLITE_SECONDS.time('select_chat_settings'):
+            async with self.db.execute(SELECT_CHAT_SETTINGS, (chat_id,)) as cursor:
+                rows = {row['setting_id']: dict(row) for row in await cursor.fetchall()}
+        # Settings queued for write-behind are newer than the stored ones
+        for (pending_chat_id, setting_id), value in self.pending.items():
+            if pending_chat_id == chat_id:
+                rows[setting_id] = {'chat_id': chat_id, 'setting_id': setting_id, 'value': value}
+        return list(rows.values())
+
     async def upsert_setting(self, chat_id: int, setting_id: int, setting_value: str):
-        query = """
-        INSERT INTO settings VALUES (:chat_id, :setting_id, :value)
-        ON CONFLICT (chat_id, setting_id) DO UPDATE SET value = :value
-        """
-        async with aiosqlite.connect(self.FILE) as db:
-            await db.execute(query, {'chat_id': chat_id, 'setting_id': setting_id, 'value': setting_value})
-            await db.commit()
+        if self.flush_interval > 0:
+            self.pending[(chat_id, setting_id)] = setting_value
+            return
+        async with self.writing:
+            with metrics.SQLITE_SECONDS.time('upsert_setting'):
+                await self.db.execute(UPSERT_SETTING,
+                                      {'chat_id': chat_id, 'setting_id': setting_id, 'value': setting_value})
+                await self.db.commit()
+
+    async def insert_captcha_events(self, events: list[tuple]):
+        async with self.writing:
+            with metrics.SQLITE_SECONDS.time('insert_captcha_events'):
+                try:
+                    await self.db.executemany(INSERT_CAPTCHA_EVENT, events)
+                    await self.db.commit()
+                except BaseException:
+                    await self.db.rollback()
+                    raise
+
+    async def flush(self):
+        if len(self.pending) == 0:
+            return
+        pending, self.pending = self.pending, {}
+        rows = [{'chat_id': chat_id, 'setting_id': setting_id, 'value': value}
+                for (chat_id, setting_id), value in pending.items()]
+        async with self.writing:
+            try:
+                with metrics.SQLITE_SECONDS.time('flush'):
+                    await self.db.executemany(UPSERT_SETTING, rows)
+                    await self.db.commit()
+            except BaseException:
+                # Put failed upserts back unless they were overwritten meanwhile
+                self.pending = pending | self.pending
+                await self.db.rollback()
+                raise
+        log.logger.debug('Flushed %d setting(s) to database', len(rows))
+
+    async def flush_periodically(self, flush: Callable[[], Awaitable], interval: float):
+        # Not cancelled on close, so a flush in progress isn't interrupted
+        while not self.closing.is_set():
+            try:
+                await asyncio.wait_for(self.closing.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await flush()
+            except Exception as e:
+                log_exception(e)
+
+    async def close(self):
+        self.closing.set()
+        await asyncio.gather(*self.tasks)
+        self.tasks = []
+        if self.db is not None:
+            # Writes queued while the last periodic flushes were running
+            for flush in self.flushes:
+                try:
+                    await flush()
+                except Exception as e:
+                    log_exception(e)
+            await self.db.close()
+            self.db = None
@@ -0,0 +1,44 @@
+import aiogram
+from typing import Callable
+from aiogram.types import Update, AllowedUpdates
+from aiogram.dispatcher.filters.builtin import StateFilter
+from guardian import metrics
+from guardian.inbound import ChatExecutor
+
+
+class Dispatcher(aiogram.Dispatcher):
+    """
+    Dispatcher which drops updates `is_relevant` returns False for before middlewares and filters see them,
+    and handles the rest through `inbound` executor if given, see `inbound.ChatExecutor`.
+    """
+
+    def __init__(self, *args, inbound: ChatExecutor | None = None,
+                 is_relevant: Callable[[Update], bool] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.inbound = inbound
+        self.is_relevant = is_relevant
+
+    async def process_update(self, update: Update):
+        if self.is_relevant is not None and not self.is_relevant(update):
+            metrics.SKIPPED_UPDATES.inc()
+            return None
+        if self.inbound is None:
+            return await super().process_update(update)
+        return await self.inbound.submit(update, super().process_update)
+
+    def allowed_updates(self) -> list[str]:
+        """
+        Returns types of updates there are handlers for.
+        """
+        return [name for name in AllowedUpdates.all() if len(getattr(self, f'{name}_handlers').handlers) > 0]
+
+    def message_states(self) -> set[str]:
+        """
+        Returns FSM states message handlers are registered for, '*' stands for any state.
+        """
+        states = set()
+        for handler in self.message_handlers.handlers:
+            for f in handler.filters or []:
+                if isinstance(f.filter, StateFilter):
+                    states.update(state for state in f.filter.states if state is not None)
+        return states
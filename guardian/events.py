@@ -0,0 +1,153 @@
+import sys
+import time
+import argparse
+from collections import deque
+from guardian import log, metrics
+from guardian.database import Database
+from guardian.maintenance import migrations, schema_version
+from guardian.util import AttrDict
+
+# Captcha outcomes stored in captcha_events.outcome column.
+SHOWN, CORRECT, WRONG, TIMEOUT = 0, 1, 2, 3
+OUTCOME_NAMES = ('shown', 'correct', 'wrong', 'timeout')
+# Answer latencies are aggregated into buckets of that many milliseconds, so percentiles are that precise.
+LATENCY_BUCKET_MS = 100
+REPORT_KEYS = {'query': 'phrase', 'chat': 'chat_id'}
+# Grouped in order of captcha_events indexes, the bucket expression must match theirs (migrations/002).
+REPORT_QUERY = """
+SELECT {key}, outcome, CASE WHEN outcome = 1 THEN latency_ms / {bucket} END AS bucket, COUNT(*)
+FROM captcha_events
+WHERE time >= ?
+GROUP BY 1, 2, 3
+"""
+
+
+class CaptchaEvents:
+    """
+    Captcha events kept in a ring buffer of at most `size` events and appended to captcha_events table
+    every `flush_interval` seconds and on database close in a transaction of their own,
+    so handlers never wait for the database. When the buffer is full, the oldest events are dropped.
+    """
+
+    def __init__(self, db: Database, size: int, flush_interval: float):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.events = deque(maxlen=size)
+
+    def record(self, chat_id: int, user_id: int, outcome: int, phrase: str | None, emoji: str | None,
+               shown_at: float | None = None):
+        # Captchas shown by previous versions have no phrase to attribute the outcome to
+        if phrase is None:
+            return
+        now = time.time()
+        latency = None if shown_at is None else round((now - shown_at) * 1000)
+        if len(self.events) == self.events.maxlen:
+            metrics.CAPTCHA_EVENTS_DROPPED.inc()
+        self.events.append((int(now), chat_id, user_id, outcome, phrase, emoji, latency))
+
+    async def flush(self):
+        if len(self.events) == 0:
+            return
+        events = list(self.events)
+        self.events.clear()
+        try:
+            await self.db.insert_captcha_events(events)
+        except BaseException:
+            # Put failed events back before the ones recorded meanwhile, the newest ones that fit
+            kept = events[max(len(events) - (self.events.maxlen - len(self.events)), 0):]
+            if len(kept) < len(events):
+                metrics.CAPTCHA_EVENTS_DROPPED.inc(amount=len(events) - len(kept))
+            self.events.extendleft(reversed(kept))
+            raise
+        log.logger.debug('Flushed %d captcha event(s)', len(events))
+
+    def start(self):
+        self.db.flush_every(self.flush, self.flush_interval)
+
+
+def percentile(histogram: dict[int, int], total: int, q: float) -> float | None:
+    """
+    Returns upper bound of the latency bucket holding `q` quantile, in seconds.
+    """
+    if total == 0:
+        return None
+    rank, seen = q * total, 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= rank:
+            return (bucket + 1) * LATENCY_BUCKET_MS / 1000
+    return None
+
+
+def aggregate(rows, fast: float) -> list[dict]:
+    """
+    Turns (key, outcome, latency bucket, count) rows into per key stats, the lowest solve rates first.
+    """
+    groups = {}
+    for key, outcome, bucket, count in rows:
+        group = groups.setdefault(key, {'counts': [0] * len(OUTCOME_NAMES), 'latencies': {}})
+        group['counts'][outcome] += count
+        if bucket is not None:
+            group['latencies'][bucket] = group['latencies'].get(bucket, 0) + count
+
+    fast_buckets = fast * 1000 // LATENCY_BUCKET_MS
+    stats = []
+    for key, group in groups.items():
+        counts, latencies = group['counts'], group['latencies']
+        answered = counts[CORRECT] + counts[WRONG] + counts[TIMEOUT]
+        correct = sum(latencies.values())
+        stats.append({
+            'key': key,
+            **dict(zip(OUTCOME_NAMES, counts)),
+            'solve_rate': counts[CORRECT] / answered if answered > 0 else None,
+            'p50': percentile(latencies, correct, 0.5),
+            'p90': percentile(latencies, correct, 0.9),
+            'p99': percentile(latencies, correct, 0.99),
+            'fast_rate': sum(n for b, n in latencies.items() if b < fast_buckets) / correct if correct > 0 else None
+        })
+    stats.sort(key=lambda s: (s['solve_rate'] is None, s['solve_rate'] or 0))
+    return stats
+
+
+def format_stats(stats: list[dict], by: str) -> str:
+    def number(value, fmt):
+        return '-' if value is None else format(value, fmt)
+
+    lines = [f'{by:<32}{"shown":>8}{"correct":>8}{"wrong":>8}{"timeout":>8}{"solved":>8}'
+             f'{"p50":>7}{"p90":>7}{"p99":>7}{"fast":>7}']
+    for s in stats:
+        lines.append(f'{str(s["key"])[:31]:<32}{s["shown"]:>8}{s["correct"]:>8}{s["wrong"]:>8}{s["timeout"]:>8}'
+                     f'{number(s["solve_rate"], ".1%"):>8}{number(s["p50"], ".1f"):>7}'
+                     f'{number(s["p90"], ".1f"):>7}{number(s["p99"], ".1f"):>7}{number(s["fast_rate"], ".1%"):>7}')
+    return '\n'.join(lines)
+
+
+async def report(db: Database, by: str, days: float, fast: float) -> list[dict]:
+    since = int(time.time() - days * 86400)
+    query = REPORT_QUERY.format(key=REPORT_KEYS[by], bucket=LATENCY_BUCKET_MS)
+    async with db.db.execute(query, (since,)) as cursor:
+        rows = await cursor.fetchall()
+    return aggregate(rows, fast)
+
+
+async def run_report(config: AttrDict, args: argparse.Namespace) -> int:
+    """
+    Runs `guardian report` command.
+    """
+    db = Database(config.database.path)
+    await db.connect()
+    try:
+        if await schema_version(db.db) < migrations()[-1][0]:
+            log.logger.error('Database schema is outdated, run `guardian db migrate` or start the bot first')
+            return 1
+        start = time.perf_counter()
+        stats = await report(db, args.by, args.days, args.fast)
+        seconds = time.perf_counter() - start
+    finally:
+        await db.close()
+    if args.limit > 0:
+        stats = stats[:args.limit]
+    print(format_stats(stats, args.by))
+    print(f'Aggregated in {seconds:.2f} seconds. Latencies of correct answers are in seconds, '
+          f'"fast" is the share of correct answers under {args.fast} seconds.', file=sys.stderr)
+    return 0
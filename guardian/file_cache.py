@@ -0,0 +1,55 @@
+import time
+from hashlib import sha1
+from guardian import log
+from guardian.redis import Redis
+
+FILES_KEY = 'file_id'
+LRU_KEY = 'file_id:lru'
+
+
+def cache_field(phrase: str, image: str) -> str:
+    digest = sha1(image.encode()).hexdigest()[:16]
+    return f'{phrase}:{digest}'
+
+
+class FileIdCache:
+    """
+    Telegram file_id of already uploaded captcha images keyed by query phrase and image.
+    Holds at most `max_size` entries, least recently used ones are evicted first.
+    """
+
+    def __init__(self, redis: Redis, max_size: int):
+        self.redis = redis.redis
+        self.max_size = max_size
+
+    async def get(self, phrase: str, image: str) -> str | None:
+        field = cache_field(phrase, image)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hget(FILES_KEY, field)
+            pipe.zadd(LRU_KEY, {field: time.time()}, xx=True)
+            file_id, _ = await pipe.execute()
+        return file_id
+
+    async def put(self, phrase: str, image: str, file_id: str):
+        field = cache_field(phrase, image)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(FILES_KEY, field, file_id)
+            pipe.zadd(LRU_KEY, {field: time.time()})
+            pipe.zcard(LRU_KEY)
+            *_, size = await pipe.execute()
+        if size > self.max_size:
+            await self.evict(size - self.max_size)
+
+    async def evict(self, count: int):
+        evicted = await self.redis.zpopmin(LRU_KEY, count)
+        fields = [field for field, _ in evicted]
+        if len(fields) > 0:
+            log.logger.info('Evicting %d file_id(s) from cache', len(fields))
+            await self.redis.hdel(FILES_KEY, *fields)
+
+    async def invalidate(self, phrase: str, image: str):
+        field = cache_field(phrase, image)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hdel(FILES_KEY, field)
+            pipe.zrem(LRU_KEY, field)
+            await pipe.execute()
@@ -1,6 +1,14 @@
 from typing import Union
 from aiogram.types import Message, CallbackQuery
 from aiogram.dispatcher.filters import BoundFilter
+from guardian.admins import AdminCache
+
+# Sender of messages posted in groups on behalf of channels.
+CHANNEL_BOT = 'Channel_Bot'
+
+
+def is_channel_message(message: Message | None) -> bool:
+    return message is not None and message.from_user is not None and message.from_user.username == CHANNEL_BOT
 
 
 class UsernameFilter(BoundFilter):
@@ -11,3 +19,19 @@ class UsernameFilter(BoundFilter):
 
     async def check(self, obj: Union[Message, CallbackQuery]):
         return obj.from_user.username == self.username
+
+
+class ChatAdminFilter(BoundFilter):
+    """
+    Passes messages and callback queries of chat administrators, checked against the given cache.
+    """
+    key = 'chat_admins'
+
+    def __init__(self, chat_admins: AdminCache):
+        self.admins = chat_admins
+
+    async def check(self, obj: Union[Message, CallbackQuery]):
+        message = obj if isinstance(obj, Message) else obj.message
+        if message is None:
+            return False
+        return await self.admins.is_admin(message.chat.id, obj.from_user.id)
@@ -0,0 +1,166 @@
+import time
+import random
+import asyncio
+import aiohttp
+from guardian import log, metrics
+
+# Response statuses worth retrying.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class HttpStatusError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f'HTTP {status} from {url}')
+        self.status = status
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and fails fast for `reset_timeout` seconds.
+    After that a single trial request is let through (half-open state),
+    which either closes the circuit on success or opens it again on failure.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    # Values of HTTP_BREAKER_STATE metric
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.set_state(self.CLOSED)
+
+    def set_state(self, state: str):
+        self.state = state
+        metrics.HTTP_BREAKER_STATE.set(self.STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.set_state(self.HALF_OPEN)
+            return True
+        return self.state == self.CLOSED
+
+    def success(self):
+        self.set_state(self.CLOSED)
+        self.failures = 0
+
+    def release(self):
+        """
+        Gives up the trial of a half-open breaker without an outcome, e.g. when the request was cancelled.
+        """
+        if self.state == self.HALF_OPEN:
+            self.set_state(self.OPEN)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                log.logger.warning(f'Circuit breaker is open after {self.failures} failure(s)')
+            self.set_state(self.OPEN)
+            self.opened_at = time.monotonic()
+
+
+class HttpClient:
+    """
+    Long-lived HTTP client with keep-alive connections, timeouts, retries and a circuit breaker.
+    """
+
+    def __init__(self, total_timeout: float, connect_timeout: float, limit_per_host: int,
+                 retries: int, backoff: float, breaker: CircuitBreaker):
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.limit_per_host = limit_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker
+        self.session = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection_created)
+            trace.on_connection_reuseconn.append(self._on_connection_reused)
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                 trace_configs=[trace])
+        return self.session
+
+    @staticmethod
+    async def _on_connection_created(_session, _ctx, _params):
+        metrics.HTTP_CONNECTIONS.inc('created')
+
+    @staticmethod
+    async def _on_connection_reused(_session, _ctx, _params):
+        metrics.HTTP_CONNECTIONS.inc('reused')
+
+    async def get_json(self, url: str, params: dict = None, headers: dict = None):
+        return await self.get(url, lambda r: r.json(), params, headers)
+
+    async def get_bytes(self, url: str, params: dict = None, headers: dict = None) -> bytes:
+        return await self.get(url, lambda r: r.read(), params, headers)
+
+    async def get(self, url: str, read, params: dict = None, headers: dict = None):
+        if not self.breaker.allow():
+            metrics.HTTP_REQUESTS.inc('rejected')
+            raise CircuitOpenError(f'Circuit breaker is open, not requesting {url}')
+
+        # Every allowed request must report its outcome, or a half-open breaker never lets another one through
+        try:
+            data = await self.request(url, read, params, headers)
+        except HttpStatusError as e:
+            if e.status in RETRY_STATUSES:
+                self.failed()
+            else:
+                # The service is up, it just refuses this request
+                self.breaker.success()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except BaseException:
+            self.failed()
+            raise
+        self.breaker.success()
+        return data
+
+    async def request(self, url: str, read, params: dict = None, headers: dict = None):
+        session = self.get_session()
+        attempt = 0
+        while True:
+            metrics.HTTP_REQUESTS.inc('attempt')
+            try:
+                with metrics.HTTP_SECONDS.time():
+                    async with session.get(url, params=params, headers=headers) as response:
+                        if response.status >= 400:
+                            raise HttpStatusError(response.status, url)
+                        return await read(response)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError, HttpStatusError) as e:
+                if attempt >= self.retries or isinstance(e, HttpStatusError) and e.status not in RETRY_STATUSES:
+                    raise
+                # Full jitter exponential backoff
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                attempt += 1
+                metrics.HTTP_REQUESTS.inc('retry')
+                log.logger.warning(f'{e.__class__.__name__} requesting {url}, retry {attempt} in {delay:.2f}s')
+                await asyncio.sleep(delay)
+
+    def failed(self):
+        metrics.HTTP_REQUESTS.inc('failure')
+        self.breaker.failure()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def from_config(config) -> HttpClient:
+    breaker = CircuitBreaker(config.breaker_threshold, config.breaker_reset_timeout)
+    return HttpClient(config.total_timeout, config.connect_timeout, config.limit_per_host,
+                      config.retries, config.backoff, breaker)
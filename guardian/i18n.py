@@ -1,6 +1,10 @@
+import ast
+import os
 import yaml
+import marshal
+from string import Formatter
 from pathlib import Path
-from typing import Any, Dict, Tuple, Optional, Callable
+from typing import Any, Dict, Tuple, Optional, Callable, Awaitable
 from contextvars import ContextVar
 from aiogram import types
 from aiogram.dispatcher.middlewares import BaseMiddleware
@@ -14,19 +18,124 @@ class TranslationPathError(Exception):
     pass
 
 
+I18N_DIR = Path(__file__).resolve().parent.parent.joinpath('i18n')
+SOURCES_DIR = Path(__file__).resolve().parent
+CATALOG_FILE = I18N_DIR.joinpath('catalog.bin')
+CATALOG_VERSION = 1
+
+
+def flatten(tree: dict, prefix: str = '') -> Dict[str, str]:
+    flat = {}
+    for key, value in tree.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            flat |= flatten(value, path + '.')
+        else:
+            flat[path] = value
+    return flat
+
+
+def placeholders(template: str) -> set[str]:
+    return {field for _, field, _, _ in Formatter().parse(template) if field}
+
+
+def is_i18n(node: ast.expr) -> bool:
+    return isinstance(node, ast.Name) and node.id == 'i18n' \
+        or isinstance(node, ast.Attribute) and node.attr == 'i18n'
+
+
+def find_calls(directory: Path = SOURCES_DIR) -> Dict[str, set[str]]:
+    """
+    Finds `i18n.t('path', **kwargs)` and `<obj>.i18n.t('path', **kwargs)` calls in source files,
+    returns keyword argument names per translation path.
+    """
+    calls = {}
+    for f in sorted(directory.glob('*.py')):
+        for node in ast.walk(ast.parse(f.read_text(), str(f))):
+            if isinstance(node, ast.Call) \
+                    and isinstance(node.func, ast.Attribute) and node.func.attr == 't' \
+                    and is_i18n(node.func.value) \
+                    and len(node.args) > 0 and isinstance(node.args[0], ast.Constant):
+                kwargs = calls.setdefault(node.args[0].value, set())
+                kwargs.update(k.arg for k in node.keywords if k.arg is not None)
+    return calls
+
+
+def check_catalog(catalog: Dict[Tuple[str, str], str], calls: Dict[str, set[str]]) -> list[str]:
+    errors = []
+    locales = sorted({locale for locale, _ in catalog})
+    paths = sorted({path for _, path in catalog} | calls.keys())
+    for path in paths:
+        templates = {locale: catalog.get((locale, path)) for locale in locales}
+        for locale, template in templates.items():
+            if template is None:
+                errors.append(f'Missing translation for path "{path}" with locale "{locale}"')
+                continue
+            # Template is returned as is when i18n.t() is called without keyword arguments
+            kwargs = calls.get(path)
+            if not kwargs:
+                continue
+            missing = placeholders(template) - kwargs
+            if len(missing) > 0:
+                errors.append(f'Placeholders {sorted(missing)} of "{locale}.{path}" are not passed to i18n.t()')
+        fields = {frozenset(placeholders(t)) for t in templates.values() if t is not None}
+        if len(fields) > 1:
+            errors.append(f'Translations for path "{path}" have different placeholders')
+    return errors
+
+
+def source_mtimes() -> Dict[str, int]:
+    return {f.name: f.stat().st_mtime_ns for f in sorted(I18N_DIR.glob('*.yaml'))}
+
+
+def compile_catalog(translations: Dict[str, dict]) -> Dict[Tuple[str, str], str]:
+    catalog = {}
+    for locale, tree in translations.items():
+        for path, template in flatten(tree).items():
+            catalog[(locale, path)] = template
+    return catalog
+
+
+def write_catalog(catalog: Dict[Tuple[str, str], str], file: Path = CATALOG_FILE):
+    tmp = file.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        marshal.dump((CATALOG_VERSION, source_mtimes(), catalog), f)
+    os.replace(tmp, file)
+
+
+def load_catalog(file: Path = CATALOG_FILE) -> Dict[Tuple[str, str], str]:
+    """
+    Loads compiled catalog, recompiles it from YAML files when it's missing or outdated.
+    """
+    try:
+        with open(file, 'rb') as f:
+            version, mtimes, catalog = marshal.load(f)
+        if version == CATALOG_VERSION and mtimes == source_mtimes():
+            return catalog
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+    catalog = compile_catalog(I18nMiddleware.load_translations())
+    try:
+        write_catalog(catalog, file)
+    except OSError:
+        pass
+    return catalog
+
+
 class I18nMiddleware(BaseMiddleware):
     ctx_locale = ContextVar('ctx_chat_locale', default=None)
 
-    def __init__(self, get_lang: Callable[[int], Optional[str]], default: str = 'en'):
+    def __init__(self, get_lang: Callable[[int], Awaitable[Optional[str]]], default: str = 'en'):
         super(I18nMiddleware, self).__init__()
         self.get_lang = get_lang
         self.default = default
-        self.translations = self.load_translations()
+        self.catalog = load_catalog()
+        self.locales = {locale for locale, _ in self.catalog}
 
     @staticmethod
     def load_translations() -> Dict[str, dict]:
         translations = {}
-        files = Path(__file__).resolve().parent.parent.joinpath('i18n').glob('*.yaml')
+        files = I18N_DIR.glob('*.yaml')
         for f in files:
             with open(f, 'r') as stream:
                 translations |= yaml.safe_load(stream)
@@ -35,25 +144,23 @@ class I18nMiddleware(BaseMiddleware):
     def t(self, path: str, locale: Optional[str] = None, **kwargs) -> str:
         if locale is None:
             locale = self.ctx_locale.get()
-        value = self.translations.get(locale)
-        if value is None:
-            raise LocaleError(f'Wrong locale or missing translations for locale "{locale}"')
-        for p in path.split('.'):
-            value = value.get(p)
-            if value is None:
-                raise TranslationPathError(
-                    f'No translation for path "{path}" with locale "{locale}"')
-        if len(kwargs) > 0:
+        try:
+            value = self.catalog[locale, path]
+        except KeyError:
+            if locale not in self.locales:
+                raise LocaleError(f'Wrong locale or missing translations for locale "{locale}"')
+            raise TranslationPathError(f'No translation for path "{path}" with locale "{locale}"')
+        if kwargs:
             return value.format(**kwargs)
         return value
 
-    def get_chat_locale(self, args: Tuple[Any]) -> str:
+    async def get_chat_locale(self, args: Tuple[Any]) -> str:
         chat: Optional[types.Chat] = types.Chat.get_current()
         chat_id: Optional[int] = chat.id if chat else None
 
         if chat_id:
             *_, data = args
-            lang = self.get_lang(chat_id) or self.default
+            lang = await self.get_lang(chat_id) or self.default
             data['i18n'] = self
             return lang
         return self.default
@@ -62,6 +169,6 @@ class I18nMiddleware(BaseMiddleware):
         if 'update' not in action \
                 and 'error' not in action \
                 and action.startswith('pre_process'):
-            locale = self.get_chat_locale(args)
+            locale = await self.get_chat_locale(args)
             self.ctx_locale.set(locale)
             return True
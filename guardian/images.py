@@ -0,0 +1,83 @@
+import io
+from aiogram.types import InputFile
+from guardian import log
+from guardian.util import log_exception
+
+
+class UnknownProviderError(Exception):
+    pass
+
+
+class Image:
+    """
+    Captcha image, either a remote `url` or raw `data` bytes.
+    `key` uniquely identifies the image within its query phrase (used by file_id cache).
+    """
+
+    def __init__(self, key: str, url: str | None = None, data: bytes | memoryview | None = None):
+        self.key = key
+        self.url = url
+        self.data = data
+
+    def as_photo(self) -> str | InputFile:
+        if self.url is not None:
+            return self.url
+        return InputFile(io.BytesIO(self.data), filename=f'{self.key}.jpg')
+
+    def __repr__(self):
+        source = self.url if self.url is not None else f'<{len(self.data)} bytes>'
+        return f'{self.__class__.__name__}(key={self.key!r} source={source})'
+
+
+class ImageProvider:
+    name = None
+
+    async def get_image(self, query: str) -> Image | None:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class ChainProvider(ImageProvider):
+    """
+    Asks providers in order and returns the first image found.
+    """
+    name = 'chain'
+
+    def __init__(self, providers: list[ImageProvider]):
+        self.providers = providers
+
+    async def get_image(self, query: str) -> Image | None:
+        for provider in self.providers:
+            try:
+                image = await provider.get_image(query)
+            except Exception as e:
+                log_exception(e)
+                continue
+            if image is not None:
+                return image
+            log.logger.info('No image for "%s" from %s provider', query, provider.name)
+        return None
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.close()
+
+
+def create_provider(names: list[str], http, corpus_path: str) -> ImageProvider:
+    from guardian.qwant import QwantProvider
+    from guardian.corpus import Corpus, LocalProvider
+
+    providers = []
+    for name in names:
+        match name:
+            case QwantProvider.name:
+                providers.append(QwantProvider(http))
+            case LocalProvider.name:
+                providers.append(LocalProvider(Corpus(corpus_path)))
+            case _:
+                raise UnknownProviderError(f'Unknown image provider: {name!r}')
+    if len(providers) == 1:
+        return providers[0]
+    return ChainProvider(providers)
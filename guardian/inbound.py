@@ -0,0 +1,179 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, Awaitable
+from aiogram.types import Update
+from guardian import metrics
+from guardian.filters import is_channel_message
+
+# Update priorities, the least important updates are dropped first when a chat queue overflows.
+LOW, NORMAL, HIGH = 0, 1, 2
+PRIORITY_NAMES = ('low', 'normal', 'high')
+OVERFLOW_POLICIES = ('low_priority', 'oldest', 'newest')
+
+
+def update_priority(update: Update) -> int:
+    message = update.message
+    if update.callback_query is not None or is_channel_message(message):
+        return HIGH
+    if message is not None:
+        if message.new_chat_members:
+            return HIGH
+        if message.left_chat_member is not None:
+            return LOW
+    return NORMAL
+
+
+def update_chat_id(update: Update) -> int | None:
+    message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+    if message is None and update.callback_query is not None:
+        message = update.callback_query.message
+    if message is not None:
+        return message.chat.id
+    for chat_update in (update.my_chat_member, update.chat_member, update.chat_join_request):
+        if chat_update is not None:
+            return chat_update.chat.id
+    return None
+
+
+class Turn:
+    """
+    Turn of an update being handled, holds a slot of `concurrency` except while lent out with `lend_slot`.
+    """
+
+    def __init__(self, semaphore: asyncio.Semaphore):
+        self.semaphore = semaphore
+        self.held = False
+        self.ended = False
+        # Number of requests of the handler waiting with the slot lent out
+        self.waiting = 0
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        # Tasks spawned by the handler inherit its turn and can outlive it
+        if self.ended:
+            self.semaphore.release()
+        else:
+            self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+    def end(self):
+        self.ended = True
+        self.release()
+
+
+# Turn of the update handled by the current task.
+current_turn: ContextVar[Turn | None] = ContextVar('inbound_turn', default=None)
+
+
+@asynccontextmanager
+async def lend_slot():
+    """
+    Lets updates of other chats use the concurrency slot of the current update within the block.
+    Used while the handler waits for something else to be done, such as outbound rate limits.
+    The chat's turn is kept, so the next update of the chat still waits for the handler to finish.
+    """
+    turn = current_turn.get()
+    if turn is None:
+        yield
+        return
+    turn.waiting += 1
+    if turn.waiting == 1:
+        turn.release()
+    try:
+        yield
+    finally:
+        turn.waiting -= 1
+        if turn.waiting == 0 and not turn.held and not turn.ended:
+            await turn.acquire()
+
+
+class ChatExecutor:
+    """
+    Handles updates of the same chat one at a time in order of arrival, and at most `concurrency` updates at once.
+    At most `queue_size` updates of a chat wait for their turn, when one more arrives an update is dropped
+    according to `overflow` policy:
+        low_priority - the least important one (see `update_priority`), the newest of equally important ones
+        oldest - the oldest waiting one
+        newest - the incoming one
+    A handler may lend its slot of `concurrency` out while waiting with `lend_slot`.
+    """
+
+    def __init__(self, concurrency: int, queue_size: int, overflow: str):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy "{overflow}", expected one of {OVERFLOW_POLICIES}')
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queue_size = queue_size
+        self.overflow = overflow
+        # Chat ID -> deque of (priority, future), the head is being handled, futures of the rest resolve
+        # to True when it's their turn or to False when they're dropped.
+        self.queues = {}
+
+    def drop(self, queue: deque, priority: int) -> bool:
+        """
+        Makes room in a full queue, returns False if the incoming update should be dropped instead.
+        """
+        if self.overflow == 'newest' or len(queue) < 2:
+            return False
+        if self.overflow == 'oldest':
+            entry = queue[1]
+        else:
+            # Waiting update of the lowest priority, the oldest of them
+            entry = min(list(queue)[1:], key=lambda e: e[0])
+            if entry[0] >= priority:
+                return False
+        queue.remove(entry)
+        entry[1].set_result(False)
+        metrics.INBOUND_DROPPED.inc(PRIORITY_NAMES[entry[0]])
+        return True
+
+    async def submit(self, update: Update, process: Callable[[Update], Awaitable]):
+        """
+        Waits for the turn of `update` and handles it with `process`, returns None if update is dropped.
+        """
+        chat_id, priority = update_chat_id(update), update_priority(update)
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = self.queues[chat_id] = deque()
+        if len(queue) > self.queue_size and not self.drop(queue, priority):
+            metrics.INBOUND_DROPPED.inc(PRIORITY_NAMES[priority])
+            return None
+        entry = (priority, asyncio.get_running_loop().create_future())
+        queue.append(entry)
+        if len(queue) == 1:
+            entry[1].set_result(True)
+        try:
+            if not await entry[1]:
+                return None
+            turn = Turn(self.semaphore)
+            await turn.acquire()
+            token = current_turn.set(turn)
+            try:
+                return await process(update)
+            finally:
+                current_turn.reset(token)
+                turn.end()
+        finally:
+            self.leave(chat_id, queue, entry)
+
+    def leave(self, chat_id: int | None, queue: deque, entry: tuple):
+        if len(queue) > 0 and queue[0] is entry:
+            queue.popleft()
+            if len(queue) > 0:
+                queue[0][1].set_result(True)
+            else:
+                del self.queues[chat_id]
+        elif entry in queue:
+            # Cancelled while waiting
+            queue.remove(entry)
+
+    async def depth(self) -> int:
+        """
+        Returns number of updates being handled or waiting.
+        """
+        return sum(len(queue) for queue in self.queues.values())
@@ -1,5 +1,10 @@
 import sys
+import json
+import time
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from aiogram import types
 
 
 class Formatter(logging.Formatter):
@@ -18,14 +23,102 @@ class Formatter(logging.Formatter):
         logging.CRITICAL: f'{bold_red}%(levelname)s{reset}:{fmt}'
     }
 
+    def __init__(self):
+        super().__init__()
+        self.formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            formatter = self.formatters[record.levelno] = logging.Formatter()
         return formatter.format(record)
 
 
+class JsonFormatter(logging.Formatter):
+    CONTEXT = ('chat_id', 'user_id', 'update_id')
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'name': record.name,
+            'message': record.getMessage()
+        }
+        for field in self.CONTEXT:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attaches chat, user and update IDs of the update being processed to log records.
+    Has to be attached to a handler running in the event loop thread,
+    since update context isn't available in the background writer thread.
+    """
+
+    def filter(self, record):
+        update = types.Update.get_current(no_error=True)
+        chat = types.Chat.get_current(no_error=True)
+        user = types.User.get_current(no_error=True)
+        record.update_id = update.update_id if update else None
+        record.chat_id = chat.id if chat else None
+        record.user_id = user.id if user else None
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rate` records below WARNING level with the same message template per second.
+    The next record let through after suppression reports the number of suppressed records.
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self.second = 0
+        self.counts = {}
+        self.suppressed = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        second = int(time.monotonic())
+        if second != self.second:
+            self.second = second
+            self.counts.clear()
+        key = (record.name, record.msg)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count > self.rate:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+        suppressed = self.suppressed.pop(key, 0)
+        if suppressed > 0:
+            record.msg = f'{record.msg} ({suppressed} similar message(s) suppressed)'
+        return True
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are, so they're formatted by the writer thread along with their exceptions.
+    QueueHandler formats records beforehand, since they may be pickled, which an in-process queue doesn't do.
+    """
+
+    def prepare(self, record):
+        return record
+
+
 class Log(sys.modules[__name__].__class__):
-    def init(self, level: str):
+    def init(self, level: str, fmt: str = 'text', use_queue: bool = False, rate_limit: int = 0):
+        """
+        :param fmt: "text" for colored text lines, "json" for JSON lines with update context.
+        :param use_queue: Hand records over to a background writer thread.
+        :param rate_limit: Max number of records per second with the same message template, 0 for no limit.
+        """
         level = level.upper()
         if level not in logging._nameToLevel:
             raise ValueError('Unknown logging level: %r' % level)
@@ -34,11 +127,35 @@ class Log(sys.modules[__name__].__class__):
         self.lgr = logging.getLogger()
         self.lgr.setLevel(self.level)
         ch = logging.StreamHandler()
-        ch.setLevel(self.level)
-        ch.setFormatter(Formatter())
-        self.lgr.addHandler(ch)
+        match fmt:
+            case 'text':
+                ch.setFormatter(Formatter())
+            case 'json':
+                ch.setFormatter(JsonFormatter())
+            case _:
+                raise ValueError('Unknown logging format: %r' % fmt)
+
+        if use_queue:
+            q = queue.SimpleQueue()
+            self.listener = QueueListener(q, ch)
+            self.listener.start()
+            handler = LocalQueueHandler(q)
+        else:
+            handler = ch
+        handler.setLevel(self.level)
+        if fmt == 'json':
+            handler.addFilter(ContextFilter())
+        if rate_limit > 0:
+            handler.addFilter(RateLimitFilter(rate_limit))
+        self.lgr.addHandler(handler)
         return self.lgr
 
+    def stop(self):
+        listener = getattr(self, 'listener', None)
+        if listener is not None:
+            listener.stop()
+            self.listener = None
+
     def get_logger(self):
         if getattr(self, 'lgr', None) is None:
             raise RuntimeError('Logger was not initialized')
@@ -0,0 +1,277 @@
+import re
+import os
+import csv
+import sys
+import argparse
+import json
+import time
+import asyncio
+import aiosqlite
+from pathlib import Path
+from typing import Iterator, TextIO
+from redis.exceptions import RedisError
+from guardian import log, settings
+from guardian.database import PRAGMAS
+from guardian.redis import Redis
+from guardian.settings import Setting
+from guardian.util import log_exception, AttrDict
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent.joinpath('migrations')
+MIGRATION_RE = re.compile(r'^(\d+)-.+\.sql$')
+FORMATS = ('jsonl', 'csv')
+FIELDS = ('chat_id', 'setting_id', 'value')
+EXPORT_SETTINGS = 'SELECT chat_id, setting_id, value FROM settings ORDER BY chat_id, setting_id'
+IMPORT_SETTING = """
+INSERT INTO settings VALUES (?, ?, ?)
+ON CONFLICT (chat_id, setting_id) DO UPDATE SET value = excluded.value
+"""
+# Rows fetched from SQLite thread at once on export.
+EXPORT_BATCH = 1000
+# Import releases write lock for WRITE_PAUSE seconds after every WRITE_SLICE seconds of writing.
+# Waiting writers retry to take the lock every 100 ms at most, so the pause lets bot writes through.
+WRITE_SLICE = 1
+WRITE_PAUSE = 0.12
+SETTING_IDS = frozenset(setting.value for setting in Setting)
+# Source of settings changes announced on import, see `Settings.listen`.
+IMPORT_INSTANCE_ID = 'import'
+
+
+def migrations(directory: Path = MIGRATIONS_DIR) -> list[tuple[int, Path]]:
+    """
+    Returns (version, file) of migration files named "<version>-<description>.sql" in order of versions.
+    """
+    files = []
+    for f in directory.glob('*.sql'):
+        match = MIGRATION_RE.match(f.name)
+        if match is not None:
+            files.append((int(match[1]), f))
+    return sorted(files)
+
+
+async def schema_version(db: aiosqlite.Connection) -> int:
+    async with db.execute('PRAGMA user_version') as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def connect(path: str) -> aiosqlite.Connection:
+    db = await aiosqlite.connect(path)
+    await db.executescript(';'.join(PRAGMAS))
+    return db
+
+
+async def migrate(db: aiosqlite.Connection, directory: Path = MIGRATIONS_DIR) -> list[int]:
+    """
+    Applies migrations newer than the schema version stored in `user_version` pragma, each in its own transaction.
+    Returns versions of applied migrations.
+    """
+    applied = []
+    version = await schema_version(db)
+    for number, f in migrations(directory):
+        if number <= version:
+            continue
+        try:
+            await db.executescript(f'BEGIN IMMEDIATE;\n{f.read_text()}\nPRAGMA user_version = {number};\nCOMMIT;')
+        except Exception:
+            await db.rollback()
+            raise
+        log.logger.info('Applied migration %s', f.name)
+        applied.append(number)
+    return applied
+
+
+def detect_format(file: str, fmt: str | None) -> str:
+    if fmt is None:
+        fmt = Path(file).suffix.lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format "{fmt}" of "{file}", expected one of {FORMATS}')
+    return fmt
+
+
+def open_file(file: str, mode: str) -> TextIO:
+    if file == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    return open(file, mode, newline='', encoding='utf-8')
+
+
+async def export_settings(db: aiosqlite.Connection, out: TextIO, fmt: str) -> int:
+    """
+    Writes settings to `out` as they are read, so memory use doesn't depend on number of rows.
+    """
+    writer = csv.writer(out) if fmt == 'csv' else None
+    if writer is not None:
+        writer.writerow(FIELDS)
+    count = 0
+    async with db.execute(EXPORT_SETTINGS) as cursor:
+        while True:
+            rows = await cursor.fetchmany(EXPORT_BATCH)
+            if len(rows) == 0:
+                break
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                out.writelines(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+    return count
+
+
+def parse_row(chat_id, setting_id, value) -> tuple[int, int, str]:
+    row = int(chat_id), int(setting_id), value
+    if row[1] not in SETTING_IDS:
+        raise ValueError(f'Unknown setting ID {setting_id}')
+    if not isinstance(value, str):
+        raise ValueError(f'Value {value!r} is not a string')
+    return row
+
+
+def read_settings(stream: TextIO, fmt: str) -> Iterator[tuple[int, tuple[int, int, str] | None]]:
+    """
+    Yields (line number, row) of every row, row is None if it's invalid.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        lines = ((reader.line_num, (r.get('chat_id'), r.get('setting_id'), r.get('value'))) for r in reader)
+    else:
+        lines = ((n, line) for n, line in enumerate(stream, 1) if not line.isspace())
+    for n, line in lines:
+        try:
+            if fmt == 'jsonl':
+                entry = json.loads(line)
+                line = entry['chat_id'], entry['setting_id'], entry['value']
+            yield n, parse_row(*line)
+        except (ValueError, TypeError, KeyError) as e:
+            log.logger.warning('Skipping line %d: %s', n, e)
+            yield n, None
+
+
+def chunks(rows: Iterator, size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+async def announce(redis: Redis, rows: list[tuple[int, int, str]]):
+    """
+    Updates settings cached by running bot instances.
+    """
+    try:
+        async with redis.redis.pipeline(transaction=False) as pipe:
+            for chat_id, setting_id, value in rows:
+                pipe.publish(settings.CHANNEL, json.dumps([IMPORT_INSTANCE_ID, chat_id, setting_id, value]))
+            await pipe.execute()
+    except RedisError as e:
+        log_exception(e)
+
+
+async def write_chunk(db: aiosqlite.Connection, rows: list[tuple[int, int, str]]):
+    try:
+        await db.executemany(IMPORT_SETTING, rows)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def import_settings(db: aiosqlite.Connection, stream: TextIO, fmt: str, chunk_size: int,
+                          redis: Redis | None = None) -> dict:
+    """
+    Upserts settings read from `stream`, `chunk_size` rows per transaction.
+    The next chunk is parsed while SQLite thread writes the previous one.
+    In WAL mode readers aren't blocked, and bot writes wait for about WRITE_SLICE seconds at most.
+    """
+    imported, skipped, start = 0, 0, time.perf_counter()
+    resumed = start
+    writing, written = None, []
+
+    async def wait():
+        nonlocal imported
+        try:
+            await writing
+        except Exception:
+            log.logger.error('Import failed after %d row(s) imported', imported)
+            raise
+        imported += len(written)
+        if redis is not None:
+            await announce(redis, written)
+
+    for chunk in chunks(read_settings(stream, fmt), chunk_size):
+        rows = [row for _, row in chunk if row is not None]
+        skipped += len(chunk) - len(rows)
+        if writing is not None:
+            await wait()
+            if time.perf_counter() - resumed >= WRITE_SLICE:
+                await asyncio.sleep(WRITE_PAUSE)
+                resumed = time.perf_counter()
+        writing, written = asyncio.ensure_future(write_chunk(db, rows)), rows
+        # Hand the chunk over to SQLite thread before parsing the next one
+        await asyncio.sleep(0)
+    if writing is not None:
+        await wait()
+    seconds = time.perf_counter() - start
+    return {
+        'imported': imported,
+        'skipped': skipped,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(imported / seconds) if seconds > 0 else None
+    }
+
+
+async def vacuum(db: aiosqlite.Connection, path: str, into: str | None = None) -> tuple[int, int]:
+    """
+    Rebuilds the database file or writes its compacted copy to `into`, which doesn't block writers.
+    Returns sizes before and after in bytes.
+    """
+    before = os.path.getsize(path)
+    if into is not None:
+        await db.execute('VACUUM INTO ?', (into,))
+        return before, os.path.getsize(into)
+    await db.executescript('VACUUM; PRAGMA optimize; PRAGMA wal_checkpoint(TRUNCATE)')
+    return before, os.path.getsize(path)
+
+
+async def run(config: AttrDict, args: argparse.Namespace) -> int:
+    """
+    Runs `guardian db` subcommand.
+    """
+    db = await connect(config.database.path)
+    redis = None
+    try:
+        match args.db_command:
+            case 'migrate':
+                applied = await migrate(db)
+                log.logger.info('Schema version %d, %d migration(s) applied', await schema_version(db), len(applied))
+            case 'export':
+                fmt = detect_format(args.file, args.format)
+                out = open_file(args.file, 'w')
+                try:
+                    count = await export_settings(db, out, fmt)
+                finally:
+                    if out is not sys.stdout:
+                        out.close()
+                log.logger.info('Exported %d setting(s)', count)
+            case 'import':
+                fmt = detect_format(args.file, args.format)
+                if args.notify:
+                    redis = Redis(config.redis.url)
+                stream = open_file(args.file, 'r')
+                try:
+                    stats = await import_settings(db, stream, fmt, args.chunk_size, redis)
+                finally:
+                    if stream is not sys.stdin:
+                        stream.close()
+                log.logger.info('Import stats: %s', stats)
+            case 'vacuum':
+                before, after = await vacuum(db, config.database.path, args.into)
+                log.logger.info('Database size %d -> %d bytes', before, after)
+    except ValueError as e:
+        log.logger.error(e)
+        return 1
+    finally:
+        await db.close()
+        if redis is not None:
+            await redis.close()
+    return 0
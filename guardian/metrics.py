@@ -0,0 +1,201 @@
+import time
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Awaitable
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    async def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    async def render(self) -> str:
+        header = f'# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n'
+        return header + ''.join(line + '\n' for line in await self.samples())
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    async def samples(self) -> list[str]:
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {value}'
+                for labels, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """
+    Gauge which value is either set directly or collected by an async `collect` function on every scrape.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+        self.collect = None
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def set_function(self, collect: Callable[[], Awaitable[float]]):
+        self.collect = collect
+
+    async def samples(self) -> list[str]:
+        if self.collect is not None:
+            self.values[()] = await self.collect()
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {value}'
+                for labels, value in self.values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # labels -> [count per bucket..., count in +Inf bucket, sum]
+        self.values = {}
+
+    def observe(self, value: float, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    async def samples(self) -> list[str]:
+        lines = []
+        for labels, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+HANDLER_SECONDS = Histogram('guardian_handler_seconds', 'Update handler latency.', ('handler',))
+TELEGRAM_SECONDS = Histogram('guardian_telegram_request_seconds', 'Telegram Bot API request latency.',
+                             ('method',))
+HTTP_SECONDS = Histogram('guardian_image_search_seconds', 'Image search (Qwant) request latency.')
+HTTP_REQUESTS = Counter('guardian_image_search_requests_total',
+                        'Image search requests (attempt, retry, failure, rejected by open circuit breaker).',
+                        ('event',))
+HTTP_CONNECTIONS = Counter('guardian_image_search_connections_total', 'Image search connections (created, reused).',
+                           ('event',))
+HTTP_BREAKER_STATE = Gauge('guardian_image_search_breaker_state',
+                           'Image search circuit breaker state (0 closed, 1 half-open, 2 open).')
+REDIS_SECONDS = Histogram('guardian_redis_command_seconds', 'Redis command latency.', ('command',))
+SQLITE_SECONDS = Histogram('guardian_sqlite_query_seconds', 'SQLite query latency.', ('query',))
+LOOP_LAG_SECONDS = Histogram('guardian_event_loop_lag_seconds', 'Event loop lag.')
+CAPTCHA_OUTCOMES = Counter('guardian_captcha_outcomes_total', 'Captcha outcomes.', ('outcome',))
+CAPTCHA_EVENTS_DROPPED = Counter('guardian_captcha_events_dropped_total',
+                                 'Captcha events dropped from full buffer before being stored.')
+PENDING_JOBS = Gauge('guardian_pending_jobs', 'Pending scheduled jobs (captcha timeouts, message deletions).')
+INBOUND_QUEUE_DEPTH = Gauge('guardian_inbound_queue_depth', 'Updates being handled or waiting in chat queues.')
+INBOUND_DROPPED = Counter('guardian_inbound_dropped_total', 'Updates dropped on chat queue overflow.', ('priority',))
+SKIPPED_UPDATES = Counter('guardian_skipped_updates_total', 'Updates dropped as irrelevant before dispatching.')
+OUTBOUND_QUEUE_DEPTH = Gauge('guardian_outbound_queue_depth', 'Bot API requests waiting in outbound queue.')
+OUTBOUND_WAIT_SECONDS = Histogram('guardian_outbound_wait_seconds', 'Time Bot API requests wait in outbound queue.',
+                                  ('method',))
+OUTBOUND_DROPPED = Counter('guardian_outbound_dropped_total', 'Queued Bot API requests dropped as obsolete.',
+                           ('method',))
+OUTBOUND_RETRIES = Counter('guardian_outbound_retries_total', 'Bot API requests rejected by flood control.',
+                           ('method',))
+STREAM_ENTRIES = Counter('guardian_stream_entries_total',
+                         'Updates passed through Redis Streams (received, processed, failed, dead).', ('outcome',))
+CATCHUP_BACKLOG = Gauge('guardian_catchup_backlog_updates', 'Updates received while the bot was down.')
+CATCHUP_RELEVANT = Gauge('guardian_catchup_relevant_updates', 'Backlog updates left to handle after coalescing.')
+CATCHUP_SECONDS = Gauge('guardian_catchup_seconds', 'Time from fetching the backlog until it was handled.')
+CACHE_REQUESTS = Counter('guardian_cache_requests_total', 'Chat cache lookups (hit, miss).', ('cache', 'result'))
+CACHE_EVICTIONS = Counter('guardian_cache_evictions_total', 'Chats evicted from full chat cache.', ('cache',))
+CACHE_SIZE = Gauge('guardian_cache_size', 'Chats in chat cache.', ('cache',))
+FSM_STATES = Gauge('guardian_fsm_states', 'Users with FSM state (pending captchas and settings wizards).')
+
+
+async def render() -> str:
+    return ''.join([await metric.render() for metric in REGISTRY])
+
+
+async def handle_metrics(_request: web.Request) -> web.Response:
+    return web.Response(text=await render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def measure_loop_lag(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(loop.time() - start - interval, 0))
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Measures latency of update handlers, from the moment filters pass until post-processing.
+    """
+
+    @staticmethod
+    def start(data: dict):
+        handler = current_handler.get(None)
+        if handler is not None:
+            data['metrics_handler'] = handler.__name__
+            data['metrics_start'] = time.perf_counter()
+
+    @staticmethod
+    def stop(data: dict):
+        start = data.pop('metrics_start', None)
+        if start is not None:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, data.pop('metrics_handler'))
+
+    async def on_process_message(self, _message, data: dict):
+        self.start(data)
+
+    async def on_post_process_message(self, _message, _results, data: dict):
+        self.stop(data)
+
+    async def on_process_callback_query(self, _query, data: dict):
+        self.start(data)
+
+    async def on_post_process_callback_query(self, _query, _results, data: dict):
+        self.stop(data)
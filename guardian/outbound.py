@@ -0,0 +1,183 @@
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+from guardian import metrics
+
+# Lower value is sent first, methods not listed here bypass the queue.
+PRIORITIES = {
+    'restrictChatMember': 0,
+    'banChatSenderChat': 0,
+    'sendPhoto': 1,
+    'answerCallbackQuery': 2,
+    'deleteMessage': 3,
+    'sendMessage': 4,
+}
+# Methods posting messages, limited per chat in addition to the global limit.
+CHAT_LIMITED = {'sendPhoto', 'sendMessage'}
+# Seconds between pruning of idle per chat buckets.
+PRUNE_INTERVAL = 60
+
+# Called right before a queued request is sent, the request is dropped if it returns True.
+obsolete_check: ContextVar[Callable[[], bool] | None] = ContextVar('obsolete_check', default=None)
+
+
+class ObsoleteRequestError(Exception):
+    pass
+
+
+@contextmanager
+def drop_if(check: Callable[[], bool]):
+    """
+    Requests made within the block are dropped with ObsoleteRequestError when `check()` is True
+    by the time their turn comes.
+    """
+    token = obsolete_check.set(check)
+    try:
+        yield
+    finally:
+        obsolete_check.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """
+        Returns seconds until a token is available.
+        """
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        delay = max(self.blocked_until - now, 0)
+        if self.tokens < 1:
+            delay = max(delay, (1 - self.tokens) / self.rate)
+        return delay
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        return self.delay(now) == 0 and self.tokens >= self.burst
+
+
+class OutboundQueue:
+    """
+    Orders outgoing Bot API requests by priority and releases them as token buckets allow:
+    `global_rate` requests per second in total and `chat_rate` messages per minute to the same chat.
+    A chat which is out of tokens doesn't hold back requests to other chats.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate / 60
+        self.chat_burst = chat_burst
+        self.chats = {}
+        # Heap of (priority, sequence number, method, chat_id, enqueue time, future)
+        self.queue = []
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.pruned = time.monotonic()
+        self.task = None
+
+    def chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, method: str, chat_id: int | str | None):
+        """
+        Waits for the turn of request to `method`, `chat_id` is given for messages limited per chat.
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        future = asyncio.get_running_loop().create_future()
+        entry = (PRIORITIES[method], next(self.sequence), method, chat_id, time.monotonic(), future)
+        heapq.heappush(self.queue, entry)
+        self.wakeup.set()
+        await future
+
+    def block(self, chat_id: int | str | None, seconds: float):
+        """
+        Holds back requests to the chat, or all requests if `chat_id` is None, for `seconds`.
+        """
+        bucket = self.global_bucket if chat_id is None else self.chat_bucket(chat_id)
+        bucket.block(time.monotonic(), seconds)
+        self.wakeup.set()
+
+    def grant(self, now: float) -> float | None:
+        """
+        Releases requests while tokens are available.
+        Returns seconds until the next request can be released or None if the queue is empty.
+        """
+        while len(self.queue) > 0:
+            delay = self.global_bucket.delay(now)
+            if delay > 0:
+                return delay
+            skipped, granted, delay = [], None, None
+            while len(self.queue) > 0:
+                entry = heapq.heappop(self.queue)
+                _, _, method, chat_id, queued, future = entry
+                # Requester was cancelled
+                if future.done():
+                    continue
+                bucket = None if chat_id is None else self.chat_bucket(chat_id)
+                chat_delay = 0 if bucket is None else bucket.delay(now)
+                if chat_delay == 0:
+                    granted = entry
+                    break
+                skipped.append(entry)
+                delay = chat_delay if delay is None else min(delay, chat_delay)
+            for entry in skipped:
+                heapq.heappush(self.queue, entry)
+            if granted is None:
+                return delay
+            self.global_bucket.take()
+            if bucket is not None:
+                bucket.take()
+            metrics.OUTBOUND_WAIT_SECONDS.observe(now - queued, method)
+            future.set_result(None)
+        return None
+
+    def prune(self, now: float):
+        if now - self.pruned < PRUNE_INTERVAL:
+            return
+        self.pruned = now
+        self.chats = {chat_id: bucket for chat_id, bucket in self.chats.items() if not bucket.idle(now)}
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            delay = self.grant(now)
+            self.prune(now)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def depth(self) -> int:
+        return len(self.queue)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        # Let the remaining requests through
+        for entry in self.queue:
+            if not entry[-1].done():
+                entry[-1].set_result(None)
+        self.queue = []
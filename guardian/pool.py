@@ -0,0 +1,103 @@
+import random
+import asyncio
+from collections import deque
+from aiogram.types import InlineKeyboardMarkup
+from guardian import qna, log
+from guardian.qna import Combination
+from guardian.images import Image, ImageProvider
+from guardian.util import emoji_keyboard, log_exception
+
+# Number of captchas prepared concurrently during refill.
+REFILL_CONCURRENCY = 4
+# Seconds to wait before next refill attempt when all preparations have failed.
+REFILL_BACKOFF = 5
+
+
+class NoImageError(Exception):
+    pass
+
+
+class Captcha:
+    def __init__(self, comb: Combination, image: Image, keyboard: InlineKeyboardMarkup):
+        self.comb = comb
+        self.image = image
+        self.keyboard = keyboard
+        self.uses = 0
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(comb={self.comb!r} image={self.image!r} uses={self.uses!r})'
+
+
+async def prepare(provider: ImageProvider) -> Captcha:
+    comb = qna.pick(6)
+    image = await provider.get_image(comb.query_phrase)
+    if image is None:
+        raise NoImageError(f'No image found for "{comb.query_phrase}"')
+    keyboard = emoji_keyboard(comb.emoji, rows=2)
+    return Captcha(comb, image, keyboard)
+
+
+class CaptchaPool:
+    """
+    Pool of ready-to-send captchas, refilled in the background once it drops to `low_watermark`.
+    Every captcha is shown at most `max_uses` times.
+    """
+
+    def __init__(self, provider: ImageProvider, size: int, low_watermark: int, max_uses: int):
+        self.provider = provider
+        self.size = size
+        self.low_watermark = low_watermark
+        self.max_uses = max_uses
+        self.captchas = deque()
+        self.low = asyncio.Event()
+        self.task = None
+
+    def __len__(self):
+        return len(self.captchas)
+
+    async def pop(self) -> Captcha:
+        if len(self.captchas) == 0:
+            log.logger.warning('Captcha pool is empty, preparing captcha on demand')
+            self.low.set()
+            captcha = await prepare(self.provider)
+        else:
+            captcha = self.captchas.popleft()
+
+        captcha.uses += 1
+        if captcha.uses < self.max_uses:
+            # Put back at a random position, so the same image isn't shown to consecutive newcomers
+            self.captchas.insert(random.randint(0, len(self.captchas)), captcha)
+        if len(self.captchas) <= self.low_watermark:
+            self.low.set()
+        return captcha
+
+    async def fill(self):
+        while len(self.captchas) < self.size:
+            count = min(REFILL_CONCURRENCY, self.size - len(self.captchas))
+            results = await asyncio.gather(*(prepare(self.provider) for _ in range(count)), return_exceptions=True)
+            prepared = [r for r in results if isinstance(r, Captcha)]
+            for r in results:
+                if isinstance(r, Exception):
+                    log_exception(r)
+            if len(prepared) == 0:
+                await asyncio.sleep(REFILL_BACKOFF)
+                continue
+            for captcha in prepared[:self.size - len(self.captchas)]:
+                self.captchas.append(captcha)
+        log.logger.info(f'Captcha pool is filled with {len(self.captchas)} captchas')
+
+    async def refill(self):
+        while True:
+            await self.low.wait()
+            self.low.clear()
+            await self.fill()
+
+    def start(self):
+        self.low.set()
+        self.task = asyncio.create_task(self.refill())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
@@ -12,6 +12,12 @@ class Query:
         else:
             return random.choice(self.emoji)
 
+    def phrases(self):
+        if isinstance(self.phrase, str):
+            return (self.phrase,)
+        else:
+            return tuple(self.phrase)
+
     def pick_phrase(self):
         if isinstance(self.phrase, str):
             return self.phrase
@@ -101,3 +107,10 @@ def pick(count: int):
     answer_idx = random.randrange(0, count)
     query_phrase = queries[answer_idx].pick_phrase()
     return Combination(emoji, answer_idx, query_phrase)
+
+
+def phrases() -> list[str]:
+    queries = []
+    for q in QNA:
+        queries.extend(q if isinstance(q, list) else (q,))
+    return list(dict.fromkeys(p for q in queries for p in q.phrases()))
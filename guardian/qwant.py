@@ -1,7 +1,10 @@
-
-import aiohttp
 import random
+from urllib.parse import urlparse
 from guardian import log
+from guardian.http import HttpClient
+from guardian.images import Image, ImageProvider
+
+URL = 'https://api.qwant.com/v3/search/images'
 
 PARAMS = {
     'count': 10,
@@ -17,11 +20,32 @@ HEADERS = {
 }
 
 
-async def get_image_url(query: str) -> str | None:
+async def get_image_url(http: HttpClient, query: str) -> str | None:
     log.logger.info('Searching images on Qwant')
     params = PARAMS | {'q': query}
-    async with aiohttp.ClientSession() as session:
-        async with session.get('https://api.qwant.com/v3/search/images', params=params, headers=HEADERS) as response:
-            data = await response.json()
-            items = data.get('data').get('result').get('items')
-            return random.choice(items).get('thumbnail')
+    data = await http.get_json(URL, params=params, headers=HEADERS)
+    items = (data.get('data') or {}).get('result', {}).get('items')
+    if not items:
+        return None
+    return random.choice(items).get('thumbnail')
+
+
+def is_valid_url(url: str | None) -> bool:
+    if not url:
+        return False
+    parsed = urlparse(url)
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
+
+
+class QwantProvider(ImageProvider):
+    name = 'qwant'
+
+    def __init__(self, http: HttpClient):
+        self.http = http
+
+    async def get_image(self, query: str) -> Image | None:
+        url = await get_image_url(self.http, query)
+        if not is_valid_url(url):
+            log.logger.warning(f'Invalid image URL for "{query}": {url!r}')
+            return None
+        return Image(url, url=url)
@@ -0,0 +1,61 @@
+import asyncio
+import contextvars
+from typing import Callable, Awaitable
+from aiogram.types import User
+from guardian.util import log_exception
+
+# Max number of newcomers sharing a captcha, keeps the caption within Telegram limits.
+MAX_BATCH = 20
+
+
+class JoinBatcher:
+    """
+    Collects newcomers of a chat in raid mode for `window` seconds and passes them to `flush` at once,
+    so the whole batch gets a single captcha message. A batch reaching MAX_BATCH users is flushed right away.
+    `flush` runs in context of the update which started the batch (e.g. chat locale), even when flushed by `stop`.
+    """
+
+    def __init__(self, flush: Callable[[int, list[User]], Awaitable]):
+        self.flush = flush
+        # Chat ID -> (newcomers, context of the update which started the batch)
+        self.batches = {}
+        self.timers = set()
+        self.tasks = set()
+
+    def add(self, chat_id: int, users: list[User], window: float):
+        for user in users:
+            batch = self.batches.get(chat_id)
+            if batch is None:
+                batch = self.batches[chat_id] = ([], contextvars.copy_context())
+                self.spawn(self.flush_later(chat_id, batch, window), self.timers)
+            batch[0].append(user)
+            if len(batch[0]) >= MAX_BATCH:
+                del self.batches[chat_id]
+                self.spawn(self.run_flush(chat_id, batch), self.tasks)
+
+    @staticmethod
+    def spawn(coro: Awaitable, tasks: set):
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def flush_later(self, chat_id: int, batch: tuple, window: float):
+        await asyncio.sleep(window)
+        if self.batches.get(chat_id) is batch:
+            del self.batches[chat_id]
+            self.spawn(self.run_flush(chat_id, batch), self.tasks)
+
+    async def run_flush(self, chat_id: int, batch: tuple):
+        users, context = batch
+        try:
+            await asyncio.create_task(self.flush(chat_id, users), context=context)
+        except Exception as e:
+            log_exception(e)
+
+    async def stop(self):
+        # Newcomers are already restricted, show them captcha before shutting down
+        for timer in list(self.timers):
+            timer.cancel()
+        await asyncio.gather(*self.timers, *self.tasks, return_exceptions=True)
+        batches, self.batches = self.batches, {}
+        await asyncio.gather(*(self.run_flush(chat_id, batch) for chat_id, batch in batches.items()))
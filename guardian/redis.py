@@ -1,25 +1,198 @@
-import redis.asyncio as redis
+import sys
 import time
-from guardian import log
+import argparse
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ResponseError
+from guardian import log, metrics
+from guardian.util import AttrDict
+
+
+# Global sorted set of "chat_id:user_id" ignored by previous versions.
+LEGACY_IGNORE_KEY = 'ignore'
+
+# Sets key expiration epoch ARGV[1] unless key already expires later (EXPIREAT with GT option before Redis 7).
+EXPIREAT_GT_SCRIPT = """
+local ttl = redis.call('PTTL', KEYS[1])
+local expire_at = tonumber(ARGV[1]) * 1000
+if ttl == -1 or (ttl >= 0 and tonumber(ARGV[2]) * 1000 + ttl < expire_at) then
+    return redis.call('PEXPIREAT', KEYS[1], math.floor(expire_at))
+end
+return 0
+"""
+
+# Marks users ARGV[3..] ignored in chat KEYS[1] for ARGV[2] seconds unless they're already ignored at ARGV[1].
+# Returns 1 for every user marked by this call and 0 for already ignored ones.
+TRY_IGNORE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local epoch = now + tonumber(ARGV[2])
+local marked = {}
+for i = 3, #ARGV do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) > now then
+        table.insert(marked, 0)
+    else
+        redis.call('ZADD', KEYS[1], epoch, ARGV[i])
+        table.insert(marked, 1)
+    end
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return marked
+"""
+
+# Adds ARGV[1] joins to the current minute counter KEYS[1] and estimates joins per minute over the last 60 seconds
+# using the previous minute counter KEYS[2] weighted by ARGV[2].
+# Raid flag KEYS[3] is set while the rate is at least ARGV[3], once set it's kept until the rate drops below ARGV[4]
+# or no one joins for ARGV[5] seconds. Returns {raid, was raid}.
+TRACK_JOINS_SCRIPT = """
+local current = redis.call('INCRBY', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], 120)
+local rate = current + tonumber(redis.call('GET', KEYS[2]) or 0) * tonumber(ARGV[2])
+local was_raid = redis.call('EXISTS', KEYS[3])
+if rate >= tonumber(ARGV[3]) or (was_raid == 1 and rate >= tonumber(ARGV[4])) then
+    redis.call('SET', KEYS[3], 1, 'EX', ARGV[5])
+    return {1, was_raid}
+end
+if was_raid == 1 then
+    redis.call('DEL', KEYS[3])
+end
+return {0, was_raid}
+"""
+
+# Seconds raid mode stays on after the last join.
+RAID_TTL = 60
+
+
+def ignore_key(chat_id: int | str) -> str:
+    return f'ignore:{chat_id}'
+
+
+# Keys of the same chat share {chat_id} hash tag, so they're in the same Redis Cluster slot for a script.
+def joins_key(chat_id: int, minute: int) -> str:
+    return f'joins:{{{chat_id}}}:{minute}'
+
+
+def raid_key(chat_id: int) -> str:
+    return f'raid:{{{chat_id}}}'
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with metrics.REDIS_SECONDS.time('PIPELINE'):
+            return await super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    async def execute_command(self, *args, **options):
+        with metrics.REDIS_SECONDS.time(args[0]):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
 
 
 class Redis:
-    def __init__(self, url: str):
-        pool = redis.ConnectionPool.from_url(url, max_connections=16, decode_responses=True)
-        self.redis = redis.Redis(connection_pool=pool)
-
-    async def ignore(self, chat_id: int, user_id: int, duration: int):
-        key = f'{chat_id}:{user_id}'
-        epoch = time.time() + duration
-        log.logger.info(f'Ignore {key} until {epoch}')
-        await self.redis.zadd('ignore', {key: epoch})
-
-    async def is_ignored(self, chat_id: int, user_id: int):
-        key = f'{chat_id}:{user_id}'
-        epoch = await self.redis.zscore('ignore', key)
-        if epoch == None:
+    def __init__(self, url: str, max_connections: int = 16):
+        self.redis = InstrumentedRedis(connection_pool=self.create_pool(url, max_connections))
+        self.expireat_gt = self.redis.register_script(EXPIREAT_GT_SCRIPT)
+        self.try_ignore_script = self.redis.register_script(TRY_IGNORE_SCRIPT)
+        self.track_joins_script = self.redis.register_script(TRACK_JOINS_SCRIPT)
+
+    @staticmethod
+    def create_pool(url: str, max_connections: int) -> redis.ConnectionPool:
+        # Wait for a free connection instead of failing when all of them are busy
+        return redis.BlockingConnectionPool.from_url(url, max_connections=max_connections, timeout=5,
+                                                     decode_responses=True)
+
+    # Ignored users are kept in a sorted set per chat scored by ignore expiration epoch.
+    # Expired users are pruned on every write and the whole set expires along with its last user.
+    async def try_ignore(self, chat_id: int, user_id: int, duration: int) -> bool:
+        """
+        Atomically checks that user isn't ignored and marks them ignored for `duration` seconds.
+        Returns True if user was marked by this call.
+        """
+        marked, = await self.try_ignore_many(chat_id, [user_id], duration)
+        return marked
+
+    async def try_ignore_many(self, chat_id: int, user_ids: list[int], duration: int) -> list[bool]:
+        now = time.time()
+        marked = await self.try_ignore_script(keys=[ignore_key(chat_id)], args=[now, duration, *user_ids])
+        log.logger.info('Ignore %s:%s until %s, marked: %s', chat_id, user_ids, now + duration, marked)
+        return [m == 1 for m in marked]
+
+    async def unignore(self, chat_id: int, user_id: int):
+        await self.redis.zrem(ignore_key(chat_id), user_id)
+
+    async def mark_answered(self, captcha_id: str, ttl: int) -> bool:
+        """
+        Marks signed captcha as answered or timed out, returns False if it already was.
+        """
+        return bool(await self.redis.set(f'answered:{captcha_id}', 1, nx=True, ex=ttl))
+
+    async def track_joins(self, chat_id: int, count: int, threshold: int) -> bool:
+        """
+        Counts `count` new members of the chat and returns whether the chat is raided,
+        i.e. joins per minute reached `threshold` and didn't drop below half of it since.
+        """
+        if threshold <= 0:
             return False
-        return time.time() < epoch
+        now = time.time()
+        minute = int(now // 60)
+        weight = 1 - now % 60 / 60
+        keys = [joins_key(chat_id, minute), joins_key(chat_id, minute - 1), raid_key(chat_id)]
+        raid, was_raid = await self.track_joins_script(keys=keys, args=[count, weight, threshold,
+                                                                          threshold / 2, RAID_TTL])
+        if raid != was_raid:
+            log.logger.warning('Raid mode is %s in chat %s', 'on' if raid else 'off', chat_id)
+        return raid == 1
+
+    async def migrate_legacy_ignores(self, batch: int = 1000) -> int:
+        migrated = 0
+        while True:
+            entries = await self.redis.zrange(LEGACY_IGNORE_KEY, 0, batch - 1, withscores=True)
+            if len(entries) == 0:
+                break
+            now = time.time()
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for member, epoch in entries:
+                    if epoch <= now:
+                        continue
+                    chat_id, user_id = member.split(':')
+                    key = ignore_key(chat_id)
+                    pipe.zadd(key, {user_id: epoch}, gt=True)
+                    await self.expireat_gt(keys=[key], args=[epoch, now], client=pipe)
+                    migrated += 1
+                pipe.zrem(LEGACY_IGNORE_KEY, *(member for member, _ in entries))
+                await pipe.execute()
+        if migrated > 0:
+            log.logger.info(f'Migrated {migrated} ignored user(s) from legacy "{LEGACY_IGNORE_KEY}" key')
+        return migrated
+
+    async def ignore_stats(self) -> dict[int, tuple[int, int | None]]:
+        """
+        Returns number of currently ignored users and memory usage in bytes per chat.
+        Memory usage is None where MEMORY USAGE command isn't available, e.g. disabled by a managed Redis.
+        """
+        keys = [key async for key in self.redis.scan_iter(match=ignore_key('*'), count=1000)]
+        if len(keys) == 0:
+            return {}
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.zcount(key, now, '+inf')
+                pipe.memory_usage(key)
+            results = await pipe.execute(raise_on_error=False)
+        stats = {}
+        for key, count, memory in zip(keys, results[::2], results[1::2]):
+            if isinstance(count, Exception):
+                raise count
+            if isinstance(memory, ResponseError):
+                memory = None
+            elif isinstance(memory, Exception):
+                raise memory
+            stats[int(key.split(':')[1])] = (count, memory)
+        return stats
 
     async def ping(self):
         if not await self.redis.ping():
@@ -31,3 +204,29 @@ class Redis:
 
 class RedisPingError(Exception):
     pass
+
+
+def format_ignore_stats(stats: dict[int, tuple[int, int | None]]) -> str:
+    lines = [f'{"chat":<24}{"ignored":>10}{"bytes":>12}']
+    for chat_id, (count, memory) in stats.items():
+        lines.append(f'{chat_id:<24}{count:>10}{"-" if memory is None else memory:>12}')
+    return '\n'.join(lines)
+
+
+async def run_ignore_stats(config: AttrDict, args: argparse.Namespace) -> int:
+    """
+    Runs `guardian ignores` command.
+    """
+    redis_client = Redis(config.redis.url)
+    try:
+        stats = await redis_client.ignore_stats()
+    finally:
+        await redis_client.close()
+    rows = sorted(stats.items(), key=lambda item: item[1][0], reverse=True)
+    if args.limit > 0:
+        rows = rows[:args.limit]
+    print(format_ignore_stats(dict(rows)))
+    total = sum(count for count, _ in stats.values())
+    memory = sum(memory or 0 for _, memory in stats.values())
+    print(f'{total} ignored user(s) in {len(stats)} chat(s), {memory} bytes.', file=sys.stderr)
+    return 0
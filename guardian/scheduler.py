@@ -0,0 +1,147 @@
+import json
+import time
+import asyncio
+from uuid import uuid4
+from typing import Callable, Awaitable
+from redis.exceptions import RedisError
+from guardian import log
+from guardian.redis import Redis
+from guardian.util import log_exception
+
+JOBS_KEY = 'jobs'
+PAYLOADS_KEY = 'jobs:payload'
+
+# Claims up to ARGV[2] jobs due by ARGV[1] by pushing their score ARGV[3] seconds forward (lease),
+# so other instances don't pick them up, while jobs of crashed instance get picked up after lease expires.
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local jobs = {}
+if #due == 0 then
+    return jobs
+end
+local payloads = redis.call('HMGET', KEYS[2], unpack(due))
+local lease = tonumber(ARGV[1]) + tonumber(ARGV[3])
+for i, id in ipairs(due) do
+    if payloads[i] then
+        redis.call('ZADD', KEYS[1], lease, id)
+        table.insert(jobs, id)
+        table.insert(jobs, payloads[i])
+    else
+        redis.call('ZREM', KEYS[1], id)
+    end
+end
+return jobs
+"""
+
+
+class Scheduler:
+    """
+    Durable delayed jobs shared by all bot instances.
+    Job ids are kept in a sorted set scored by due time, payloads in a hash.
+    Every instance polls for due jobs and claims them in batches, claiming costs O(log(n) + batch).
+    A claimed job is leased for `lease` seconds, if the claiming instance dies, the job is executed again,
+    so job handlers must be idempotent.
+    """
+
+    def __init__(self, redis: Redis, interval: float, batch: int, lease: float):
+        self.redis = redis.redis
+        self.claim = self.redis.register_script(CLAIM_SCRIPT)
+        self.interval = interval
+        self.batch = batch
+        self.lease = lease
+        self.handlers = {}
+        self.wakeup = asyncio.Event()
+        self.next_poll = 0.0
+        self.running = set()
+        self.task = None
+
+    def register(self, name: str, handler: Callable[..., Awaitable]):
+        self.handlers[name] = handler
+
+    async def schedule(self, name: str, delay: float, job_id: str | None = None, **kwargs) -> str:
+        if job_id is None:
+            job_id = uuid4().hex
+        due = time.time() + delay
+        payload = json.dumps({'name': name, 'kwargs': kwargs}, separators=(',', ':'))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(PAYLOADS_KEY, job_id, payload)
+            pipe.zadd(JOBS_KEY, {job_id: due})
+            await pipe.execute()
+        if due < self.next_poll:
+            self.wakeup.set()
+        return job_id
+
+    async def cancel(self, job_id: str) -> bool:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(JOBS_KEY, job_id)
+            pipe.hdel(PAYLOADS_KEY, job_id)
+            removed, _ = await pipe.execute()
+        return removed == 1
+
+    async def pop(self, job_id: str) -> dict | None:
+        """
+        Cancels the job, returns its keyword arguments or None if there was no such job.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hget(PAYLOADS_KEY, job_id)
+            pipe.zrem(JOBS_KEY, job_id)
+            pipe.hdel(PAYLOADS_KEY, job_id)
+            payload, _, _ = await pipe.execute()
+        return None if payload is None else json.loads(payload)['kwargs']
+
+    async def execute(self, job_id: str, payload: str):
+        job = json.loads(payload)
+        handler = self.handlers.get(job['name'])
+        try:
+            if handler is None:
+                log.logger.error(f'No handler for job {job_id} "{job["name"]}", dropping it')
+            else:
+                await handler(**job['kwargs'])
+        except Exception as e:
+            # Don't retry failed job, handler is responsible for its errors
+            log_exception(e)
+        await self.cancel(job_id)
+
+    async def poll(self) -> int:
+        now = time.time()
+        jobs = await self.claim(keys=[JOBS_KEY, PAYLOADS_KEY], args=[now, self.batch, self.lease])
+        for job_id, payload in zip(jobs[::2], jobs[1::2]):
+            task = asyncio.create_task(self.execute(job_id, payload))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+        return len(jobs) // 2
+
+    async def seconds_to_next_job(self) -> float:
+        head = await self.redis.zrange(JOBS_KEY, 0, 0, withscores=True)
+        if len(head) == 0:
+            return self.interval
+        return min(max(head[0][1] - time.time(), 0), self.interval)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                # More due jobs may be waiting when the whole batch is claimed
+                if await self.poll() == self.batch:
+                    continue
+                delay = await self.seconds_to_next_job()
+            except RedisError as e:
+                log_exception(e)
+                delay = self.interval
+            self.next_poll = time.time() + delay
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def pending(self) -> int:
+        return await self.redis.zcard(JOBS_KEY)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
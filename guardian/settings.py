@@ -1,6 +1,14 @@
+import json
 from enum import Enum
+from uuid import uuid4
+from redis.exceptions import RedisError
+from guardian.cache import ChatCache
+from guardian.util import log_exception
 
 
+# Redis pub/sub channel announcing settings changes to other bot instances.
+CHANNEL = 'settings'
+
 LANGUAGES = ['en', 'ru']
 FLAGS = ['🇬🇧', '🇷🇺']
 
@@ -25,6 +33,14 @@ def validate_language(lang: str, i18n) -> tuple[bool, list[str] | None]:
         return False, errors
 
 
+def integer_validator(minimum: int, maximum: int):
+    def validate_integer(value: str, i18n) -> tuple[bool, list[str] | None]:
+        if value.isdigit() and minimum <= int(value) <= maximum:
+            return True, None
+        return False, [i18n.t('errors.integer.range', min=minimum, max=maximum)]
+    return validate_integer
+
+
 def dummy_validator(_, _i18n) -> tuple[bool, list[str] | None]:
     return True, None
 
@@ -33,6 +49,10 @@ class Setting(Enum):
     LANGUAGE = 1
     BAN_CHANNELS = 2
     WELCOME_MESSAGE = 3
+    # Joins per minute which turn raid mode on, 0 disables raid mode
+    RAID_THRESHOLD = 4
+    # Seconds during which newcomers are collected into a single captcha in raid mode
+    RAID_WINDOW = 5
 
     @property
     def title(self):
@@ -43,12 +63,18 @@ class Setting(Enum):
         match self:
             case self.BAN_CHANNELS:
                 return False
+            case self.RAID_THRESHOLD:
+                return 20
+            case self.RAID_WINDOW:
+                return 10
 
     @property
     def from_str(self):
         match self:
             case self.BAN_CHANNELS:
                 return lambda v: bool(int(v))
+            case self.RAID_THRESHOLD | self.RAID_WINDOW:
+                return int
             case _:
                 return lambda v: v
 
@@ -67,31 +93,62 @@ class Setting(Enum):
                 return validate_language
             case self.WELCOME_MESSAGE:
                 return validate_welcome_message
+            case self.RAID_THRESHOLD:
+                return integer_validator(0, 1000)
+            case self.RAID_WINDOW:
+                return integer_validator(1, 30)
             case _:
                 return dummy_validator
 
 
 class Settings:
-    settings = {}
+    """
+    Per chat settings loaded on demand into LRU cache of at most `max_size` chats.
+    Concurrent loads of the same chat are collapsed into one database query.
+    Changes are announced through Redis pub/sub, so other bot instances update their caches.
+    """
 
-    def __init__(self, database):
+    def __init__(self, database, redis, max_size: int):
         self.db = database
+        self.redis = redis.redis
+        self.cache = ChatCache('settings', self.fetch, max_size)
+        self.instance_id = uuid4().hex
 
-    async def load(self):
-        for s in await self.db.select_settings():
+    async def fetch(self, chat_id: int) -> dict:
+        settings = {}
+        for s in await self.db.select_chat_settings(chat_id):
             setting = Setting(s['setting_id'])
-            chat_id, value = s['chat_id'], setting.from_str(s['value'])
-            self.settings[chat_id] = self.settings.get(chat_id, {})
-            self.settings[chat_id][setting] = value
+            settings[setting] = setting.from_str(s['value'])
+        return settings
 
-    def get(self, chat_id: int, setting: Setting):
-        value = self.settings.get(chat_id, {}).get(setting)
+    async def get(self, chat_id: int, setting: Setting):
+        value = (await self.cache.get_or_load(chat_id)).get(setting)
         if value is None:
             return setting.default_value
         return value
 
     async def set(self, chat_id: int, setting: Setting, value: str):
         await self.db.upsert_setting(chat_id, setting.value, value)
-        s = self.settings.get(chat_id, {})
-        s[setting] = setting.from_str(value)
-        self.settings[chat_id] = s
+        self.update(chat_id, setting, value)
+        message = json.dumps([self.instance_id, chat_id, setting.value, value])
+        try:
+            await self.redis.publish(CHANNEL, message)
+        except RedisError as e:
+            log_exception(e)
+
+    def update(self, chat_id: int, setting: Setting, value: str):
+        value = setting.from_str(value)
+        settings = self.cache.modify(chat_id)
+        if settings is not None:
+            settings[setting] = value
+
+    def handle_message(self, data: str):
+        instance_id, chat_id, setting_id, value = json.loads(data)
+        if instance_id != self.instance_id:
+            self.update(chat_id, Setting(setting_id), value)
+
+    def start(self):
+        self.cache.start(self.redis, CHANNEL, self.handle_message)
+
+    async def stop(self):
+        await self.cache.stop()
@@ -0,0 +1,75 @@
+import hmac
+import time
+import struct
+import secrets
+import binascii
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from hashlib import sha256
+from typing import NamedTuple
+from aiogram.types import InlineKeyboardMarkup
+from guardian.qna import Combination
+from guardian.util import emoji_keyboard
+
+# Marks signed callback data, neither emoji nor setting ids start with it.
+TOKEN_PREFIX = '~'
+# Button index, captcha id, expiration epoch.
+HEADER = struct.Struct('>B6sI')
+MAC_SIZE = 12
+
+
+class SignedAnswer(NamedTuple):
+    captcha_id: str
+    expire_at: int
+    correct: bool
+
+
+class AnswerSigner:
+    """
+    Signs every captcha button with HMAC of chat, user the captcha is shown to, captcha id, expiration time,
+    button index and whether the button is the right answer. The latter is only in the MAC, so it isn't revealed
+    by callback data, yet any bot instance sharing the secret can check an answer without reading storage.
+    Signed callback data is the `~` prefix followed by unpadded base64 of 11 bytes of header and 12 bytes of MAC,
+    1 + 31 = 32 bytes in total (Telegram limit is 64).
+    """
+
+    def __init__(self, secret: str):
+        self.key = secret.encode()
+
+    def mac(self, chat_id: int, user_id: int, header: bytes, correct: bool) -> bytes:
+        message = b'%d:%d:%d:' % (chat_id, user_id, correct) + header
+        return hmac.new(self.key, message, sha256).digest()[:MAC_SIZE]
+
+    def sign(self, chat_id: int, user_id: int, captcha_id: bytes, expire_at: int, index: int, correct: bool) -> str:
+        header = HEADER.pack(index, captcha_id, expire_at)
+        token = urlsafe_b64encode(header + self.mac(chat_id, user_id, header, correct))
+        return TOKEN_PREFIX + token.decode().rstrip('=')
+
+    def keyboard(self, chat_id: int, user_id: int, comb: Combination, expire: int) -> tuple[str, InlineKeyboardMarkup]:
+        """
+        Returns new captcha id and keyboard with signed buttons.
+        """
+        captcha_id = secrets.token_bytes(HEADER.size - 5)
+        expire_at = int(time.time()) + expire
+        tokens = [self.sign(chat_id, user_id, captcha_id, expire_at, i, i == comb.answer_index)
+                  for i in range(len(comb.emoji))]
+        return captcha_id.hex(), emoji_keyboard(comb.emoji, rows=2, callback_data=tokens)
+
+    def verify(self, data: str, chat_id: int, user_id: int) -> SignedAnswer | None:
+        """
+        Returns the answer or None if data wasn't signed for this chat and user.
+        """
+        if not data.startswith(TOKEN_PREFIX):
+            return None
+        token = data[len(TOKEN_PREFIX):]
+        try:
+            raw = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except (ValueError, binascii.Error):
+            return None
+        if len(raw) != HEADER.size + MAC_SIZE:
+            return None
+        header, mac = raw[:HEADER.size], raw[HEADER.size:]
+        for correct in (True, False):
+            if hmac.compare_digest(mac, self.mac(chat_id, user_id, header, correct)):
+                _, captcha_id, expire_at = HEADER.unpack(header)
+                return SignedAnswer(captcha_id.hex(), expire_at, correct)
+        return None
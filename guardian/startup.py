@@ -0,0 +1,52 @@
+import time
+import importlib
+from contextlib import contextmanager
+from logging import Logger
+from typing import Awaitable
+
+# Heavy dependencies, imported one by one when profiling to tell their import times apart.
+DEPENDENCIES = ('yaml', 'aiohttp', 'redis.asyncio', 'aiosqlite', 'aiogram')
+
+
+class StartupProfile:
+    """
+    Durations of startup phases since `started` (perf_counter), reported once the bot accepts updates.
+    Phases may run concurrently, so their durations don't add up to the total.
+    """
+
+    def __init__(self, started: float, enabled: bool):
+        self.started = started
+        self.enabled = enabled
+        # (name, seconds since start when the phase began, duration)
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, begin - self.started, time.perf_counter() - begin))
+
+    async def timed(self, name: str, aw: Awaitable):
+        with self.phase(name):
+            return await aw
+
+    def import_dependencies(self):
+        if not self.enabled:
+            return
+        for name in DEPENDENCIES:
+            with self.phase(f'import {name}'):
+                importlib.import_module(name)
+
+    def report(self) -> str:
+        lines = [f'{"phase":<32}{"start":>10}{"duration":>10}']
+        for name, begin, duration in sorted(self.phases, key=lambda p: p[1]):
+            lines.append(f'{name:<32}{begin * 1000:>8.1f}ms{duration * 1000:>8.1f}ms')
+        return '\n'.join(lines)
+
+    def ready(self, logger: Logger):
+        seconds = time.perf_counter() - self.started
+        logger.info('Accepting updates %.3f seconds after start', seconds)
+        if self.enabled:
+            logger.warning('Startup profile:\n%s', self.report())
@@ -0,0 +1,211 @@
+import json
+import time
+import typing
+import asyncio
+from contextvars import ContextVar
+from aiogram.dispatcher.storage import BaseStorage
+from redis.exceptions import RedisError
+from guardian.redis import Redis
+from guardian.util import log_exception
+
+# [key, data] read together with state by `get_state`, consumed by `get_data` called right after it,
+# before the task yields to the event loop. The list is emptied on the next loop iteration, so data is never stale.
+prefetched = ContextVar('prefetched_fsm_data', default=None)
+# Sorted set of "chat:user" having a state scored by expiration epoch, counted by FSM_STATES gauge.
+STATES_KEY = 'fsm_states'
+# Sorted set of "chat:user" in watched states scored by expiration epoch, shared by bot instances.
+WAITING_KEY = 'fsm_waiting'
+# Seconds between reloads of users in watched states.
+WAITING_REFRESH_INTERVAL = 1
+
+
+class RedisStorage(BaseStorage):
+    """
+    FSM storage keeping state and data of every (chat, user) in a single Redis hash, which expires after `ttl` seconds.
+    `get_state` fetches data along with the state, so the `get_state` + `get_data` pair
+    issued by `FSMContext.proxy()` costs a single round trip.
+    Chats having users in one of `watched` states are known without a round trip, see `is_waiting`.
+    """
+
+    def __init__(self, redis: Redis, ttl: int):
+        self.redis = redis.redis
+        self.ttl = ttl
+        self.watched = set()
+        # Chat ID -> {user ID: expiration epoch} of users in watched states
+        self.waiting = {}
+        self.changes = 0
+        self.task = None
+
+    @staticmethod
+    def key(chat, user) -> str:
+        return f'fsm:{chat}:{user}'
+
+    async def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        chat, user = self.check_address(chat=chat, user=user)
+        key = self.key(chat, user)
+        state, data = await self.redis.hmget(key, 'state', 'data')
+        entry = [key, data]
+        prefetched.set(entry)
+        asyncio.get_running_loop().call_soon(entry.clear)
+        return state or self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        key = self.key(chat, user)
+        cached = prefetched.get()
+        if cached and cached[0] == key:
+            data = cached[1]
+            cached.clear()
+        else:
+            data = await self.redis.hget(key, 'data')
+        if data is None:
+            return default or {}
+        return json.loads(data)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        state = self.resolve_state(state)
+        await self.set_field(chat, user, 'state', state)
+        if state is not None and (state in self.watched or '*' in self.watched):
+            await self.set_waiting(chat, user, True)
+        else:
+            await self.set_waiting(chat, user, False)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        value = json.dumps(data, separators=(',', ':')) if data else None
+        await self.set_field(chat, user, 'data', value)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        if data is None:
+            data = {}
+        temp_data = await self.get_data(chat=chat, user=user)
+        temp_data.update(data, **kwargs)
+        await self.set_data(chat=chat, user=user, data=temp_data)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        chat, user = self.check_address(chat=chat, user=user)
+        key = self.key(chat, user)
+        prefetched.set(None)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if with_data:
+                pipe.delete(key)
+            else:
+                pipe.hdel(key, 'state')
+            pipe.zrem(STATES_KEY, f'{chat}:{user}')
+            await pipe.execute()
+        await self.set_waiting(chat, user, False)
+
+    async def set_field(self, chat, user, field: str, value: str | None):
+        key, member = self.key(chat, user), f'{chat}:{user}'
+        prefetched.set(None)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if value is None:
+                pipe.hdel(key, field)
+                if field == 'state':
+                    pipe.zrem(STATES_KEY, member)
+            else:
+                pipe.hset(key, field, value)
+                pipe.expire(key, self.ttl)
+                # Prolong the state along with the hash, add it to the index when it's the state being set
+                pipe.zadd(STATES_KEY, {member: time.time() + self.ttl}, xx=field != 'state')
+            await pipe.execute()
+
+    async def count_states(self) -> int:
+        """
+        Returns the number of users having a state, in O(log(n)) unlike `get_states_list`.
+        """
+        return await self.redis.zcount(STATES_KEY, time.time(), '+inf')
+
+    def watch(self, states: set[str]):
+        self.watched = states
+
+    def is_waiting(self, chat_id: int) -> bool:
+        """
+        Returns True if any user of the chat may be in a watched state.
+        States set by other bot instances are seen within WAITING_REFRESH_INTERVAL seconds.
+        """
+        users = self.waiting.get(int(chat_id))
+        return users is not None and max(users.values()) > time.time()
+
+    async def set_waiting(self, chat, user, waiting: bool):
+        chat, user = int(chat), int(user)
+        if waiting:
+            expire_at = time.time() + self.ttl
+            await self.redis.zadd(WAITING_KEY, {f'{chat}:{user}': expire_at})
+            self.waiting.setdefault(chat, {})[user] = expire_at
+            self.changes += 1
+        elif user in self.waiting.get(chat, {}):
+            # Users marked by other instances expire on their own, which costs only a spare dispatch
+            await self.redis.zrem(WAITING_KEY, f'{chat}:{user}')
+            users = self.waiting[chat]
+            users.pop(user, None)
+            if len(users) == 0:
+                del self.waiting[chat]
+            self.changes += 1
+
+    async def load_waiting(self):
+        now, changes = time.time(), self.changes
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(STATES_KEY, '-inf', now)
+            pipe.zremrangebyscore(WAITING_KEY, '-inf', now)
+            pipe.zrange(WAITING_KEY, 0, -1, withscores=True)
+            *_, entries = await pipe.execute()
+        waiting = {}
+        for member, expire_at in entries:
+            chat, user = map(int, member.split(':'))
+            waiting.setdefault(chat, {})[user] = expire_at
+        # Keep users marked while loading
+        if self.changes != changes:
+            for chat, users in self.waiting.items():
+                waiting.setdefault(chat, {}).update(users)
+        self.waiting = waiting
+
+    async def refresh_waiting(self):
+        while True:
+            try:
+                await self.load_waiting()
+            except RedisError as e:
+                log_exception(e)
+            await asyncio.sleep(WAITING_REFRESH_INTERVAL)
+
+    def start(self):
+        self.task = asyncio.create_task(self.refresh_waiting())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def get_states_list(self) -> typing.List[typing.Tuple[str, str]]:
+        result = []
+        async for key in self.redis.scan_iter(match='fsm:*', count=1000):
+            _, chat, user = key.split(':')
+            result.append((chat, user))
+        return result
@@ -0,0 +1,394 @@
+import os
+import json
+import math
+import time
+import random
+import socket
+import signal
+import asyncio
+from collections import deque
+from typing import Callable, Awaitable
+from aiohttp import web
+from redis.exceptions import RedisError, ResponseError
+from guardian import log, metrics
+from guardian.bot import Bot, api_server, webhook_url, webhook_secret, check_secret_token, WEBHOOK_PATH
+from guardian.redis import Redis
+from guardian.util import log_exception, AttrDict
+
+GROUP = 'workers'
+# Sorted set of workers scored by last heartbeat epoch.
+WORKERS_KEY = 'updates:workers'
+DEAD_LETTER_KEY = 'updates:dead'
+DEAD_LETTER_MAX_LENGTH = 10000
+# Base delay between attempts to process a failed update, in seconds.
+RETRY_DELAY = 0.5
+# Milliseconds to wait for new entries on read.
+READ_BLOCK = 1000
+# Fields of updates carrying a chat, the rest are sharded by sender.
+CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+               'my_chat_member', 'chat_member', 'chat_join_request')
+
+# Sets lease KEYS[1] for ARGV[1] to expire in ARGV[2] milliseconds if it's free or already held by ARGV[1].
+TAKE_LEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+# Deletes lease KEYS[1] if it's held by ARGV[1].
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def stream_key(shard: int) -> str:
+    return f'updates:{shard}'
+
+
+def lease_key(shard: int) -> str:
+    return f'updates:{shard}:lease'
+
+
+def update_chat_id(update: dict) -> int:
+    """
+    Returns ID of the chat update belongs to, or ID of the sender for updates without chat (e.g. inline queries).
+    Raises KeyError, TypeError or ValueError if update is malformed.
+    """
+    for field in CHAT_FIELDS:
+        if field in update:
+            return int(update[field]['chat']['id'])
+    query = update.get('callback_query')
+    if query is not None and 'message' in query:
+        return int(query['message']['chat']['id'])
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return int(value['from']['id'])
+    return 0
+
+
+class UpdateReceiver:
+    """
+    Accepts updates sent by Telegram to webhook and adds them to Redis Streams sharded by chat.
+    Responds with an error if Redis is unavailable, so Telegram delivers the update again later.
+    """
+
+    def __init__(self, redis: Redis, shards: int, max_length: int):
+        self.redis = redis.redis
+        self.shards = shards
+        self.max_length = max_length
+
+    async def handle(self, request: web.Request) -> web.Response:
+        text = await request.text()
+        try:
+            update = json.loads(text)
+            if not isinstance(update.get('update_id'), int):
+                raise ValueError('update_id is missing')
+            chat_id = update_chat_id(update)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            log.logger.warning('Invalid update: %s', e)
+            raise web.HTTPBadRequest()
+        await self.redis.xadd(stream_key(chat_id % self.shards), {'chat_id': chat_id, 'update': text},
+                              maxlen=self.max_length, approximate=True)
+        metrics.STREAM_ENTRIES.inc('received')
+        return web.Response(text='ok')
+
+
+class ChatQueues:
+    """
+    Entries of a shard read but not processed yet, queued by chat. Every chat with queued entries is processed
+    by a task of its own, so a chat waiting for rate limits or retries doesn't hold back the others.
+    """
+
+    def __init__(self, process: Callable[[tuple], Awaitable]):
+        self.process = process
+        # Chat ID -> deque of entries, the first one is being processed
+        self.queues = {}
+        self.tasks = set()
+        self.changed = asyncio.Event()
+        # Set when a chat stopped on Redis error, its entries are left pending
+        self.failed = False
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def put(self, chat_id: str, entry: tuple):
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = self.queues[chat_id] = deque()
+            task = asyncio.create_task(self.run(chat_id, queue))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        queue.append(entry)
+
+    async def run(self, chat_id: str, queue: deque):
+        try:
+            while len(queue) > 0:
+                await self.process(queue[0])
+                queue.popleft()
+                self.changed.set()
+            del self.queues[chat_id]
+        except RedisError as e:
+            log_exception(e)
+            self.failed = True
+        finally:
+            self.changed.set()
+
+    async def wait_below(self, size: int):
+        while len(self) >= size and len(self.tasks) > 0:
+            self.changed.clear()
+            await self.changed.wait()
+
+    async def join(self):
+        await asyncio.gather(*self.tasks)
+
+    def reset(self):
+        """
+        Forgets entries left by failed chats, they're read again as pending ones.
+        """
+        self.queues.clear()
+        self.failed = False
+
+    async def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+class StreamWorker:
+    """
+    Processes updates from streams of the shards it holds leases on. Every shard is held by a single worker,
+    so updates of a chat are processed in order, while updates of different chats are processed concurrently
+    and acknowledged as soon as they're processed. New entries are read while some chats are still busy,
+    up to `batch` entries of a shard at once. Workers share shards evenly, shards of a worker which stopped
+    renewing its leases are taken over along with entries it didn't acknowledge.
+    An update failing `max_attempts` times goes to dead-letter stream.
+    """
+
+    def __init__(self, redis: Redis, process: Callable[[dict], Awaitable], shards: int, batch: int,
+                 max_attempts: int, lease: float):
+        self.redis = redis.redis
+        self.take_lease = self.redis.register_script(TAKE_LEASE_SCRIPT)
+        self.release_lease = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+        self.process = process
+        self.shards = shards
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}'
+        # Shard -> consumer task
+        self.consumers = {}
+        # Consumers finishing their last batch before releasing the shard
+        self.releasing = {}
+        self.task = None
+
+    async def heartbeat(self) -> int:
+        """
+        Returns number of alive workers.
+        """
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(WORKERS_KEY, {self.name: now})
+            pipe.zremrangebyscore(WORKERS_KEY, '-inf', now - self.lease)
+            pipe.zcard(WORKERS_KEY)
+            *_, workers = await pipe.execute()
+        return workers
+
+    async def balance(self):
+        workers = await self.heartbeat()
+        target = math.ceil(self.shards / workers)
+        ttl = int(self.lease * 1000)
+        for consumers in (self.consumers, self.releasing):
+            for shard, task in list(consumers.items()):
+                if task.done() or not await self.take_lease(keys=[lease_key(shard)], args=[self.name, ttl]):
+                    log.logger.warning('Lost shard %d', shard)
+                    consumers.pop(shard, None)
+                    task.cancel()
+        while len(self.consumers) > target:
+            shard, task = self.consumers.popitem()
+            self.releasing[shard] = task
+        if len(self.consumers) >= target:
+            return
+        # Start from a random shard, so workers don't compete for the same ones
+        offset = random.randrange(self.shards)
+        for i in range(self.shards):
+            shard = (offset + i) % self.shards
+            if shard in self.consumers or shard in self.releasing:
+                continue
+            if await self.take_lease(keys=[lease_key(shard)], args=[self.name, ttl]):
+                log.logger.info('Took shard %d', shard)
+                self.consumers[shard] = asyncio.create_task(self.consume(shard))
+                if len(self.consumers) >= target:
+                    break
+
+    async def run(self):
+        while True:
+            try:
+                await self.balance()
+            except RedisError as e:
+                log_exception(e)
+            await asyncio.sleep(self.lease / 3)
+
+    async def create_group(self, stream: str):
+        try:
+            await self.redis.xgroup_create(stream, GROUP, '0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def take_over(self, stream: str):
+        """
+        Claims entries left unacknowledged by previous holders of the shard and forgets idle holders.
+        """
+        start = '0-0'
+        while True:
+            start, *_ = await self.redis.xautoclaim(stream, GROUP, self.name, 0, start, count=self.batch)
+            if start == '0-0':
+                break
+        for consumer in await self.redis.xinfo_consumers(stream, GROUP):
+            if consumer['name'] != self.name and consumer['pending'] == 0 and consumer['idle'] > self.lease * 1000:
+                await self.redis.xgroup_delconsumer(stream, GROUP, consumer['name'])
+
+    async def consume(self, shard: int):
+        stream, task = stream_key(shard), asyncio.current_task()
+        chats = ChatQueues(lambda entry: self.process_entry(stream, *entry))
+        # Entries delivered to this worker before are processed first
+        pending = True
+        try:
+            while self.consumers.get(shard) is task:
+                try:
+                    if chats.failed:
+                        pending = True
+                    if pending:
+                        # Entries being processed would be read again along with pending ones
+                        await chats.join()
+                        chats.reset()
+                        await self.create_group(stream)
+                        await self.take_over(stream)
+                    elif len(chats) >= self.batch:
+                        await chats.wait_below(self.batch)
+                        continue
+                    entries = await self.redis.xreadgroup(GROUP, self.name, {stream: '0' if pending else '>'},
+                                                          count=self.batch - len(chats),
+                                                          block=None if pending else READ_BLOCK)
+                    entries = entries[0][1] if entries else []
+                    if pending and len(entries) == 0:
+                        pending = False
+                        continue
+                    await self.dispatch(stream, entries, chats, pending)
+                    if pending:
+                        await chats.join()
+                except RedisError as e:
+                    log_exception(e)
+                    pending = True
+                    await asyncio.sleep(1)
+            # Shard is released, let chats finish their entries
+            await chats.join()
+        finally:
+            await chats.cancel()
+            self.releasing.pop(shard, None)
+            try:
+                await self.release_lease(keys=[lease_key(shard)], args=[self.name])
+            except RedisError as e:
+                log_exception(e)
+
+    async def dispatch(self, stream: str, entries: list, chats: ChatQueues, pending: bool):
+        deliveries = {}
+        if pending and len(entries) > 0:
+            # Entry crashing the worker is delivered again to every next holder of the shard
+            for info in await self.redis.xpending_range(stream, GROUP, entries[0][0], entries[-1][0],
+                                                        len(entries), consumername=self.name):
+                deliveries[info['message_id']] = info['times_delivered']
+        trimmed = []
+        for entry_id, fields in entries:
+            if fields:
+                chats.put(fields['chat_id'], (entry_id, fields, deliveries.get(entry_id, 1)))
+            else:
+                # Entry trimmed from the stream before it was processed
+                trimmed.append(entry_id)
+        if len(trimmed) > 0:
+            await self.redis.xack(stream, GROUP, *trimmed)
+
+    async def process_entry(self, stream: str, entry_id: str, fields: dict, attempt: int):
+        error = 'delivered too many times'
+        while attempt <= self.max_attempts:
+            try:
+                await self.process(json.loads(fields['update']))
+                metrics.STREAM_ENTRIES.inc('processed')
+                break
+            except Exception as e:
+                log_exception(e)
+                error = f'{e} [{e.__class__.__name__}]'
+                metrics.STREAM_ENTRIES.inc('failed')
+                await asyncio.sleep(RETRY_DELAY * attempt)
+                attempt += 1
+        else:
+            log.logger.error('Moving update %s of %s to dead-letter stream: %s', entry_id, stream, error)
+            await self.redis.xadd(DEAD_LETTER_KEY, {'stream': stream, 'id': entry_id, 'error': error, **fields},
+                                  maxlen=DEAD_LETTER_MAX_LENGTH, approximate=True)
+            metrics.STREAM_ENTRIES.inc('dead')
+        await self.redis.xack(stream, GROUP, entry_id)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        # Let consumers finish their batches, leases are released as they exit
+        self.releasing.update(self.consumers)
+        self.consumers = {}
+        await asyncio.gather(*self.releasing.values(), return_exceptions=True)
+        try:
+            await self.redis.zrem(WORKERS_KEY, self.name)
+        except RedisError as e:
+            log_exception(e)
+
+
+def receiver_app(receiver: UpdateReceiver, secret: str, serve_metrics: bool) -> web.Application:
+    app = web.Application(middlewares=[check_secret_token(secret)])
+    app.router.add_post(WEBHOOK_PATH, receiver.handle)
+    if serve_metrics:
+        app.router.add_get('/metrics', metrics.handle_metrics)
+    return app
+
+
+def run_receiver(config: AttrDict, allowed_updates: list[str]):
+    """
+    Runs webhook server adding updates of `allowed_updates` types to Redis Streams,
+    `guardian worker` processes handle them.
+    """
+    redis = Redis(config.redis.url)
+    receiver = UpdateReceiver(redis, config.streams.shards, config.streams.max_length)
+    bot = Bot(token=config.telegram.token, server=api_server(config.telegram))
+    secret = webhook_secret(config.telegram)
+
+    async def on_startup(_app):
+        await redis.ping()
+        await bot.set_webhook(webhook_url(config.telegram), allowed_updates=allowed_updates, secret_token=secret)
+
+    async def on_cleanup(_app):
+        # Webhook is kept, so Telegram holds updates while receiver restarts
+        await (await bot.get_session()).close()
+        await redis.close()
+        log.stop()
+
+    app = receiver_app(receiver, secret, config.metrics.enabled)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    web.run_app(app, host=config.webhook.host, port=config.webhook.port, access_log=None)
+
+
+async def wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
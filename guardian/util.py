@@ -1,6 +1,4 @@
 import math
-import asyncio
-from functools import partial
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from guardian import log
 
@@ -14,20 +12,17 @@ class AttrDict(dict):
         self.__dict__ = self
 
 
-def callback(func, *args):
-    return partial(asyncio.ensure_future, func(*args))
-
-
 def chunks(elements, n):
     for i in range(0, len(elements), n):
         yield elements[i:i + n]
 
 
-def emoji_keyboard(emoji: list, rows: int):
+def emoji_keyboard(emoji: list, rows: int, callback_data: list | None = None):
     markup = InlineKeyboardMarkup()
     row_size = math.ceil(len(emoji) / rows)
-    for row in chunks(emoji, row_size):
-        kb_row = (InlineKeyboardButton(e, callback_data=e) for e in row)
+    buttons = list(zip(emoji, callback_data or emoji))
+    for row in chunks(buttons, row_size):
+        kb_row = (InlineKeyboardButton(e, callback_data=data) for e, data in row)
         markup.row(*kb_row)
     return markup
 
@@ -48,5 +43,5 @@ def get_user_tag(user):
 
 
 def log_exception(e: Exception):
-    log.logger.error(f'{e} [{e.__class__.__name__}]')
+    log.logger.error('%s [%s]', e, e.__class__.__name__)
     pass
@@ -1,34 +1,24 @@
-import re
-from pathlib import Path
-from guardian.i18n import I18nMiddleware
+import sys
+from guardian.i18n import I18nMiddleware, find_calls, compile_catalog, check_catalog, write_catalog, CATALOG_FILE
 
 
 LIGHT_GREEN = '\033[0;92m'
+LIGHT_RED = '\033[0;91m'
 RESET = '\033[0m'
 
-
-class I18nTest():
-    def __init__(self):
-        self.paths = set()
-
-    def t(self, path: str):
-        self.paths.add(path)
-
-
-i18n = I18nTest()
-files = Path(__file__).resolve().parent.joinpath('guardian').glob('*.py')
-for f in files:
-    with open(f, 'r') as stream:
-        contents = stream.read()
-    result = re.findall(r"""i18n\.t\((?:').*?(?:')""", contents, re.MULTILINE | re.DOTALL)
-    for code in result:
-        eval(code + ')')
-
+calls = find_calls()
 translations = I18nMiddleware.load_translations()
+catalog = compile_catalog(translations)
 for lang in translations.keys():
-    for path in i18n.paths:
+    for path in calls:
         print(f'{LIGHT_GREEN}{lang}.{path}{RESET}')
-        value = translations[lang]
-        for p in path.split('.'):
-            value = value[p]
-        print(value)
+        print(catalog.get((lang, path)))
+
+errors = check_catalog(catalog, calls)
+for error in errors:
+    print(f'{LIGHT_RED}{error}{RESET}', file=sys.stderr)
+if len(errors) > 0:
+    sys.exit(1)
+
+write_catalog(catalog)
+print(f'Compiled {len(catalog)} translations to {CATALOG_FILE}')
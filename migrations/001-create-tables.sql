@@ -1,4 +1,4 @@
-CREATE TABLE settings (
+CREATE TABLE IF NOT EXISTS settings (
     chat_id INTEGER NOT NULL,
     setting_id INTEGER NOT NULL,
     value TEXT NOT NULL,
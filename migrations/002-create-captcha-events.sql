@@ -0,0 +1,19 @@
+-- Append-only log of captcha outcomes.
+CREATE TABLE IF NOT EXISTS captcha_events (
+    time INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    outcome INTEGER NOT NULL,
+    phrase TEXT NOT NULL,
+    emoji TEXT NOT NULL,
+    latency_ms INTEGER
+);
+
+-- Cover `guardian report` groupings, so it reads events in group order instead of sorting them.
+-- The bucket expression must match REPORT_QUERY in guardian/events.py, time filters by period.
+CREATE INDEX IF NOT EXISTS captcha_events_chat ON captcha_events (
+    chat_id, outcome, (CASE WHEN outcome = 1 THEN latency_ms / 100 END), time
+);
+CREATE INDEX IF NOT EXISTS captcha_events_phrase ON captcha_events (
+    phrase, outcome, (CASE WHEN outcome = 1 THEN latency_ms / 100 END), time
+);
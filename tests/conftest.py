@@ -0,0 +1,22 @@
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from guardian import log
+from guardian.redis import Redis
+
+log.init('critical')
+
+
+@pytest.fixture
+def redis(monkeypatch) -> Redis:
+    """
+    Client of a fake Redis server, other clients created by the test with `Redis(url)` share the server,
+    like bot instances sharing Redis.
+    """
+    server = FakeServer()
+
+    def create_pool(_url: str, _max_connections: int):
+        return FakeRedis(server=server, decode_responses=True).connection_pool
+
+    monkeypatch.setattr(Redis, 'create_pool', staticmethod(create_pool))
+    return Redis('redis://fake')
@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+from guardian.admins import AdminCache, admins_key
+from guardian.redis import Redis
+
+
+class FakeBot:
+    def __init__(self):
+        self.admins = {1, 2}
+        self.calls = 0
+
+    async def get_chat_administrators(self, _chat_id):
+        self.calls += 1
+        await asyncio.sleep(0.001)
+        return [SimpleNamespace(user=SimpleNamespace(id=user_id)) for user_id in self.admins]
+
+
+def test_admin_cache(redis):
+    async def run():
+        bot = FakeBot()
+        cache = AdminCache(bot, redis, ttl=60, max_size=10)
+        other = AdminCache(bot, Redis('redis://fake'), ttl=60, max_size=10)
+
+        # Concurrent checks are collapsed into one request
+        assert await asyncio.gather(*(cache.is_admin(-1, user_id) for user_id in (1, 2, 3))) == [True, True, False]
+        assert bot.calls == 1
+        # Other instance reads administrators from Redis
+        assert await other.is_admin(-1, 2)
+        assert bot.calls == 1
+
+        bot.admins = {1}
+        await cache.invalidate(-1)
+        assert not await cache.is_admin(-1, 2)
+        assert bot.calls == 2
+
+        # Entry past half of TTL is returned and refreshed in the background
+        fetched, admins = cache.cache.entries[-1]
+        cache.cache.entries[-1] = (fetched - 40, admins)
+        await cache.redis.pexpire(admins_key(-1), 20000)
+        bot.admins = {1, 3}
+        assert not await cache.is_admin(-1, 3)
+        await asyncio.sleep(0.01)
+        assert await cache.is_admin(-1, 3)
+        assert bot.calls == 3
+
+    asyncio.run(run())
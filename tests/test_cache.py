@@ -0,0 +1,36 @@
+import asyncio
+from guardian import metrics
+from guardian.cache import ChatCache
+
+
+def test_chat_cache():
+    fetches = []
+
+    async def fetch(chat_id):
+        fetches.append(chat_id)
+        await asyncio.sleep(0.001)
+        return {'chat': chat_id, 'version': len(fetches)}
+
+    async def run():
+        cache = ChatCache('test', fetch, max_size=2)
+        values = await asyncio.gather(*(cache.get_or_load(-1) for _ in range(3)))
+        assert values == [{'chat': -1, 'version': 1}] * 3 and fetches == [-1]
+        assert await cache.get_or_load(-1) == {'chat': -1, 'version': 1}
+        assert metrics.CACHE_REQUESTS.values[('test', 'hit')] == 1
+        assert metrics.CACHE_REQUESTS.values[('test', 'miss')] == 3
+
+        # Result of a load in progress isn't cached once the chat is changed
+        load = cache.load(-2)
+        cache.modify(-2)
+        await load
+        assert cache.get(-2) is None
+
+        # Stale values are loaded again, the least recently used chat is evicted
+        assert await cache.get_or_load(-1, lambda value: value['version'] > 1) == {'chat': -1, 'version': 3}
+        await cache.get_or_load(-2)
+        await cache.get_or_load(-3)
+        assert list(cache.entries) == [-2, -3]
+        assert metrics.CACHE_EVICTIONS.values[('test',)] == 1
+        assert metrics.CACHE_SIZE.values[('test',)] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+import time
+import asyncio
+from aiogram.types import Update, WebhookInfo
+from guardian.catchup import coalesce, fetch_backlog
+from guardian.streams import WORKERS_KEY
+
+CHAT = {'id': -100, 'type': 'supergroup', 'title': 'Chat'}
+
+
+def user(user_id: int, username: str | None = None) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': username}
+
+
+def message(update_id: int, age: float = 0, **fields) -> Update:
+    return Update(update_id=update_id, message={
+        'message_id': update_id, 'date': int(time.time() - age), 'chat': CHAT, 'from': user(1), **fields
+    })
+
+
+def test_coalesce():
+    updates = [
+        message(1, new_chat_members=[user(10), user(11)]),
+        message(2, text='hello'),
+        message(3, age=3600, new_chat_members=[user(12)]),
+        message(4, new_chat_members=[user(11)]),
+        message(5, new_chat_members=[user(13)]),
+        message(6, left_chat_member=user(13)),
+        Update(update_id=7, message={'message_id': 7, 'date': int(time.time()), 'chat': CHAT,
+                                     'from': user(777000, 'Channel_Bot'), 'sender_chat': {'id': -5, 'type': 'channel'},
+                                     'text': 'spam'}),
+    ]
+    relevant = coalesce(updates, max_age=600)
+    assert [update.update_id for update in relevant] == [1, 4, 7]
+    assert [member.id for member in relevant[0].message.new_chat_members] == [10]
+    assert [member.id for member in relevant[1].message.new_chat_members] == [11]
+
+
+class FakeBot:
+    def __init__(self, pending: int, url: str = ''):
+        self.url = url
+        self.updates = [message(i, text='hello') for i in range(1, pending + 1)]
+
+    async def get_webhook_info(self) -> WebhookInfo:
+        return WebhookInfo(url=self.url, pending_update_count=len(self.updates))
+
+    async def get_updates(self, offset: int | None, limit: int, timeout: int) -> list[Update]:
+        if offset is not None:
+            self.updates = [update for update in self.updates if update.update_id >= offset]
+        return self.updates[:limit]
+
+
+def test_fetch_backlog(redis):
+    async def run():
+        assert await fetch_backlog(FakeBot(pending=0), redis, lease=10) == []
+        # Updates are received by other instances
+        bot = FakeBot(pending=3, url='https://example.com/')
+        assert await fetch_backlog(bot, redis, lease=10) == [] and len(bot.updates) == 3
+        await redis.redis.zadd(WORKERS_KEY, {'worker': time.time() - 20})
+        bot = FakeBot(pending=150)
+        assert [update.update_id for update in await fetch_backlog(bot, redis, lease=10)] == list(range(1, 151))
+        assert bot.updates == []
+        await redis.redis.zadd(WORKERS_KEY, {'worker': time.time()})
+        assert await fetch_backlog(FakeBot(pending=3), redis, lease=10) == []
+
+    asyncio.run(run())
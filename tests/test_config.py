@@ -0,0 +1,34 @@
+from pathlib import Path
+from guardian import load_config
+from guardian.config import DEFAULTS
+
+EXAMPLE = Path(__file__).resolve().parent.parent.joinpath('config.example.yaml')
+# Settings of the example config that must be set explicitly.
+REQUIRED = {'telegram', 'redis.url', 'guardian.answer_secret'}
+
+
+def keys(d: dict, prefix: str = '') -> set[str]:
+    result = set()
+    for key, value in d.items():
+        if isinstance(value, dict) and prefix + key not in REQUIRED:
+            result |= keys(value, f'{prefix}{key}.')
+        else:
+            result.add(prefix + key)
+    return result
+
+
+def test_defaults(tmp_path):
+    config_file = tmp_path.joinpath('config.yaml')
+    config_file.write_text('telegram:\n  token: 1:X\nredis:\n  url: redis://\nguardian:\n  captcha_expire: 30\n')
+    config = load_config(config_file)
+    assert config.guardian.captcha_expire == 30
+    assert config.guardian.message_expire == DEFAULTS['guardian']['message_expire']
+    assert config.events.buffer_size == DEFAULTS['events']['buffer_size']
+    assert 'webhook_host' not in config.telegram
+
+    config.pool.size = 1
+    assert load_config(config_file).pool.size == DEFAULTS['pool']['size']
+
+
+def test_example_settings_have_defaults():
+    assert keys(load_config(EXAMPLE)) - REQUIRED <= keys(DEFAULTS)
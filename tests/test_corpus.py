@@ -0,0 +1,22 @@
+import asyncio
+from guardian.corpus import Corpus, LocalProvider
+
+
+def test_corpus_roundtrip(tmp_path):
+    corpus = Corpus(tmp_path)
+    first = corpus.add('clown', b'clown image')
+    assert corpus.add('clown', b'clown image') == first
+    corpus.add('ghost', b'ghost image')
+    corpus.add('spooky', b'ghost image')
+    corpus.save()
+
+    corpus = Corpus(tmp_path)
+    assert len(corpus) == 2
+    assert corpus.images('spooky') == corpus.images('ghost')
+    assert bytes(corpus.read(first)) == b'clown image'
+
+    provider = LocalProvider(corpus)
+    image = asyncio.run(provider.get_image('clown'))
+    assert image.key == first.hex()
+    assert bytes(image.data) == b'clown image'
+    assert asyncio.run(provider.get_image('unknown')) is None
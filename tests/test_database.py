@@ -0,0 +1,39 @@
+import asyncio
+from guardian.database import Database
+from guardian.maintenance import migrate
+
+
+def test_flush_on_close(tmp_path):
+    path = str(tmp_path.joinpath('data.db'))
+
+    async def run():
+        db = Database(path, flush_interval=0.01)
+        await db.connect()
+        await migrate(db.db)
+        await db.upsert_setting(-1, 1, 'ru')
+
+        # Close while the periodic flush is writing
+        executemany, writing, release = db.db.executemany, asyncio.Event(), asyncio.Event()
+
+        async def slow_executemany(*args):
+            writing.set()
+            await release.wait()
+            return await executemany(*args)
+
+        db.db.executemany = slow_executemany
+        await writing.wait()
+        await db.upsert_setting(-1, 2, 'en')
+        closing = asyncio.create_task(db.close())
+        await asyncio.sleep(0.05)
+        assert not closing.done()
+        release.set()
+        await closing
+
+        db = Database(path)
+        await db.connect()
+        try:
+            assert [tuple(row) for row in await db.select_settings()] == [(-1, 1, 'ru'), (-1, 2, 'en')]
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+import time
+import asyncio
+from aiogram import Bot
+from aiogram.types import Update
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from guardian.dispatcher import Dispatcher
+from guardian.redis import Redis
+from guardian.storage import RedisStorage
+
+TOKEN = '123456:test'
+
+
+class FormState(StatesGroup):
+    name = State()
+    value = State()
+
+
+def message(chat_id: int, text: str) -> Update:
+    return Update(update_id=1, message={
+        'message_id': 1, 'date': int(time.time()), 'text': text,
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'User'},
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Chat'}
+    })
+
+
+def test_fast_path(redis):
+    async def run():
+        storage = RedisStorage(redis, ttl=60)
+        handled = []
+        dp = Dispatcher(Bot(TOKEN), storage=storage, is_relevant=lambda u: storage.is_waiting(u.message.chat.id))
+
+        async def handle(m):
+            handled.append(m.chat.id)
+
+        dp.register_message_handler(handle, state=FormState.value)
+        dp.register_callback_query_handler(handle, state=FormState.name)
+        assert sorted(dp.allowed_updates()) == ['callback_query', 'message']
+        assert dp.message_states() == {FormState.value.state}
+        storage.watch(dp.message_states())
+
+        await storage.set_state(chat=-1, user=1, state=FormState.name)
+        await dp.process_update(message(-1, 'skipped'))
+        assert not storage.is_waiting(-1)
+        await storage.set_state(chat=-1, user=1, state=FormState.value)
+        await dp.process_update(message(-1, 'handled'))
+        assert handled == [-1]
+
+        # Other instances learn about waiting users from Redis
+        other = RedisStorage(Redis('redis://fake'), ttl=60)
+        await other.load_waiting()
+        assert other.is_waiting(-1)
+        await storage.reset_state(chat=-1, user=1)
+        assert not storage.is_waiting(-1)
+        await other.load_waiting()
+        assert not other.is_waiting(-1)
+        await (await dp.bot.get_session()).close()
+
+    asyncio.run(run())
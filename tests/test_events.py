@@ -0,0 +1,118 @@
+import time
+import asyncio
+import pytest
+from guardian.database import Database
+from guardian.events import CaptchaEvents, report, SHOWN, CORRECT, WRONG, TIMEOUT, \
+    REPORT_QUERY, REPORT_KEYS, LATENCY_BUCKET_MS
+from guardian.maintenance import migrate
+
+
+def test_events_report(tmp_path):
+    async def run():
+        db = Database(str(tmp_path.joinpath('data.db')))
+        await db.connect()
+        await migrate(db.db)
+        events = CaptchaEvents(db, size=6, flush_interval=60)
+        now = time.time()
+        # The oldest event is dropped from the full buffer
+        events.record(-1, 1, SHOWN, 'lost', '😎')
+        for user_id, outcome, seconds in ((3, WRONG, 5), (4, TIMEOUT, 60)):
+            events.record(-1, user_id, SHOWN, 'cowboy', '🤠🐴')
+            events.record(-1, user_id, outcome, 'cowboy', '🤠🐴', now - seconds)
+        events.record(-2, 1, SHOWN, 'cowboy', '🤠🐴')
+        events.record(-2, 1, CORRECT, 'cowboy', '🤠🐴', now - 0.5)
+        # Captchas shown before upgrade have no phrase
+        events.record(-2, 2, CORRECT, None, None, now)
+        await events.flush()
+
+        stats = await report(db, 'query', days=1, fast=2)
+        assert [s['key'] for s in stats] == ['cowboy']
+        assert {k: stats[0][k] for k in ('shown', 'correct', 'wrong', 'timeout')} == \
+               {'shown': 3, 'correct': 1, 'wrong': 1, 'timeout': 1}
+        assert stats[0]['p50'] == 0.6
+        assert stats[0]['fast_rate'] == 1
+        assert [(s['key'], s['solve_rate']) for s in await report(db, 'chat', days=1, fast=2)] == \
+               [(-1, 0.0), (-2, 1.0)]
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_report_uses_indexes(tmp_path):
+    async def run():
+        db = Database(str(tmp_path.joinpath('data.db')))
+        await db.connect()
+        await migrate(db.db)
+        for key in REPORT_KEYS.values():
+            query = REPORT_QUERY.format(key=key, bucket=LATENCY_BUCKET_MS)
+            async with db.db.execute('EXPLAIN QUERY PLAN ' + query, (0,)) as cursor:
+                plan = ' '.join(row[-1] for row in await cursor.fetchall())
+            assert 'USING COVERING INDEX' in plan or 'USING INDEX' in plan
+            assert 'TEMP B-TREE' not in plan
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_failed_flush_keeps_events(tmp_path):
+    async def run():
+        db = Database(str(tmp_path.joinpath('data.db')))
+        await db.connect()
+        events = CaptchaEvents(db, size=3, flush_interval=60)
+        for user_id in range(2):
+            events.record(-1, user_id, SHOWN, 'cowboy', '🤠🐴')
+        # No captcha_events table before migration
+        with pytest.raises(Exception):
+            await events.flush()
+        events.record(-1, 2, SHOWN, 'cowboy', '🤠🐴')
+        assert [e[2] for e in events.events] == [0, 1, 2]
+
+        await migrate(db.db)
+        await events.flush()
+        async with db.db.execute('SELECT COUNT(*) FROM captcha_events') as cursor:
+            assert (await cursor.fetchone())[0] == 3
+        await db.close()
+
+    asyncio.run(run())
+
+
+def test_events_transaction(tmp_path):
+    async def run():
+        db = Database(str(tmp_path.joinpath('data.db')), flush_interval=60)
+        await db.connect()
+        await migrate(db.db)
+        events = CaptchaEvents(db, size=10, flush_interval=60)
+        events.start()
+        await db.upsert_setting(-1, 1, 'ru')
+        events.record(-1, 1, SHOWN, 'cowboy', '🤠🐴')
+
+        # Settings flush waits for events transaction, so they don't share its rollback
+        executemany, writing, release = db.db.executemany, asyncio.Event(), asyncio.Event()
+
+        async def failing_executemany(*args):
+            await executemany(*args)
+            writing.set()
+            await release.wait()
+            raise ValueError('disk is full')
+
+        db.db.executemany = failing_executemany
+        flush = asyncio.create_task(events.flush())
+        await writing.wait()
+        db.db.executemany = executemany
+        settings = asyncio.create_task(db.flush())
+        await asyncio.sleep(0.01)
+        release.set()
+        with pytest.raises(ValueError):
+            await flush
+        await settings
+
+        # Events are flushed on close
+        await db.close()
+        db = Database(str(tmp_path.joinpath('data.db')))
+        await db.connect()
+        assert [tuple(row) for row in await db.select_settings()] == [(-1, 1, 'ru')]
+        async with db.db.execute('SELECT COUNT(*) FROM captcha_events') as cursor:
+            assert (await cursor.fetchone())[0] == 1
+        await db.close()
+
+    asyncio.run(run())
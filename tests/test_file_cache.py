@@ -0,0 +1,27 @@
+import asyncio
+from guardian import file_cache
+from guardian.file_cache import FileIdCache, FILES_KEY, LRU_KEY
+
+
+def test_lru_eviction(monkeypatch, redis):
+    clock = iter(range(1000))
+    monkeypatch.setattr(file_cache.time, 'time', lambda: next(clock))
+
+    async def run():
+        cache = FileIdCache(redis, max_size=2)
+        await cache.put('cowboy', 'a.jpg', 'A')
+        await cache.put('cowboy', 'b.jpg', 'B')
+        assert await cache.get('cowboy', 'a.jpg') == 'A'
+        await cache.put('cowboy', 'c.jpg', 'C')
+        # b.jpg was used least recently
+        assert await cache.get('cowboy', 'b.jpg') is None
+        assert await cache.get('cowboy', 'a.jpg') == 'A'
+        assert await cache.get('cowboy', 'c.jpg') == 'C'
+        # A miss doesn't add the image to LRU index
+        assert await redis.redis.zcard(LRU_KEY) == 2
+
+        await cache.invalidate('cowboy', 'a.jpg')
+        assert await cache.get('cowboy', 'a.jpg') is None
+        assert await redis.redis.hlen(FILES_KEY) == await redis.redis.zcard(LRU_KEY) == 1
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from guardian import http, metrics
+from guardian.http import CircuitBreaker, HttpClient, HttpStatusError
+
+
+def test_circuit_breaker(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(http.time, 'monotonic', lambda: now)
+    breaker = CircuitBreaker(threshold=2, reset_timeout=10)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    now = 110.0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now = 120.0
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_outcomes():
+    async def run():
+        statuses = [503, 503, 200, 404]
+
+        async def handler(_request):
+            status = statuses.pop(0) if statuses else 200
+            return web.Response(status=status, text='not json', content_type='application/json')
+
+        app = web.Application()
+        app.router.add_get('/', handler)
+        async with TestServer(app) as server:
+            breaker = CircuitBreaker(threshold=2, reset_timeout=0)
+            client = HttpClient(5, 5, 1, retries=0, backoff=0, breaker=breaker)
+            url = str(server.make_url('/'))
+            failures = metrics.HTTP_REQUESTS.values.get(('failure',), 0)
+            for _ in range(2):
+                with pytest.raises(HttpStatusError):
+                    await client.get_json(url)
+            assert breaker.state == CircuitBreaker.OPEN
+            assert metrics.HTTP_BREAKER_STATE.values[()] == 2
+            assert metrics.HTTP_REQUESTS.values[('failure',)] == failures + 2
+            # Keep-alive connection is reused
+            assert metrics.HTTP_CONNECTIONS.values[('reused',)] > 0
+            # Trial with malformed response opens the breaker again instead of blocking requests forever
+            with pytest.raises(ValueError):
+                await client.get_json(url)
+            assert breaker.state == CircuitBreaker.OPEN
+            # Client errors don't count as failures
+            with pytest.raises(HttpStatusError):
+                await client.get_bytes(url)
+            assert breaker.state == CircuitBreaker.CLOSED
+
+            breaker.state = CircuitBreaker.OPEN
+            trial = asyncio.create_task(client.get_bytes(url))
+            await asyncio.sleep(0)
+            trial.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await trial
+            assert breaker.state == CircuitBreaker.OPEN
+            assert await client.get_bytes(url) == b'not json'
+            await client.close()
+
+    asyncio.run(run())
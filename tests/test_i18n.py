@@ -0,0 +1,27 @@
+from guardian.i18n import I18nMiddleware, compile_catalog, check_catalog, find_calls
+
+
+def test_catalog_is_complete():
+    catalog = compile_catalog(I18nMiddleware.load_translations())
+    assert check_catalog(catalog, find_calls()) == []
+
+
+def test_check_catalog_errors():
+    catalog = {
+        ('en', 'greeting'): 'Hello {name}',
+        ('ru', 'greeting'): 'Привет',
+        ('en', 'bye'): 'Bye',
+    }
+    errors = check_catalog(catalog, {'greeting': {'user'}})
+    assert 'Missing translation for path "bye" with locale "ru"' in errors
+    assert 'Placeholders [\'name\'] of "en.greeting" are not passed to i18n.t()' in errors
+    assert 'Translations for path "greeting" have different placeholders' in errors
+
+
+def test_find_calls(tmp_path):
+    tmp_path.joinpath('handlers.py').write_text(
+        "i18n.t('greeting', name=name)\n"
+        "self.i18n.t('bye', user_tag=tag)\n"
+        "other.t('ignored', x=1)\n"
+    )
+    assert find_calls(tmp_path) == {'greeting': {'name'}, 'bye': {'user_tag'}}
@@ -0,0 +1,94 @@
+import time
+import asyncio
+from aiogram.types import Update
+from guardian.inbound import ChatExecutor, lend_slot
+
+USER = {'id': 1, 'is_bot': False, 'first_name': 'User'}
+
+
+def update(update_id: int, chat_id: int, **fields) -> Update:
+    return Update(update_id=update_id, message={
+        'message_id': update_id, 'date': int(time.time()), 'from': USER,
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Chat'}, **fields
+    })
+
+
+def test_chat_order():
+    handled, running = [], set()
+
+    async def process(u):
+        chat_id = u.message.chat.id
+        assert chat_id not in running
+        running.add(chat_id)
+        await asyncio.sleep(0.001)
+        running.discard(chat_id)
+        handled.append((chat_id, u.update_id))
+        return u.update_id
+
+    async def run():
+        executor = ChatExecutor(concurrency=2, queue_size=100, overflow='low_priority')
+        results = await asyncio.gather(*(executor.submit(update(i, i % 3), process) for i in range(30)))
+        assert results == list(range(30))
+        assert executor.queues == {}
+
+    asyncio.run(run())
+    for chat_id in range(3):
+        assert [i for c, i in handled if c == chat_id] == list(range(chat_id, 30, 3))
+
+
+def test_overflow():
+    async def process(u):
+        await asyncio.sleep(0.01)
+        return u.update_id
+
+    async def run(overflow):
+        executor = ChatExecutor(concurrency=10, queue_size=2, overflow=overflow)
+        updates = [
+            update(1, 1, text='first'),
+            update(2, 1, left_chat_member=USER),
+            update(3, 1, new_chat_members=[USER]),
+            update(4, 1, new_chat_members=[USER]),
+        ]
+        return await asyncio.gather(*(executor.submit(u, process) for u in updates))
+
+    assert asyncio.run(run('low_priority')) == [1, None, 3, 4]
+    assert asyncio.run(run('oldest')) == [1, None, 3, 4]
+    assert asyncio.run(run('newest')) == [1, 2, 3, None]
+
+
+def test_lend_slot():
+    handled, spawned, sent = [], [], asyncio.Event()
+
+    async def send():
+        async with lend_slot():
+            await sent.wait()
+
+    async def process(u):
+        if u.update_id == 1:
+            # E.g. waiting for outbound rate limits
+            await send()
+        elif u.update_id == 4:
+            # Spawned request outlives the handler and its turn
+            spawned.append(asyncio.create_task(send()))
+        handled.append(u.update_id)
+
+    async def run():
+        executor = ChatExecutor(concurrency=1, queue_size=100, overflow='low_priority')
+        first = asyncio.create_task(executor.submit(update(1, 1), process))
+        await asyncio.sleep(0)
+        # The slot is lent to the other chat, the next update of the same chat waits for its turn
+        same_chat = asyncio.create_task(executor.submit(update(2, 1), process))
+        await executor.submit(update(3, 2), process)
+        assert handled == [3]
+        sent.set()
+        await asyncio.gather(first, same_chat)
+        assert handled == [3, 1, 2]
+        assert executor.queues == {} and not executor.semaphore.locked()
+
+        sent.clear()
+        await executor.submit(update(4, 1), process)
+        sent.set()
+        await spawned[0]
+        assert not executor.semaphore.locked()
+
+    asyncio.run(run())
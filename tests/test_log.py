@@ -0,0 +1,38 @@
+import json
+import logging
+from guardian import log
+from guardian.log import RateLimitFilter
+
+
+def make_record(level, msg, *args):
+    return logging.LogRecord('guardian', level, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_filter():
+    rate_limit = RateLimitFilter(2)
+    passed = [rate_limit.filter(make_record(logging.INFO, 'Ignoring %s', i)) for i in range(4)]
+    assert passed == [True, True, False, False]
+    assert rate_limit.filter(make_record(logging.INFO, 'Other %s', 1))
+    assert rate_limit.filter(make_record(logging.ERROR, 'Ignoring %s', 5))
+
+    rate_limit.second -= 1
+    record = make_record(logging.INFO, 'Ignoring %s', 6)
+    assert rate_limit.filter(record)
+    assert record.getMessage() == 'Ignoring 6 (2 similar message(s) suppressed)'
+
+
+def test_json_queue_keeps_exception(capsys):
+    lgr = log.init('error', 'json', use_queue=True)
+    handler = lgr.handlers[-1]
+    try:
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            lgr.exception('boom')
+    finally:
+        log.stop()
+        lgr.removeHandler(handler)
+        lgr.setLevel(logging.CRITICAL)
+    entry = json.loads(capsys.readouterr().err.splitlines()[-1])
+    assert entry['message'] == 'boom'
+    assert 'ZeroDivisionError' in entry['exception']
@@ -0,0 +1,35 @@
+import io
+import asyncio
+from guardian.maintenance import connect, migrate, schema_version, import_settings, export_settings, migrations
+
+
+def test_import_export(tmp_path):
+    async def run():
+        db = await connect(str(tmp_path.joinpath('data.db')))
+        try:
+            latest = migrations()[-1][0]
+            assert await migrate(db) == [number for number, _ in migrations()]
+            assert await migrate(db) == []
+            assert await schema_version(db) == latest
+
+            source = io.StringIO(
+                '{"chat_id": -1, "setting_id": 1, "value": "ru"}\n'
+                '{"chat_id": -1, "setting_id": 99, "value": "x"}\n'
+                '\n'
+                '{"chat_id": -2, "setting_id": 3, "value": "Hi, {user_tag}"}\n'
+                '{"chat_id": -1, "setting_id": 1, "value": "en"}\n'
+            )
+            stats = await import_settings(db, source, 'jsonl', chunk_size=2)
+            assert (stats['imported'], stats['skipped']) == (3, 1)
+
+            out = io.StringIO()
+            assert await export_settings(db, out, 'csv') == 2
+            assert out.getvalue().splitlines() == ['chat_id,setting_id,value', '-2,3,"Hi, {user_tag}"', '-1,1,en']
+
+            out.seek(0)
+            stats = await import_settings(db, out, 'csv', chunk_size=10)
+            assert (stats['imported'], stats['skipped']) == (2, 0)
+        finally:
+            await db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,16 @@
+import asyncio
+from guardian import metrics
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram('test_seconds', 'Test latency.', ('method',), buckets=(.1, 1))
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(.05, 'get')
+    histogram.observe(.5, 'get')
+    histogram.observe(5, 'get')
+    text = asyncio.run(histogram.render())
+    assert 'test_seconds_bucket{method="get",le="0.1"} 1\n' in text
+    assert 'test_seconds_bucket{method="get",le="1"} 2\n' in text
+    assert 'test_seconds_bucket{method="get",le="+Inf"} 3\n' in text
+    assert 'test_seconds_sum{method="get"} 5.55\n' in text
+    assert 'test_seconds_count{method="get"} 3\n' in text
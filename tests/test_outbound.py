@@ -0,0 +1,58 @@
+import io
+import asyncio
+import aiogram
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import RetryAfter
+from guardian.bot import Bot
+from guardian.outbound import OutboundQueue
+
+
+def test_priorities_and_chat_limit():
+    async def run():
+        queue = OutboundQueue(global_rate=1000, chat_rate=60, chat_burst=1)
+        order = []
+
+        async def request(method, chat_id):
+            await queue.acquire(method, chat_id)
+            order.append((method, chat_id))
+
+        # Queue is filled before the releasing task gets to run
+        await asyncio.gather(
+            request('sendMessage', 1),
+            request('deleteMessage', None),
+            request('sendMessage', 1),
+            request('sendPhoto', 2),
+            request('restrictChatMember', None),
+        )
+        await queue.stop()
+        return order
+
+    order = asyncio.run(run())
+    assert order == [('restrictChatMember', None), ('sendPhoto', 2), ('deleteMessage', None),
+                     ('sendMessage', 1), ('sendMessage', 1)]
+
+
+def test_retry_resends_files(monkeypatch):
+    sent = []
+
+    async def request(_bot, method, data=None, files=None, **_kwargs):
+        # Like aiohttp, which reads and closes every file it sends
+        file = files['photo']
+        filename, file = (file.filename, file.file) if isinstance(file, InputFile) else file
+        sent.append((method, data['chat_id'], filename, file.read()))
+        file.close()
+        if len(sent) == 1:
+            raise RetryAfter(0)
+        return {'message_id': 1}
+
+    monkeypatch.setattr(aiogram.Bot, 'request', request)
+
+    async def run():
+        queue = OutboundQueue(global_rate=1000, chat_rate=60, chat_burst=2)
+        bot = Bot('123456:test', outbound=queue)
+        photo = InputFile(io.BytesIO(b'jpeg'), filename='cowboy.jpg')
+        assert await bot.request('sendPhoto', {'chat_id': -1}, {'photo': photo}) == {'message_id': 1}
+        await queue.stop()
+
+    asyncio.run(run())
+    assert sent == [('sendPhoto', -1, 'cowboy.jpg', b'jpeg')] * 2
@@ -0,0 +1,27 @@
+import asyncio
+from guardian import pool
+from guardian.pool import CaptchaPool, Captcha
+from guardian.qna import Combination
+from guardian.images import Image
+
+
+async def fake_prepare(_provider):
+    url = 'https://example.com/clown.jpg'
+    return Captcha(Combination(('🤡', '👻'), 0, 'clown'), Image(url, url=url), None)
+
+
+def test_pop_respects_max_uses(monkeypatch):
+    monkeypatch.setattr(pool, 'prepare', fake_prepare)
+
+    async def run():
+        p = CaptchaPool(None, size=2, low_watermark=1, max_uses=2)
+        await p.fill()
+        assert len(p) == 2
+        captcha = p.captchas[0]
+        for _ in range(4):
+            await p.pop()
+        assert len(p) == 0
+        assert captcha.uses == 2
+        assert p.low.is_set()
+
+    asyncio.run(run())
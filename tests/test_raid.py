@@ -0,0 +1,50 @@
+import asyncio
+from guardian import raid
+from guardian.raid import JoinBatcher
+from guardian.i18n import I18nMiddleware
+
+
+def test_join_batcher():
+    flushed = []
+
+    async def flush(chat_id, users):
+        flushed.append((chat_id, users))
+
+    async def run():
+        batcher = JoinBatcher(flush)
+        batcher.add(1, ['a', 'b'], 0.01)
+        batcher.add(2, ['c'], 0.01)
+        batcher.add(1, ['d'], 0.01)
+        await asyncio.sleep(0.05)
+        assert sorted(flushed) == [(1, ['a', 'b', 'd']), (2, ['c'])]
+
+        flushed.clear()
+        batcher.add(1, [str(i) for i in range(raid.MAX_BATCH + 1)], 10)
+        await asyncio.sleep(0.01)
+        assert len(flushed) == 1 and len(flushed[0][1]) == raid.MAX_BATCH
+        await batcher.stop()
+        assert flushed[1] == (1, [str(raid.MAX_BATCH)])
+
+    asyncio.run(run())
+
+
+def test_stop_flushes_in_update_context():
+    i18n = I18nMiddleware(lambda _: None)
+    captions = []
+
+    async def flush(chat_id, users):
+        captions.append(i18n.t('captcha.shared_caption', user_tags=', '.join(users), expire=60))
+
+    async def add(batcher, locale):
+        # Handler of the update which started the batch
+        i18n.ctx_locale.set(locale)
+        batcher.add(1, ['a'], 10)
+
+    async def run():
+        batcher = JoinBatcher(flush)
+        await asyncio.create_task(add(batcher, 'ru'))
+        assert i18n.ctx_locale.get() is None
+        await batcher.stop()
+
+    asyncio.run(run())
+    assert captions == [i18n.t('captcha.shared_caption', 'ru', user_tags='a', expire=60)]
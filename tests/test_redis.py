@@ -0,0 +1,108 @@
+import asyncio
+import argparse
+from redis.crc import key_slot
+from guardian import redis as guardian_redis
+from guardian.redis import LEGACY_IGNORE_KEY, ignore_key, run_ignore_stats
+from guardian.util import AttrDict
+
+
+def test_ignore(monkeypatch, redis):
+    now = 1000.0
+    monkeypatch.setattr(guardian_redis.time, 'time', lambda: now)
+
+    async def run():
+        nonlocal now
+        assert await redis.try_ignore(-1, 1, duration=60)
+        assert not await redis.try_ignore(-1, 1, duration=60)
+        assert await redis.try_ignore(-2, 1, duration=60)
+        assert await redis.try_ignore_many(-1, [1, 2, 2], duration=60) == [False, True, False]
+
+        await redis.unignore(-1, 2)
+        assert await redis.try_ignore(-1, 2, duration=60)
+
+        now += 61
+        assert await redis.try_ignore_many(-1, [1, 3], duration=30) == [True, True]
+        # Users ignored before expire along with the key, expired ones are pruned
+        assert await redis.redis.zrange(ignore_key(-1), 0, -1) == ['1', '3']
+        assert 0 < await redis.redis.ttl(ignore_key(-1)) <= 30
+
+    asyncio.run(run())
+
+
+def test_migrate_legacy_ignores(monkeypatch, redis):
+    now = 1000.0
+    monkeypatch.setattr(guardian_redis.time, 'time', lambda: now)
+
+    async def run():
+        await redis.redis.zadd(LEGACY_IGNORE_KEY, {'-1:1': now + 100, '-1:2': now - 1, '-2:1': now + 50})
+        await redis.redis.zadd(ignore_key(-1), {'1': now + 200})
+        await redis.redis.expireat(ignore_key(-1), int(now + 200))
+
+        assert await redis.migrate_legacy_ignores(batch=2) == 2
+        assert await redis.redis.exists(LEGACY_IGNORE_KEY) == 0
+        # Later expirations are kept
+        assert await redis.redis.zscore(ignore_key(-1), '1') == now + 200
+        assert await redis.redis.zscore(ignore_key(-1), '2') is None
+        assert await redis.redis.zscore(ignore_key(-2), '1') == now + 50
+
+    asyncio.run(run())
+
+
+def test_expireat_gt(redis):
+    async def run():
+        now = 1000
+        await redis.redis.set('persistent', 1)
+        await redis.redis.set('expiring', 1, ex=100)
+        # Keys without expiration get one, expiration is only moved forward
+        assert await redis.expireat_gt(keys=['persistent'], args=[now + 50, now]) == 1
+        assert await redis.expireat_gt(keys=['expiring'], args=[now + 50, now]) == 0
+        assert await redis.expireat_gt(keys=['expiring'], args=[now + 200, now]) == 1
+        assert await redis.expireat_gt(keys=['missing'], args=[now + 200, now]) == 0
+
+    asyncio.run(run())
+
+
+def test_track_joins(monkeypatch, redis):
+    now = 6000.0
+    monkeypatch.setattr(guardian_redis.time, 'time', lambda: now)
+
+    async def run():
+        nonlocal now
+        assert not await redis.track_joins(-1, 5, threshold=10)
+        assert await redis.track_joins(-1, 5, threshold=10)
+        # Keys of a chat share a hash tag, so the script works on Redis Cluster
+        assert {key_slot(key.encode()) for key in await redis.redis.keys('*')} == {key_slot(b'-1')}
+
+        # Raid mode stays on until the rate drops below half of the threshold
+        now += 40
+        assert await redis.track_joins(-1, 0, threshold=10)
+        now += 50
+        assert await redis.track_joins(-1, 0, threshold=10)
+        now += 20
+        assert not await redis.track_joins(-1, 0, threshold=10)
+        assert not await redis.track_joins(-1, 100, threshold=0)
+
+    asyncio.run(run())
+
+
+def test_ignore_stats(monkeypatch, capsys, redis):
+    now = 1000.0
+    monkeypatch.setattr(guardian_redis.time, 'time', lambda: now)
+
+    async def run():
+        nonlocal now
+        assert await redis.ignore_stats() == {}
+        await redis.try_ignore_many(-1, [1, 2], duration=60)
+        await redis.try_ignore(-2, 1, duration=30)
+        await redis.try_ignore(-3, 1, duration=90)
+        now += 45
+        # Fake server lacks MEMORY USAGE like Redis with the command disabled, chat -2 key has expired
+        assert await redis.ignore_stats() == {-1: (2, None), -3: (1, None)}
+
+        config = AttrDict({'redis': {'url': 'redis://fake'}})
+        assert await run_ignore_stats(config, argparse.Namespace(limit=1)) == 0
+        out, err = capsys.readouterr()
+        assert out.splitlines()[1:] == [f'{-1:<24}{2:>10}{"-":>12}']
+        assert err.startswith('3 ignored user(s) in 2 chat(s)')
+
+    asyncio.run(run())
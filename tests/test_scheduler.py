@@ -0,0 +1,66 @@
+import asyncio
+from guardian import scheduler
+from guardian.scheduler import Scheduler, JOBS_KEY, PAYLOADS_KEY
+
+
+def test_claim_and_lease(monkeypatch, redis):
+    now = 1000.0
+    monkeypatch.setattr(scheduler.time, 'time', lambda: now)
+
+    async def run():
+        nonlocal now
+        executed = []
+
+        async def handler(n):
+            executed.append(n)
+
+        first, second = Scheduler(redis, 1, batch=2, lease=30), Scheduler(redis, 1, batch=2, lease=30)
+        for s in first, second:
+            s.register('job', handler)
+        for n in range(3):
+            await first.schedule('job', 0, job_id=f'due{n}', n=n)
+        await first.schedule('job', 60, job_id='later', n=-1)
+
+        # A batch at a time, claimed jobs are leased and not claimed again
+        claimed = await first.claim(keys=[JOBS_KEY, PAYLOADS_KEY], args=[now, first.batch, first.lease])
+        assert claimed[::2] == ['due0', 'due1']
+        assert await second.poll() == 1
+        await asyncio.gather(*second.running)
+        assert executed == [2]
+        assert await second.poll() == 0
+
+        # Jobs of an instance that died are executed by others once the lease expires
+        now += 31
+        assert await second.poll() == 2
+        await asyncio.gather(*second.running)
+        assert sorted(executed) == [0, 1, 2]
+        assert await second.pending() == 1
+
+        now += 30
+        assert await first.poll() == 1
+        await asyncio.gather(*first.running)
+        assert executed[-1] == -1
+        assert await redis.redis.hlen(PAYLOADS_KEY) == 0
+
+    asyncio.run(run())
+
+
+def test_cancel_and_pop(redis):
+    async def run():
+        s = Scheduler(redis, 1, batch=10, lease=30)
+        await s.schedule('job', 60, job_id='a', chat_id=1)
+        await s.schedule('job', 60, job_id='b', chat_id=2, phrase='cowboy')
+        assert await s.cancel('a')
+        assert not await s.cancel('a')
+        assert await s.pop('b') == {'chat_id': 2, 'phrase': 'cowboy'}
+        assert await s.pop('b') is None
+        assert await s.pending() == 0
+
+        # Jobs without payload and jobs without handler are dropped
+        await redis.redis.zadd(JOBS_KEY, {'orphan': 0})
+        await s.schedule('unknown', 0, job_id='c')
+        assert await s.poll() == 1
+        await asyncio.gather(*s.running)
+        assert await s.pending() == 0
+
+    asyncio.run(run())
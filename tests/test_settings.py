@@ -0,0 +1,58 @@
+import asyncio
+from guardian.redis import Redis
+from guardian.settings import Settings, Setting, CHANNEL
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.rows = {(-1, Setting.LANGUAGE.value): 'ru'}
+        self.selects = 0
+
+    async def select_chat_settings(self, chat_id: int) -> list[dict]:
+        self.selects += 1
+        await asyncio.sleep(0.001)
+        return [{'chat_id': c, 'setting_id': s, 'value': v} for (c, s), v in self.rows.items() if c == chat_id]
+
+    async def upsert_setting(self, chat_id: int, setting_id: int, value: str):
+        self.rows[(chat_id, setting_id)] = value
+
+
+def test_single_flight(redis):
+    async def run():
+        db = FakeDatabase()
+        settings = Settings(db, redis, max_size=1)
+        values = await asyncio.gather(*(settings.get(-1, Setting.LANGUAGE) for _ in range(5)))
+        assert values == ['ru'] * 5
+        assert db.selects == 1
+        assert await settings.get(-1, Setting.RAID_WINDOW) == Setting.RAID_WINDOW.default_value
+        assert db.selects == 1
+
+        # The least recently used chat is evicted
+        assert await settings.get(-2, Setting.LANGUAGE) is None
+        await settings.get(-1, Setting.LANGUAGE)
+        assert db.selects == 3
+
+    asyncio.run(run())
+
+
+def test_invalidation(redis):
+    async def run():
+        db = FakeDatabase()
+        settings, other = Settings(db, redis, max_size=10), Settings(db, Redis('redis://fake'), max_size=10)
+        other.start()
+        assert await other.get(-1, Setting.RAID_THRESHOLD) == Setting.RAID_THRESHOLD.default_value
+        await asyncio.sleep(0.05)
+
+        # Malformed messages don't stop the listener
+        for message in ('not json', '[1, 2]', '["x", -1, 99, "1"]', '["x", -1, 4, "abc"]'):
+            await redis.redis.publish(CHANNEL, message)
+        await settings.set(-1, Setting.RAID_THRESHOLD, '50')
+        for _ in range(100):
+            if await other.get(-1, Setting.RAID_THRESHOLD) == 50:
+                break
+            await asyncio.sleep(0.01)
+        assert await other.get(-1, Setting.RAID_THRESHOLD) == 50
+        assert not other.cache.task.done()
+        await other.stop()
+
+    asyncio.run(run())
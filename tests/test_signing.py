@@ -0,0 +1,31 @@
+from guardian.qna import Combination
+from guardian.signing import AnswerSigner
+
+CHAT_ID = -1001234567890
+USER_ID = 1234567890
+
+
+def test_signed_keyboard():
+    signer = AnswerSigner('secret')
+    comb = Combination(['🐱', '🐶', '🐭', '🐹', '🐰', '🦊'], 2, 'cats')
+    captcha_id, keyboard = signer.keyboard(CHAT_ID, USER_ID, comb, 60)
+    tokens = [button.callback_data for row in keyboard.inline_keyboard for button in row]
+    assert len(tokens) == len(comb.emoji)
+    # See AnswerSigner docstring
+    assert all(len(token.encode()) == 32 for token in tokens)
+
+    answers = [signer.verify(token, CHAT_ID, USER_ID) for token in tokens]
+    assert [answer.correct for answer in answers] == [i == 2 for i in range(len(tokens))]
+    assert all(answer.captcha_id == captcha_id for answer in answers)
+
+    # Keyboard of another user, another chat or another bot
+    assert signer.verify(tokens[2], CHAT_ID, USER_ID + 1) is None
+    assert signer.verify(tokens[2], CHAT_ID - 1, USER_ID) is None
+    assert AnswerSigner('other').verify(tokens[2], CHAT_ID, USER_ID) is None
+
+    # Tampered or malformed data
+    tampered = tokens[0][:5] + ('A' if tokens[0][5] != 'A' else 'B') + tokens[0][6:]
+    assert signer.verify(tampered, CHAT_ID, USER_ID) is None
+    assert signer.verify(tokens[0][:-3], CHAT_ID, USER_ID) is None
+    assert signer.verify('~!', CHAT_ID, USER_ID) is None
+    assert signer.verify('🐱', CHAT_ID, USER_ID) is None
@@ -0,0 +1,81 @@
+import asyncio
+from guardian.storage import RedisStorage
+
+
+def test_state_and_data(redis):
+    async def run():
+        storage = RedisStorage(redis, ttl=60)
+        await storage.set_state(chat=1, user=2, state='Form:name')
+        await storage.update_data(chat=1, user=2, a=1)
+        await storage.update_data(chat=1, user=2, b=2)
+        assert await storage.get_state(chat=1, user=2) == 'Form:name'
+        assert await storage.get_data(chat=1, user=2) == {'a': 1, 'b': 2}
+        assert 0 < await redis.redis.ttl('fsm:1:2') <= 60
+
+        await storage.reset_state(chat=1, user=2, with_data=False)
+        assert await storage.get_state(chat=1, user=2) is None
+        assert await storage.get_data(chat=1, user=2) == {'a': 1, 'b': 2}
+        await storage.reset_state(chat=1, user=2)
+        assert await storage.get_data(chat=1, user=2, default={'c': 3}) == {'c': 3}
+        assert await redis.redis.exists('fsm:1:2') == 0
+
+    asyncio.run(run())
+
+
+def test_prefetched_data_is_not_stale(redis):
+    async def run():
+        storage = RedisStorage(redis, ttl=60)
+        await storage.set_data(chat=1, user=2, data={'a': 1})
+
+        # Data read by get_state is used by get_data called right after it, as FSMContext.proxy() does
+        hget = redis.redis.hget
+        redis.redis.hget = None
+        await storage.get_state(chat=1, user=2)
+        assert await storage.get_data(chat=1, user=2) == {'a': 1}
+        redis.redis.hget = hget
+
+        # ...but not once the task yielded to the event loop
+        await storage.get_state(chat=1, user=2)
+        await redis.redis.hset('fsm:1:2', 'data', '{"a":3}')
+        await asyncio.sleep(0)
+        assert await storage.get_data(chat=1, user=2) == {'a': 3}
+
+        await storage.get_state(chat=1, user=2)
+        await storage.update_data(chat=1, user=3, b=1)
+        assert await storage.get_data(chat=1, user=2) == {'a': 3}
+
+    asyncio.run(run())
+
+
+def test_waiting(redis):
+    async def run():
+        storage = RedisStorage(redis, ttl=60)
+        other = RedisStorage(redis, ttl=60)
+        storage.watch({'Form:name'})
+        await storage.set_state(chat=1, user=2, state='Form:name')
+        await storage.set_state(chat=3, user=4, state='Form:value')
+        assert storage.is_waiting(1) and not storage.is_waiting(3)
+
+        await other.load_waiting()
+        assert other.is_waiting(1)
+        await storage.set_state(chat=1, user=2, state=None)
+        assert not storage.is_waiting(1)
+        await other.load_waiting()
+        assert not other.is_waiting(1)
+
+    asyncio.run(run())
+
+
+def test_count_states(redis):
+    async def run():
+        storage = RedisStorage(redis, ttl=60)
+        await storage.set_state(chat=1, user=2, state='Form:name')
+        await storage.set_state(chat=1, user=3, state='Form:name')
+        await storage.set_data(chat=1, user=4, data={'a': 1})
+        assert await storage.count_states() == 2
+
+        await storage.set_state(chat=1, user=2, state=None)
+        await storage.reset_state(chat=1, user=3, with_data=False)
+        assert await storage.count_states() == 0
+
+    asyncio.run(run())
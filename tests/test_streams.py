@@ -0,0 +1,112 @@
+import json
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+from guardian import streams
+from guardian.bot import SECRET_TOKEN_HEADER
+from guardian.redis import Redis
+from guardian.streams import StreamWorker, UpdateReceiver, receiver_app, update_chat_id, stream_key
+
+SHARDS = 4
+
+
+def test_update_chat_id():
+    chat = {'id': -100, 'type': 'supergroup'}
+    user = {'id': 5, 'is_bot': False, 'first_name': 'User'}
+    assert update_chat_id({'update_id': 1, 'message': {'chat': chat, 'from': user}}) == -100
+    assert update_chat_id({'update_id': 1, 'callback_query': {'from': user, 'message': {'chat': chat}}}) == -100
+    assert update_chat_id({'update_id': 1, 'inline_query': {'from': user}}) == 5
+
+
+def test_workers_keep_chat_order(monkeypatch, redis):
+    monkeypatch.setattr(streams, 'READ_BLOCK', 50)
+    monkeypatch.setattr(streams, 'RETRY_DELAY', 0)
+    processed = {}
+
+    async def process(update):
+        chat_id, seq = update['chat'], update['seq']
+        if seq == 7 and chat_id == 3:
+            raise ValueError('poison')
+        await asyncio.sleep(0.001)
+        processed.setdefault(chat_id, []).append(seq)
+
+    async def run():
+        workers = [StreamWorker(Redis('redis://fake'), process, SHARDS, 10, 2, 0.3) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for seq in range(50):
+            for chat_id in range(6):
+                update = json.dumps({'update_id': seq, 'chat': chat_id, 'seq': seq})
+                await redis.redis.xadd(stream_key(chat_id % SHARDS), {'chat_id': chat_id, 'update': update})
+            await asyncio.sleep(0.01)
+        for _ in range(100):
+            if sum(map(len, processed.values())) == 50 * 6 - 1:
+                break
+            await asyncio.sleep(0.05)
+        for worker in workers:
+            await worker.stop()
+        dead = await redis.redis.xrange(streams.DEAD_LETTER_KEY)
+        return workers, dead
+
+    workers, dead = asyncio.run(run())
+    assert processed == {chat_id: [seq for seq in range(50) if (chat_id, seq) != (3, 7)] for chat_id in range(6)}
+    assert len(dead) == 1 and json.loads(dead[0][1]['update'])['seq'] == 7
+    assert all(len(worker.consumers) == 0 for worker in workers)
+
+
+def test_slow_chat_doesnt_hold_back_others(monkeypatch, redis):
+    monkeypatch.setattr(streams, 'READ_BLOCK', 50)
+    processed, unblock = [], asyncio.Event()
+
+    async def process(update):
+        if update['chat'] == 1:
+            await unblock.wait()
+        processed.append((update['chat'], update['seq']))
+
+    async def add(chat_id, seq):
+        update = json.dumps({'update_id': seq, 'chat': chat_id, 'seq': seq})
+        await redis.redis.xadd(stream_key(0), {'chat_id': chat_id, 'update': update})
+
+    async def wait_for(count):
+        for _ in range(100):
+            if len(processed) == count:
+                break
+            await asyncio.sleep(0.01)
+
+    async def run():
+        worker = StreamWorker(Redis('redis://fake'), process, 1, 10, 2, 0.3)
+        worker.start()
+        for seq in range(3):
+            await add(1, seq)
+            await add(2, seq)
+        await wait_for(3)
+        # Entries read while chat 1 is busy are processed too
+        await add(2, 3)
+        await wait_for(4)
+        assert processed == [(2, 0), (2, 1), (2, 2), (2, 3)]
+        # Entries of chat 2 are acknowledged, so they aren't delivered again after a crash
+        assert (await redis.redis.xpending(stream_key(0), streams.GROUP))['pending'] == 3
+        unblock.set()
+        await wait_for(7)
+        await worker.stop()
+        assert processed[4:] == [(1, 0), (1, 1), (1, 2)]
+        assert (await redis.redis.xpending(stream_key(0), streams.GROUP))['pending'] == 0
+
+    asyncio.run(run())
+
+
+def test_receiver_checks_secret_token(redis):
+    update = {'update_id': 1, 'message': {'chat': {'id': -100, 'type': 'supergroup'}}}
+
+    async def run():
+        app = receiver_app(UpdateReceiver(redis, SHARDS, 100), 'secret', serve_metrics=True)
+        async with TestClient(TestServer(app)) as client:
+            assert (await client.post('/', json=update)).status == 403
+            headers = {SECRET_TOKEN_HEADER: 'wrong'}
+            assert (await client.post('/', json=update, headers=headers)).status == 403
+            headers = {SECRET_TOKEN_HEADER: 'secret'}
+            assert (await client.post('/other', json=update, headers=headers)).status == 404
+            assert (await client.post('/', json=update, headers=headers)).status == 200
+            assert (await client.get('/metrics')).status == 200
+        assert await redis.redis.xlen(stream_key(-100 % SHARDS)) == 1
+
+    asyncio.run(run())